@@ -0,0 +1,114 @@
+"""
+Benchmark of the offset-based chunker against the string-rebuilding read_and_split_text it replaced.
+
+    python benchmarks/chunker_benchmark.py --pdf big.pdf [--pdf other.pdf]
+    python benchmarks/chunker_benchmark.py [--pages 1000] [--page-chars 3000] [--repeat 3]
+
+Run from RAG_backend. Without --pdf, 1000 synthetic pages of PDF-like text are generated. Each document
+is also chunked as a single page, the shape TXT and CSV files had before they were streamed, where the
+old chunker is quadratic. Both chunkers must produce the same chunk texts; the page ranges are
+reported as differing where the old one only knew the pages added since its previous chunk.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohere_app.Chunking_UI.file_process import clean_chunk, iter_chunks, extract_text_pdf
+
+
+def previous_read_and_split_text(text_by_page, chunk_size=800, overlap_size=200):
+    chunks = []
+    current_text = ""
+    current_pages = []
+
+    for page_num, text in text_by_page:
+        cleaned_para = clean_chunk(text)
+        if not cleaned_para:
+            continue
+
+        current_text += cleaned_para + " "
+        if not current_pages or current_pages[-1] != page_num:
+            current_pages.append(page_num)
+
+        while len(current_text) >= chunk_size:
+            chunk = current_text[:chunk_size]
+
+            if len(current_text) > chunk_size and current_text[chunk_size] == '.':
+                chunk = current_text[:chunk_size+1]
+            elif not chunk.rstrip().endswith('.'):
+                period_index = current_text.find('.', chunk_size)
+                if period_index != -1:
+                    chunk = current_text[:period_index + 1]
+
+            chunk = chunk.strip()
+            if chunk:
+                chunks.append((chunk, current_pages[0], current_pages[-1]))
+
+            current_text = current_text[len(chunk) - overlap_size:].strip()
+            current_pages = [page_num]
+
+    if current_text.strip():
+        chunks.append((current_text.strip(), current_pages[0], current_pages[-1]))
+    return chunks
+
+
+def synthetic_pages(pages, page_chars, seed):
+    rng = random.Random(seed)
+    words = ["pressure", "valve", "assembly", "inspection", "hull", "section", "procedure", "torque",
+             "clearance", "drawing", "revision", "weld", "specification", "tolerance", "panel", "unit"]
+    text_by_page = []
+    for page_num in range(pages):
+        lines, size = [], 0
+        while size < page_chars:
+            line = " ".join(rng.choice(words) for _ in range(rng.randint(2, 14)))
+            line += "." if rng.random() < 0.3 else ""
+            lines.append(line)
+            size += len(line) + 1
+        text_by_page.append((page_num, "\n".join(lines)))
+    return text_by_page
+
+
+def timed(function, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started_at)
+    return best, result
+
+
+def compare(label, text_by_page, repeat):
+    previous_time, previous = timed(lambda: previous_read_and_split_text(text_by_page), repeat)
+    offset_time, chunks = timed(lambda: list(iter_chunks(text_by_page)), repeat)
+    if [chunk for chunk, _, _ in previous] != [chunk for chunk, _, _ in chunks]:
+        raise SystemExit(f"{label}: chunk texts differ")
+    differing_pages = sum(a[1:] != b[1:] for a, b in zip(previous, chunks))
+    clean_time, _ = timed(lambda: [clean_chunk(text) for _, text in text_by_page], repeat)
+    print(f"{label}: {len(chunks)} chunks, previous {previous_time * 1000:.1f} ms, offset {offset_time * 1000:.1f} ms "
+          f"({previous_time / offset_time:.1f}x), of which clean_chunk {clean_time * 1000:.1f} ms; "
+          f"page ranges corrected on {differing_pages} chunks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", action="append", default=[])
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--page-chars", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    documents = [(path, extract_text_pdf(path)[0]) for path in args.pdf]
+    if not documents:
+        documents = [(f"{args.pages} synthetic pages", synthetic_pages(args.pages, args.page_chars, args.seed))]
+    for label, text_by_page in documents:
+        compare(f"{label}, by page", text_by_page, args.repeat)
+        compare(f"{label}, as one page", [(1, "\n".join(text for _, text in text_by_page))], args.repeat)
+
+
+if __name__ == "__main__":
+    main()
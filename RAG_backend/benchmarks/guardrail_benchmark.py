@@ -0,0 +1,96 @@
+"""
+Micro-benchmark of the compiled guardrail engine against the per-pattern loops it replaced.
+
+    python benchmarks/guardrail_benchmark.py [--queries 20000] [--repeat 5]
+
+Run from RAG_backend. Both implementations are checked to reach the same decision on every query.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohere_app.guardrail_engine import GuardrailEngine, FORBIDDEN_REGEX_PATTERNS, NEUTRAL_POSITIVE_TERMS
+
+
+def contains_forbidden_regex(user_input):
+    for pattern in FORBIDDEN_REGEX_PATTERNS:
+        if re.search(pattern, user_input, flags=re.IGNORECASE):
+            return True
+    return False
+
+
+def contains_positive_lnt_terms(user_input):
+    for term in NEUTRAL_POSITIVE_TERMS:
+        if term.lower() in user_input.lower():
+            return True
+    return False
+
+
+def legacy_check(user_input):
+    if contains_positive_lnt_terms(user_input):
+        return "allow"
+    if contains_forbidden_regex(user_input):
+        return "block"
+    return None
+
+
+WORDS = (
+    "what is the maintenance schedule for pump assembly valve pressure rating of the boiler "
+    "explain procedure safety manual section clause drawing revision tender document steel grade "
+    "welding specification torque inspection report"
+).split()
+TRIGGERS = ["kill", "Murder", "assassination", "political", "fraud", "Larsen and Toubro",
+            "L&T growth", "CEO of L&T", "hate", "protest"]
+
+
+def make_queries(count, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 30))]
+        # Most real queries hit no rule at all, which is also the slowest case for the loops
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(TRIGGERS))
+        queries.append(" ".join(words))
+    return queries
+
+
+def best_of(repeat, fn, queries):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for query in queries:
+            fn(query)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries)
+    engine = GuardrailEngine(rules_file="")
+
+    mismatches = [q for q in queries if legacy_check(q) != engine.check(q).action]
+    if mismatches:
+        print(f"{len(mismatches)} queries decided differently, e.g. {mismatches[0]!r}")
+        sys.exit(1)
+
+    legacy = best_of(args.repeat, legacy_check, queries)
+    compiled = best_of(args.repeat, engine.check, queries)
+    print(f"{len(queries)} queries, best of {args.repeat}")
+    print(f"per-pattern loops : {legacy * 1e6 / len(queries):8.2f} us/query")
+    print(f"compiled engine   : {compiled * 1e6 / len(queries):8.2f} us/query")
+    print(f"speed-up          : {legacy / compiled:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Backfill and latency benchmark of the BM25 lexical index used by hybrid search.
+
+    python benchmarks/lexical_search_benchmark.py --backfill <milvus collection>
+    python benchmarks/lexical_search_benchmark.py [--collection <milvus collection>] [--chunks 100000] [--queries 500]
+
+Run from RAG_backend. --backfill indexes every chunk already stored in the collection (HOST/PORT from
+.env) into LEXICAL_INDEX_DIR, which collections ingested before the index existed need. Otherwise
+queries made of words and identifiers taken from the chunks are searched, in the index of the given
+collection or in a temporary index of synthetic chunks, and the search latency is reported; the
+search runs in parallel with the Milvus search, so it only adds time when it is the slower of the two.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohere_app.lexical_index import LexicalIndex, lexical_index
+
+
+def milvus_collection(collection_name):
+    from dotenv import load_dotenv
+    from pymilvus import connections, Collection
+    load_dotenv()
+    connections.connect("benchmark", host=os.getenv("HOST"), port=os.getenv("PORT"))
+    return Collection(collection_name, using="benchmark")
+
+
+def synthetic_chunks(chunks, seed):
+    # Word frequencies follow Zipf's law as in real text, plus one identifier and clause number per chunk
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10))) for _ in range(20000)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    texts = []
+    for _ in range(chunks):
+        text = rng.choices(vocabulary, weights, k=110)
+        text[rng.randrange(len(text))] = f"SE-{rng.randint(1000, 9999)}"
+        text[rng.randrange(len(text))] = ".".join(str(rng.randint(1, 12)) for _ in range(4))
+        texts.append(" ".join(text))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill")
+    parser.add_argument("--collection")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.backfill:
+        started_at = time.perf_counter()
+        indexed = lexical_index.backfill(milvus_collection(args.backfill))
+        print(f"Indexed {indexed} chunks of {args.backfill} in {time.perf_counter() - started_at:.1f} s")
+        return
+
+    if args.collection:
+        index, collection_name = lexical_index, args.collection
+        if not index.exists(collection_name):
+            raise SystemExit(f"No lexical index for {collection_name}, run with --backfill first")
+        texts = [text for _, text in index._connection(collection_name).execute(
+            "SELECT rowid, text FROM chunks ORDER BY random() LIMIT ?", (args.queries,))]
+    else:
+        index, collection_name = LexicalIndex(tempfile.mkdtemp()), "benchmark"
+        texts = synthetic_chunks(args.chunks, args.seed)
+        started_at = time.perf_counter()
+        for start in range(0, len(texts), 5000):
+            batch = texts[start:start + 5000]
+            index.add(collection_name, range(start, start + len(batch)), ["synthetic"] * len(batch), batch)
+        print(f"Indexed {len(texts)} synthetic chunks in {time.perf_counter() - started_at:.1f} s")
+
+    rng = random.Random(args.seed)
+    queries = []
+    for _ in range(args.queries):
+        words = rng.choice(texts).split()
+        queries.append(" ".join(rng.sample(words, min(len(words), 6))))
+    for query in queries:
+        index.search(collection_name, query)
+    search = index.stats()["search"]
+    print(f"{search['count']} searches: average {search['average_ms']:.2f} ms, "
+          f"p50 {search['p50_ms']:.2f} ms, p95 {search['p95_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Throughput and retrieval drift of the int8 ONNX Runtime encoder against the fp32 torch model.
+
+    python benchmarks/onnx_embedding_benchmark.py --collection <milvus collection> [--sample 2000] [--k 10]
+    python benchmarks/onnx_embedding_benchmark.py --texts-file chunks.txt
+
+Run from RAG_backend. Chunks are sampled from a Milvus collection (HOST/PORT from .env) or read from
+a file with one chunk per line. The first words of some chunks serve as queries. Recall@k is the
+overlap of each query's top k chunks with the fp32 top k, both for an index fully re-embedded in
+int8 and for int8 queries against the existing fp32 vectors, which is what switching the query
+path alone would give.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohere_app.model_registry import embedding_model_source
+from cohere_app.onnx_embedding import load_onnx_encoder
+
+
+def sample_collection(collection_name, sample, seed):
+    from dotenv import load_dotenv
+    from pymilvus import connections, Collection
+    load_dotenv()
+    connections.connect("benchmark", host=os.getenv("HOST"), port=os.getenv("PORT"))
+    iterator = Collection(collection_name, using="benchmark").query_iterator(batch_size=1000, output_fields=["text"])
+    texts = []
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        texts.extend(row["text"] for row in batch)
+    random.Random(seed).shuffle(texts)
+    return texts[:sample]
+
+
+def read_texts(path, sample, seed):
+    with open(path, "r", encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    random.Random(seed).shuffle(texts)
+    return texts[:sample]
+
+
+def throughput(model, texts, batch_size):
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+    started_at = time.perf_counter()
+    vectors = model.encode(texts, batch_size=batch_size)
+    return np.asarray(vectors, dtype=np.float32), len(texts) / (time.perf_counter() - started_at)
+
+
+def unit(vectors):
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def top_k(queries, corpus, k):
+    return np.argsort(-(unit(queries) @ unit(corpus).T), axis=1)[:, :k]
+
+
+def recall_at_k(expected, found):
+    return float(np.mean([len(set(e) & set(f)) / len(e) for e, f in zip(expected, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument("--collection")
+    source_group.add_argument("--texts-file")
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-words", type=int, default=12)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.collection:
+        texts = sample_collection(args.collection, args.sample, args.seed)
+    else:
+        texts = read_texts(args.texts_file, args.sample, args.seed)
+    queries = [" ".join(text.split()[:args.query_words]) for text in texts[:args.queries]]
+    print(f"{len(texts)} chunks, {len(queries)} queries, k={args.k}")
+
+    from sentence_transformers import SentenceTransformer
+    source = embedding_model_source()
+    fp32 = SentenceTransformer(source, device="cpu")
+    int8 = load_onnx_encoder(source)
+
+    fp32_corpus, fp32_rate = throughput(fp32, texts, args.batch_size)
+    int8_corpus, int8_rate = throughput(int8, texts, args.batch_size)
+    fp32_queries = np.asarray(fp32.encode(queries, batch_size=args.batch_size), dtype=np.float32)
+    int8_queries = np.asarray(int8.encode(queries, batch_size=args.batch_size), dtype=np.float32)
+
+    expected = top_k(fp32_queries, fp32_corpus, args.k)
+    cosine = np.sum(unit(fp32_corpus) * unit(int8_corpus), axis=1)
+    print(f"fp32 torch      : {fp32_rate:8.1f} sentences/s")
+    print(f"int8 onnxruntime: {int8_rate:8.1f} sentences/s ({int8_rate / fp32_rate:.2f}x)")
+    print(f"cosine(fp32, int8) per chunk: mean {cosine.mean():.4f}, min {cosine.min():.4f}")
+    print(f"recall@{args.k}, int8 queries and int8 index : {recall_at_k(expected, top_k(int8_queries, int8_corpus, args.k)):.4f}")
+    print(f"recall@{args.k}, int8 queries on fp32 index  : {recall_at_k(expected, top_k(int8_queries, fp32_corpus, args.k)):.4f}")
+
+
+if __name__ == "__main__":
+    main()
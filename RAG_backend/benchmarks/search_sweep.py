@@ -0,0 +1,131 @@
+"""
+Recall and latency of collection.search for a range of HNSW ef (or IVF nprobe) values, to choose a search profile.
+
+    python benchmarks/search_sweep.py --collection <milvus collection> --queries-file questions.txt
+    python benchmarks/search_sweep.py --collection <milvus collection> --from-history [--queries 200]
+    python benchmarks/search_sweep.py ... [--ef 16,30,64,128 | --nprobe 4,8,16,32] [--k 15] [--target 0.95]
+
+Run from RAG_backend with the usual .env (HOST/PORT, and the database for --from-history, which samples
+the prompts users asked). Queries are encoded with the configured embedding model and searched one at
+a time, as the server does. Recall@k is the overlap of each search with the exact top k, found by brute
+force over every vector of the collection. Do not run it while the collection is being ingested.
+The last line is a SEARCH_PROFILES_FILE entry with the smallest value reaching --target recall.
+Pass --nprobe for collections built with an IVF_FLAT or IVF_SQ8 index.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohere_app.model_registry import model_registry
+
+
+def history_queries():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    import django
+    django.setup()
+    from cohere_app.models import PromptHistory
+    prompts = PromptHistory.objects.exclude(prompt__iexact="continue").values_list("prompt", flat=True).distinct()
+    return [prompt for prompt in prompts if prompt.strip()]
+
+
+def read_queries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def collection_vectors(collection):
+    iterator = collection.query_iterator(batch_size=1000, output_fields=["vector"])
+    pks, vectors = [], []
+    while True:
+        rows = iterator.next()
+        if not rows:
+            iterator.close()
+            break
+        pks.extend(row["pk"] for row in rows)
+        vectors.extend(row["vector"] for row in rows)
+    return np.asarray(pks), np.asarray(vectors, dtype=np.float32)
+
+
+def exact_top_k(queries, pks, vectors, k):
+    # Squared L2 distance as ||x||^2 - 2 q.x, the ||q||^2 term does not change the order
+    norms = np.sum(vectors * vectors, axis=1)
+    found = []
+    for query in queries:
+        distances = norms - 2 * (vectors @ query)
+        nearest = np.argpartition(distances, min(k, len(distances) - 1))[:k]
+        found.append(set(pks[nearest].tolist()))
+    return found
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", required=True)
+    query_group = parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument("--queries-file")
+    query_group.add_argument("--from-history", action="store_true")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--ef", default="16,30,48,64,96,128,200")
+    parser.add_argument("--nprobe")
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--target", type=float, default=0.95)
+    parser.add_argument("--consistency", default="Bounded")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    queries = history_queries() if args.from_history else read_queries(args.queries_file)
+    random.Random(args.seed).shuffle(queries)
+    queries = queries[:args.queries]
+    if not queries:
+        raise SystemExit("No queries")
+
+    from dotenv import load_dotenv
+    from pymilvus import connections, Collection
+    load_dotenv()
+    connections.connect("benchmark", host=os.getenv("HOST"), port=os.getenv("PORT"))
+    collection = Collection(args.collection, using="benchmark")
+    collection.load()
+
+    query_vectors = np.asarray(model_registry.sentence_transformer().encode(queries), dtype=np.float32)
+    pks, vectors = collection_vectors(collection)
+    expected = exact_top_k(query_vectors, pks, vectors, args.k)
+    print(f"{len(queries)} queries over {len(pks)} vectors of {args.collection}, k={args.k}")
+
+    name = "nprobe" if args.nprobe else "ef"
+    chosen = None
+    for value in sorted(int(value) for value in (args.nprobe or args.ef).split(",")):
+        if name == "ef" and value < args.k:
+            print(f"ef={value}: skipped, Milvus needs ef >= k")
+            continue
+        latencies, recalls = [], []
+        for query_vector, exact in zip(query_vectors, expected):
+            started_at = time.perf_counter()
+            results = collection.search(data=[query_vector.tolist()], anns_field="vector",
+                                        param={"metric_type": "L2", "params": {name: value}}, limit=args.k,
+                                        consistency_level=args.consistency)
+            latencies.append((time.perf_counter() - started_at) * 1000)
+            recalls.append(len({hit.id for hit in results[0]} & exact) / len(exact))
+        recall = float(np.mean(recalls))
+        print(f"{name}={value:4d}: recall@{args.k} {recall:.4f}, p50 {percentile(latencies, 0.5):.1f} ms, "
+              f"p95 {percentile(latencies, 0.95):.1f} ms")
+        if chosen is None and recall >= args.target:
+            chosen = value
+
+    if chosen is None:
+        print(f"No {name} reached recall {args.target}")
+    else:
+        print(json.dumps({args.collection: {name: chosen, "limit": args.k, "consistency_level": args.consistency}}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Time Django startup with cohere_app, i.e. django.setup() plus importing cohere_app.urls,
+in fresh interpreters, optionally for another git revision too and for the warm-up of the models.
+
+    python benchmarks/startup_benchmark.py [--runs 5] [--ref <git ref>] [--warm-up]
+
+Run from RAG_backend with the usual .env, database and Milvus available, since older revisions
+connect to them at import. --ref checks the revision out into a temporary git worktree.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = """
+import os, sys, time, json
+started_at = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+import django
+django.setup()
+import cohere_app.urls
+result = {"startup": time.perf_counter() - started_at}
+if "--warm-up" in sys.argv:
+    from cohere_app.lazy_resource import warm_up
+    started_at = time.perf_counter()
+    result["resources"] = warm_up()
+    result["warm_up"] = time.perf_counter() - started_at
+print(json.dumps(result))
+"""
+
+
+def measure(backend_dir, runs, warm_up):
+    results = []
+    env = dict(os.environ, RAG_WARM_UP="false")
+    for _ in range(runs):
+        args = [sys.executable, "-c", STARTUP_SCRIPT] + (["--warm-up"] if warm_up else [])
+        completed = subprocess.run(args, cwd=backend_dir, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Startup failed in {backend_dir}:\n{completed.stderr[-2000:]}")
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def report(label, results):
+    startup = [result["startup"] for result in results]
+    print(f"{label}: startup median {statistics.median(startup):.2f}s, min {min(startup):.2f}s over {len(startup)} runs")
+    if "warm_up" in results[-1]:
+        print(f"{label}: warm-up {results[-1]['warm_up']:.2f}s")
+        for name, seconds in results[-1]["resources"].items():
+            print(f"    {name}: {seconds if isinstance(seconds, str) else f'{seconds:.2f}s'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ref", help="also measure this git revision, e.g. the commit before lazy loading")
+    parser.add_argument("--warm-up", action="store_true", help="also time loading every lazy resource")
+    args = parser.parse_args()
+
+    if args.ref:
+        repo_root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=BACKEND_DIR, text=True).strip()
+        worktree = tempfile.mkdtemp(prefix="startup-benchmark-")
+        try:
+            subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], cwd=repo_root, check=True, capture_output=True)
+            ref_backend = os.path.join(worktree, os.path.relpath(BACKEND_DIR, repo_root))
+            for name in (".env", "logs"):
+                if os.path.exists(os.path.join(BACKEND_DIR, name)) and not os.path.exists(os.path.join(ref_backend, name)):
+                    os.symlink(os.path.join(BACKEND_DIR, name), os.path.join(ref_backend, name))
+            report(args.ref, measure(ref_backend, args.runs, warm_up=False))
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=repo_root, capture_output=True)
+            shutil.rmtree(worktree, ignore_errors=True)
+
+    report("working tree", measure(BACKEND_DIR, args.runs, args.warm_up))
+
+
+if __name__ == "__main__":
+    main()
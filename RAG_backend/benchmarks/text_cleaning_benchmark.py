@@ -0,0 +1,94 @@
+"""
+Benchmark of clean_chunk and clean_text against the implementations they replaced.
+
+    python benchmarks/text_cleaning_benchmark.py [--pages 1000] [--pdf big.pdf]
+
+Run from RAG_backend. The timings are over synthetic pages of PDF-like text, or over the pages of the
+given PDFs, and both versions must give the same output on them. That they agree on any text is
+checked by TextCleaningTests in cohere_app/tests.py.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohere_app.Chunking_UI.file_process import clean_chunk, clean_text, extract_text_pdf
+
+def previous_clean_text(text):
+    text = re.sub(r'\.{3,}', '.', text)
+    lines = text.split('\n')
+    cleaned_lines = [line.strip() for line in lines if len(line.split()) >= 4]
+    cleaned_text = '\n'.join(cleaned_lines)
+    cleaned_text = re.sub(r'^\s*$', '', cleaned_text, flags=re.MULTILINE)
+    return cleaned_text.strip()
+
+
+def previous_clean_chunk(chunk):
+    lines = chunk.splitlines()
+    cleaned_lines = []
+    for line in lines:
+        stripped_line = line.strip()
+        if not stripped_line:
+            continue
+        alnum_count = sum(1 for ch in stripped_line if ch.isalnum())
+        if len(stripped_line) > 0 and (alnum_count / len(stripped_line)) < 0.3:
+            continue
+        cleaned_lines.append(line)
+    cleaned_chunk = " ".join(cleaned_lines)
+    cleaned_chunk = re.sub(r'[\-\+\|=]{2,}', ' ', cleaned_chunk)
+    cleaned_chunk = re.sub(r'\s+', ' ', cleaned_chunk)
+    return cleaned_chunk.strip()
+
+
+def synthetic_pages(pages, page_chars, seed):
+    rng = random.Random(seed)
+    words = ["pressure", "valve", "assembly", "inspection", "hull", "section", "procedure", "torque",
+             "12.5", "Fig.", "Table", "(a)", "mm", "±0.2", "......", "--", "|", "=="]
+    text_by_page = []
+    for page_num in range(pages):
+        lines, size = [], 0
+        while size < page_chars:
+            line = " ".join(rng.choice(words) for _ in range(rng.randint(1, 12)))
+            lines.append(line if rng.random() > 0.05 else "-" * rng.randint(3, 60))
+            size += len(lines[-1]) + 1
+        text_by_page.append((page_num, "\n".join(lines)))
+    return text_by_page
+
+
+def timed(function, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", action="append", default=[])
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--page-chars", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    text_by_page = [page for path in args.pdf for page in extract_text_pdf(path)[0]]
+    text_by_page = text_by_page or synthetic_pages(args.pages, args.page_chars, args.seed)
+    texts = [text for _, text in text_by_page]
+    for new, previous in ((clean_chunk, previous_clean_chunk), (clean_text, previous_clean_text)):
+        if [new(text) for text in texts] != [previous(text) for text in texts]:
+            raise SystemExit(f"{new.__name__} differs on the benchmark pages")
+        previous_time = timed(previous, texts, args.repeat)
+        new_time = timed(new, texts, args.repeat)
+        print(f"{new.__name__}: {len(texts)} pages, previous {previous_time * 1000:.1f} ms, "
+              f"now {new_time * 1000:.1f} ms ({previous_time / new_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import hashlib
+import threading
+from pymilvus import connections, utility, Collection, CollectionSchema, FieldSchema, DataType
+from dotenv import load_dotenv
+from .enable_logging import logger
+
+load_dotenv()
+host = os.getenv("HOST")
+port = os.getenv("PORT")
+
+# Vector index of new collections: HNSW, IVF_FLAT, or IVF_SQ8 for about a quarter of the memory
+MILVUS_INDEX_TYPE = os.getenv("MILVUS_INDEX_TYPE", "HNSW")
+HNSW_M = int(os.getenv("HNSW_M", 8))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 64))
+# Clusters of IVF indexes, about 4 * sqrt(chunks) is a good start
+IVF_NLIST = int(os.getenv("IVF_NLIST", 1024))
+# Scalar index on source, used by the source == / source in filters of file-filtered search and deletes:
+# INVERTED, Trie, or empty for none
+SOURCE_INDEX_TYPE = os.getenv("SOURCE_INDEX_TYPE", "INVERTED")
+# "true" to put the chunks of each folder in their own partition, so file-filtered searches only visit those
+MILVUS_PARTITION_BY_FOLDER = os.getenv("MILVUS_PARTITION_BY_FOLDER", "false").lower() in ("1", "true", "yes")
+# Folders beyond this go to the default partition; Milvus allows 1024 partitions per collection by default
+MILVUS_MAX_PARTITIONS = int(os.getenv("MILVUS_MAX_PARTITIONS", 1000))
+
+# VARCHAR lengths in bytes; chunks are about 800 characters but end at the next period, see iter_chunks
+SOURCE_MAX_LENGTH = 4096
+PAGE_MAX_LENGTH = 256
+TEXT_MAX_LENGTH = 65_535
+VECTOR_INDEX_TYPES = ("HNSW", "IVF_FLAT", "IVF_SQ8")
+DEFAULT_PARTITION = "_default"
+
+
+def partition_name(source):
+    """ Partition holding the chunks of the file source when partitioning by folder """
+    folder = os.path.dirname(os.path.normpath(source))
+    return "folder_" + hashlib.sha1(folder.encode("utf-8")).hexdigest()[:16]
+
+
+class CollectionBuilder:
+    """
+    Declares the schema (source, page, text, pk, vector) and the indexes of the collections ingestion
+    creates: a vector index set by MILVUS_INDEX_TYPE and a scalar index on source. Collections created
+    before the builder get the source index when they are next opened for ingestion.
+    """
+
+    def __init__(self, index_type=MILVUS_INDEX_TYPE, source_index_type=SOURCE_INDEX_TYPE,
+                 partition_by_folder=MILVUS_PARTITION_BY_FOLDER, max_partitions=MILVUS_MAX_PARTITIONS):
+        if index_type not in VECTOR_INDEX_TYPES:
+            raise ValueError(f"MILVUS_INDEX_TYPE must be one of {', '.join(VECTOR_INDEX_TYPES)}, got {index_type}")
+        self.index_type = index_type
+        self.source_index_type = source_index_type
+        self.partition_by_folder = partition_by_folder
+        self.max_partitions = max_partitions
+        self._lock = threading.Lock()
+
+    def schema(self, dim):
+        return CollectionSchema([
+            FieldSchema("source", DataType.VARCHAR, max_length=SOURCE_MAX_LENGTH),
+            FieldSchema("page", DataType.VARCHAR, max_length=PAGE_MAX_LENGTH),
+            FieldSchema("text", DataType.VARCHAR, max_length=TEXT_MAX_LENGTH),
+            FieldSchema("pk", DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema("vector", DataType.FLOAT_VECTOR, dim=dim),
+        ])
+
+    def vector_index_params(self):
+        if self.index_type == "HNSW":
+            params = {"M": HNSW_M, "efConstruction": HNSW_EF_CONSTRUCTION}
+        else:
+            params = {"nlist": IVF_NLIST}
+        return {"metric_type": "L2", "index_type": self.index_type, "params": params}
+
+    def ensure_source_index(self, collection):
+        """ Add the scalar index on source when the collection has none; a failure only leaves filters unindexed """
+        if not self.source_index_type or any(index.field_name == "source" for index in collection.indexes):
+            return
+        try:
+            collection.create_index("source", {"index_type": self.source_index_type}, index_name="source_index")
+            logger.info(f"Created {self.source_index_type} index on source of {collection.name}")
+        except Exception as e:
+            logger.warning(f"Could not index source of {collection.name}: {e}")
+
+    def create(self, collection_name, dim, using):
+        collection = Collection(collection_name, schema=self.schema(dim), using=using)
+        collection.create_index("vector", self.vector_index_params())
+        self.ensure_source_index(collection)
+        # Searches and the source filtered deletes need the collection loaded, as Milvus.from_documents left it
+        collection.load()
+        logger.info(f"Created collection {collection_name} with a {self.index_type} index")
+        return collection
+
+    def get_or_create(self, collection_name, dim, using):
+        connections.connect(using, host=host, port=port)
+        with self._lock:
+            if utility.has_collection(collection_name, using=using):
+                collection = Collection(collection_name, using=using)
+                self.ensure_source_index(collection)
+                collection.load()
+                return collection
+            return self.create(collection_name, dim, using)
+
+    def partitions_for(self, collection, sources):
+        """
+        source -> partition to insert each of sources into, creating the partitions missing.
+        Everything goes to the default partition when partitioning is off or the collection is full.
+        """
+        if not self.partition_by_folder:
+            return {source: DEFAULT_PARTITION for source in sources}
+        with self._lock:
+            existing = {partition.name for partition in collection.partitions}
+            assigned = {}
+            for source in sources:
+                name = partition_name(source)
+                if name not in existing:
+                    if len(existing) >= self.max_partitions:
+                        name = DEFAULT_PARTITION
+                    else:
+                        collection.create_partition(name)
+                        existing.add(name)
+                assigned[source] = name
+            return assigned
+
+    @staticmethod
+    def search_partitions(collection, sources):
+        """
+        Partitions a search filtered to sources has to visit, None for all of them. The default
+        partition is always included since it holds the files of folders over the partition limit.
+        """
+        if not sources:
+            return None
+        existing = {partition.name for partition in collection.partitions}
+        wanted = {partition_name(source) for source in sources} & existing
+        if not wanted:
+            return None
+        return sorted(wanted | {DEFAULT_PARTITION})
+
+
+collection_builder = CollectionBuilder()
@@ -147,3 +147,354 @@ def update_ocr_status(document_source, collection_name):
     connection.commit()
     cursor.close()
     connection.close()
+
+
+def delete_user_access(collection_name, document_names):
+    connection = create_connection()
+    cursor = connection.cursor()
+    delete_query = f'''
+    DELETE FROM user_access_{collection_name} WHERE document_name = %s;
+    '''
+    cursor.executemany(delete_query, [(name,) for name in document_names])
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+'''
+File manifest table based functions, used by the incremental folder sync
+'''
+def create_file_manifest(collection_name):
+    connection = create_connection()
+    cursor = connection.cursor()
+    create_table_query = f'''
+    CREATE TABLE IF NOT EXISTS file_manifest_{collection_name} (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        document_name TEXT,
+        size BIGINT,
+        mtime_ns BIGINT,
+        content_hash CHAR(64),
+        synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        document_name_hash CHAR(64) AS (SHA2(document_name, 256)) VIRTUAL UNIQUE,
+        INDEX idx_manifest_document_name_hash (document_name_hash)
+    );
+    '''
+    cursor.execute(create_table_query)
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def fetch_file_manifest(collection_name):
+    """ Returns {document_name: (size, mtime_ns, content_hash)} """
+    connection = create_connection()
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT document_name, size, mtime_ns, content_hash FROM file_manifest_{collection_name};")
+    manifest = {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+    cursor.close()
+    connection.close()
+    return manifest
+
+
+def upsert_file_manifest(collection_name, entries):
+    """ entries: iterable of (document_name, size, mtime_ns, content_hash) """
+    connection = create_connection()
+    cursor = connection.cursor()
+    upsert_query = f'''
+    INSERT INTO file_manifest_{collection_name} (document_name, size, mtime_ns, content_hash)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE size = VALUES(size), mtime_ns = VALUES(mtime_ns), content_hash = VALUES(content_hash);
+    '''
+    cursor.executemany(upsert_query, list(entries))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def delete_file_manifest(collection_name, document_names):
+    # Collections ingested without sync have no manifest yet
+    create_file_manifest(collection_name)
+    connection = create_connection()
+    cursor = connection.cursor()
+    delete_query = f'''
+    DELETE FROM file_manifest_{collection_name} WHERE document_name = %s;
+    '''
+    cursor.executemany(delete_query, [(name,) for name in document_names])
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+'''
+File catalog table based functions: one row per ingested source with its chunk, page and byte counts
+'''
+def file_catalog_exists(collection_name):
+    connection = create_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = %s;", (f"file_catalog_{collection_name}",))
+    exists = cursor.fetchone()[0] > 0
+    cursor.close()
+    connection.close()
+    return exists
+
+
+def create_file_catalog(collection_name):
+    connection = create_connection()
+    cursor = connection.cursor()
+    create_table_query = f'''
+    CREATE TABLE IF NOT EXISTS file_catalog_{collection_name} (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        document_name VARCHAR(4096) NOT NULL,
+        file_name VARCHAR(1024) NOT NULL,
+        chunk_count INT NOT NULL,
+        page_count INT NOT NULL,
+        byte_size BIGINT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        document_name_hash CHAR(64) AS (SHA2(document_name, 256)) VIRTUAL UNIQUE,
+        INDEX idx_catalog_document_name (document_name(255)),
+        INDEX idx_catalog_file_name (file_name(255))
+    );
+    '''
+    cursor.execute(create_table_query)
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def upsert_file_catalog(collection_name, entries):
+    """ entries: iterable of (document_name, file_name, chunk_count, page_count, byte_size) """
+    connection = create_connection()
+    cursor = connection.cursor()
+    upsert_query = f'''
+    INSERT INTO file_catalog_{collection_name} (document_name, file_name, chunk_count, page_count, byte_size)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE chunk_count = VALUES(chunk_count), page_count = VALUES(page_count), byte_size = VALUES(byte_size);
+    '''
+    cursor.executemany(upsert_query, list(entries))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def delete_file_catalog(collection_name, document_names):
+    connection = create_connection()
+    cursor = connection.cursor()
+    delete_query = f'''
+    DELETE FROM file_catalog_{collection_name} WHERE document_name = %s;
+    '''
+    cursor.executemany(delete_query, [(name,) for name in document_names])
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def fetch_file_catalog(collection_name, prefix="", offset=0, limit=None):
+    """
+    Returns (entries, total): the catalog rows whose path or file name starts with prefix, by path,
+    as dicts, at most limit of them from offset; total counts every matching row.
+    """
+    where, params = "", []
+    if prefix:
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        where, params = "WHERE document_name LIKE %s OR file_name LIKE %s", [pattern, pattern]
+    connection = create_connection()
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute(f"SELECT COUNT(*) AS total FROM file_catalog_{collection_name} {where};", params)
+    total = cursor.fetchone()["total"]
+    select_query = f'''
+    SELECT document_name, file_name, chunk_count, page_count, byte_size FROM file_catalog_{collection_name}
+    {where} ORDER BY document_name
+    '''
+    if limit is not None:
+        select_query += " LIMIT %s OFFSET %s"
+        params = params + [limit, offset]
+    cursor.execute(select_query + ";", params)
+    entries = cursor.fetchall()
+    cursor.close()
+    connection.close()
+    return entries, total
+
+
+'''
+Ingest job table based functions: the background ingests of every server process, see cohere_app.ingest_jobs
+'''
+INGEST_JOB_COLUMNS = (
+    "job_id", "collection_name", "source", "status", "message", "current_progress", "total_files",
+    "progress_percentage", "files_processed", "chunks_completed", "files_failed", "errors",
+    "submitted_at", "started_at", "finished_at", "heartbeat_at", "active_collection",
+)
+
+
+def create_ingest_jobs():
+    connection = create_connection()
+    cursor = connection.cursor()
+    # active_collection is the collection name while the job is queued or running and NULL after,
+    # so its unique index lets a single active job per collection in
+    create_table_query = '''
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        job_id CHAR(32) PRIMARY KEY,
+        collection_name VARCHAR(255) NOT NULL,
+        source TEXT,
+        status VARCHAR(16) NOT NULL,
+        message TEXT,
+        current_progress INT NOT NULL DEFAULT 0,
+        total_files INT NOT NULL DEFAULT 0,
+        progress_percentage DOUBLE NOT NULL DEFAULT 0,
+        files_processed INT NOT NULL DEFAULT 0,
+        chunks_completed INT NOT NULL DEFAULT 0,
+        files_failed INT NOT NULL DEFAULT 0,
+        errors TEXT,
+        submitted_at DOUBLE NOT NULL,
+        started_at DOUBLE,
+        finished_at DOUBLE,
+        heartbeat_at DOUBLE NOT NULL,
+        active_collection VARCHAR(255) UNIQUE,
+        INDEX idx_ingest_jobs_submitted_at (submitted_at),
+        INDEX idx_ingest_jobs_finished_at (finished_at)
+    );
+    '''
+    cursor.execute(create_table_query)
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def insert_ingest_job(row):
+    """ Insert a job row; returns False when its collection already has an active job """
+    connection = create_connection()
+    cursor = connection.cursor()
+    insert_query = f'''
+    INSERT INTO ingest_jobs ({", ".join(INGEST_JOB_COLUMNS)}) VALUES ({", ".join(["%s"] * len(INGEST_JOB_COLUMNS))});
+    '''
+    try:
+        cursor.execute(insert_query, [row[column] for column in INGEST_JOB_COLUMNS])
+        connection.commit()
+        return True
+    except mysql.connector.IntegrityError:
+        return False
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def update_ingest_jobs(rows):
+    """ Write the given job rows back, each a dict of every column """
+    columns = [column for column in INGEST_JOB_COLUMNS if column != "job_id"]
+    connection = create_connection()
+    cursor = connection.cursor()
+    update_query = f'''
+    UPDATE ingest_jobs SET {", ".join(f"{column} = %s" for column in columns)} WHERE job_id = %s;
+    '''
+    cursor.executemany(update_query, [[row[column] for column in columns] + [row["job_id"]] for row in rows])
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def fail_stale_ingest_jobs(heartbeat_before, now):
+    """ Fail the active jobs whose server process stopped sending heartbeats, freeing their collections """
+    connection = create_connection()
+    cursor = connection.cursor()
+    update_query = '''
+    UPDATE ingest_jobs SET status = 'failed', message = 'Error occurred: the server process running the job stopped',
+        finished_at = %s, active_collection = NULL
+    WHERE active_collection IS NOT NULL AND heartbeat_at < %s;
+    '''
+    cursor.execute(update_query, (now, heartbeat_before))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def fetch_ingest_jobs(job_id=None, limit=None):
+    """ Job rows as dicts, newest first: the one of job_id, or the latest limit jobs """
+    connection = create_connection()
+    cursor = connection.cursor(dictionary=True)
+    select_query = f"SELECT {', '.join(INGEST_JOB_COLUMNS)} FROM ingest_jobs"
+    params = []
+    if job_id is not None:
+        select_query += " WHERE job_id = %s"
+        params.append(job_id)
+    select_query += " ORDER BY submitted_at DESC"
+    if limit is not None:
+        select_query += " LIMIT %s"
+        params.append(limit)
+    cursor.execute(select_query + ";", params)
+    rows = cursor.fetchall()
+    cursor.close()
+    connection.close()
+    return rows
+
+
+def fetch_active_ingest_collections(heartbeat_after, finished_after):
+    """ Collections with a live active job, or a job that finished after finished_after """
+    connection = create_connection()
+    cursor = connection.cursor()
+    select_query = '''
+    SELECT DISTINCT collection_name FROM ingest_jobs
+    WHERE (active_collection IS NOT NULL AND heartbeat_at > %s) OR finished_at > %s;
+    '''
+    cursor.execute(select_query, (heartbeat_after, finished_after))
+    collections = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    connection.close()
+    return collections
+
+
+def prune_ingest_jobs(keep):
+    """ Delete the finished jobs beyond the keep most recently submitted ones """
+    connection = create_connection()
+    cursor = connection.cursor()
+    delete_query = '''
+    DELETE FROM ingest_jobs WHERE finished_at IS NOT NULL AND job_id NOT IN (
+        SELECT job_id FROM (SELECT job_id FROM ingest_jobs ORDER BY submitted_at DESC LIMIT %s) AS recent
+    );
+    '''
+    cursor.execute(delete_query, (keep,))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+'''
+Collection generation table: bumped whenever the contents of a collection change, so the retrieval cache
+of every server process can tell its cached results are stale, see cohere_app.retrieval_cache
+'''
+def create_collection_generations():
+    connection = create_connection()
+    cursor = connection.cursor()
+    create_table_query = '''
+    CREATE TABLE IF NOT EXISTS collection_generations (
+        collection_name VARCHAR(255) PRIMARY KEY,
+        generation BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    );
+    '''
+    cursor.execute(create_table_query)
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def bump_collection_generation(collection_name):
+    # The row is kept when the collection is dropped, a new collection of that name starts past the old generations
+    connection = create_connection()
+    cursor = connection.cursor()
+    upsert_query = '''
+    INSERT INTO collection_generations (collection_name, generation) VALUES (%s, 1)
+    ON DUPLICATE KEY UPDATE generation = generation + 1;
+    '''
+    cursor.execute(upsert_query, (collection_name,))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def fetch_collection_generation(collection_name):
+    """ Generation of collection_name, 0 until its contents first change """
+    connection = create_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT generation FROM collection_generations WHERE collection_name = %s;", (collection_name,))
+    row = cursor.fetchone()
+    cursor.close()
+    connection.close()
+    return row[0] if row else 0
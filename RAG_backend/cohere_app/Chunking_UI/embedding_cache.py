@@ -0,0 +1,137 @@
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from dotenv import load_dotenv
+from .enable_logging import logger
+
+load_dotenv()
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rag_embedding_cache"))
+KEY_SIZE = 16
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of chunk embeddings for one model.
+    Vectors live in a memory-mapped float32 file and their content hashes in a parallel
+    key file, row i of one belonging to row i of the other. The hash index is rebuilt
+    in memory from the key file when the cache is opened.
+    """
+
+    def __init__(self, model_name, directory=EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        self.directory = os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.keys_path = os.path.join(self.directory, "keys.bin")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self._lock = threading.Lock()
+        self.dim = None
+        self.index = {}
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        if self.dim is None or not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, 'ab') as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                rows = self._complete_rows()
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+        with open(self.keys_path, 'rb') as f:
+            keys = f.read(rows * KEY_SIZE)
+        self.index = {keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(rows)}
+        self._map(rows)
+        logger.info(f"Loaded {rows} cached embeddings for {self.model_name}")
+
+    def _complete_rows(self):
+        """
+        Rows present in both files, with the flock on the key file held. A crash or error between
+        the two appends of put_many leaves one file ahead of the other; its extra bytes are cut
+        off so the next append starts on the same row in both files.
+        """
+        keys_size = os.path.getsize(self.keys_path) if os.path.exists(self.keys_path) else 0
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        rows = min(keys_size // KEY_SIZE, vectors_size // (4 * self.dim))
+        if keys_size != rows * KEY_SIZE:
+            os.truncate(self.keys_path, rows * KEY_SIZE)
+        if vectors_size != rows * 4 * self.dim:
+            os.truncate(self.vectors_path, rows * 4 * self.dim)
+        return rows
+
+    def _map(self, rows):
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim)) if rows else None
+
+    def key(self, text):
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+    def get_many(self, keys):
+        """ Return the cached vector for every key, None where it is not cached """
+        with self._lock:
+            return [np.array(self.vectors[self.index[key]]) if key in self.index else None for key in keys]
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, 'w') as f:
+                    json.dump({"dim": self.dim, "model_name": self.model_name}, f)
+            new_rows = [(key, vector) for key, vector in zip(keys, vectors) if key not in self.index]
+            if not new_rows:
+                return
+            with open(self.keys_path, 'ab') as keys_file, open(self.vectors_path, 'ab') as vectors_file:
+                # Serialise appends from several processes and take the row count under the lock
+                fcntl.flock(keys_file, fcntl.LOCK_EX)
+                try:
+                    first_row = self._complete_rows()
+                    vectors_file.write(np.stack([vector for _, vector in new_rows]).tobytes())
+                    vectors_file.flush()
+                    keys_file.write(b"".join(key for key, _ in new_rows))
+                    keys_file.flush()
+                finally:
+                    fcntl.flock(keys_file, fcntl.LOCK_UN)
+            for offset, (key, _) in enumerate(new_rows):
+                self.index[key] = first_row + offset
+            self._map(first_row + len(new_rows))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain embeddings wrapper that looks chunk vectors up in the EmbeddingCache
+    and only runs the model on texts it has never embedded before.
+    """
+
+    def __init__(self, embeddings, model_name, directory=EMBEDDING_CACHE_DIR):
+        self.embeddings = embeddings
+        self.cache = EmbeddingCache(model_name, directory)
+
+    def embed_documents(self, texts):
+        keys = [self.cache.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], texts[i])
+        self.cache.hits += len(texts) - len(missing)
+        self.cache.misses += len(missing)
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put_many(list(missing), computed)
+            computed_by_key = dict(zip(missing, computed))
+            vectors = [computed_by_key[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import Counter, defaultdict
+from pymilvus import connections, utility, Collection
+from .enable_logging import logger
+from cohere_app.Chunking_UI import db_utility
+from cohere_app.Chunking_UI.milvus_writer import MILVUS_ALIAS, host, port
+
+# Collections whose catalog table is known to exist, to skip the information_schema lookup
+_catalogs = set()
+# One lock per collection, so the scan filling one catalog does not hold up the others
+_collection_locks = defaultdict(threading.Lock)
+_lock = threading.Lock()
+
+
+def catalog_entry(source, chunk_count, page_count):
+    """ Row of the file catalog for source; its size is None once the file is gone from disk """
+    try:
+        byte_size = os.path.getsize(source)
+    except OSError:
+        byte_size = None
+    return source, os.path.basename(source), chunk_count, page_count, byte_size
+
+
+def scan_collection(collection_name):
+    """ Catalog rows of every source in the Milvus collection, from a full scan of its source and page fields """
+    connections.connect(MILVUS_ALIAS, host=host, port=port)
+    if not utility.has_collection(collection_name, using=MILVUS_ALIAS):
+        return []
+    iterator = Collection(collection_name, using=MILVUS_ALIAS).query_iterator(batch_size=1000, output_fields=["source", "page"])
+    chunks = Counter()
+    pages = defaultdict(set)
+    while True:
+        rows = iterator.next()
+        if not rows:
+            iterator.close()
+            break
+        for row in rows:
+            chunks[row["source"]] += 1
+            pages[row["source"]].add(row["page"])
+    return [catalog_entry(source, count, len(pages[source])) for source, count in chunks.items()]
+
+
+def ensure_file_catalog(collection_name):
+    """
+    Create the file catalog of collection_name. Collections ingested before the catalog existed are
+    scanned once to fill it; the scan runs before the table is created, so a failed one is retried.
+    Only callers for the same collection wait for the scan.
+    """
+    if collection_name in _catalogs:
+        return
+    with _lock:
+        collection_lock = _collection_locks[collection_name]
+    with collection_lock:
+        if collection_name in _catalogs:
+            return
+        if not db_utility.file_catalog_exists(collection_name):
+            entries = scan_collection(collection_name)
+            db_utility.create_file_catalog(collection_name)
+            if entries:
+                db_utility.upsert_file_catalog(collection_name, entries)
+                logger.info(f"Filled the file catalog of {collection_name} with {len(entries)} files from Milvus")
+        _catalogs.add(collection_name)
+
+
+def record_files(collection_name, results):
+    """ Add the files a MilvusIngestWriter flush stored, see MilvusIngestWriter.flush for results """
+    entries = [catalog_entry(result["file"], len(result["pks"]), result["pages"]) for result in results if not result["error"]]
+    if entries:
+        ensure_file_catalog(collection_name)
+        db_utility.upsert_file_catalog(collection_name, entries)
+
+
+def remove_files(collection_name, sources):
+    if sources:
+        ensure_file_catalog(collection_name)
+        db_utility.delete_file_catalog(collection_name, sources)
+
+
+def forget(collection_name):
+    """ The catalog table of collection_name was dropped with the collection """
+    with _lock:
+        collection_lock = _collection_locks[collection_name]
+    with collection_lock:
+        _catalogs.discard(collection_name)
+
+
+def list_files(collection_name, prefix="", page=None, page_size=100):
+    """
+    (entries, total) of the files of collection_name whose path or file name starts with prefix, by path.
+    page counts from 1; without one every matching file is returned.
+    """
+    ensure_file_catalog(collection_name)
+    if page is None:
+        return db_utility.fetch_file_catalog(collection_name, prefix)
+    return db_utility.fetch_file_catalog(collection_name, prefix, offset=(page - 1) * page_size, limit=page_size)
@@ -1,65 +1,63 @@
 import re
-from tqdm import tqdm
+import bisect
 import fitz
 from langchain_core.documents import Document
 from pptx import Presentation
 from docx import Document as DocxDocument
 import openpyxl
 import csv, os
-from langchain_community.vectorstores import Milvus
+import itertools
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 from .enable_logging import logger 
+from .embedding_cache import CachedEmbeddings
+from .ocr_engine import ocr_engine
+from cohere_app.lazy_resource import LazyResource
+from cohere_app.model_registry import model_registry, embedding_model_id
 from cohere_app.Chunking_UI import db_utility
-from doctr.io import DocumentFile
-from doctr.models import ocr_predictor
 from dotenv import load_dotenv
 
 load_dotenv()
 host = os.getenv("HOST")
 port = os.getenv("PORT")
 MILVUS_URL = os.getenv("MILVUS_URL")
+# TXT, CSV and XLSX files are streamed as pseudo-pages of about this many characters,
+# the page size process_docx estimates, so their size does not bound memory
+STREAM_PAGE_CHARS = int(os.getenv("STREAM_PAGE_CHARS", 3000))
 
-embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2', model_kwargs={'device': "cpu"})
-model = ocr_predictor(pretrained=True)
-OCR_LIST = []
+
+def load_cached_embeddings():
+    # The same model instance the query path encodes with
+    return CachedEmbeddings(model_registry.embeddings(), embedding_model_id())
+
+
+# Unchanged chunks are served from disk instead of being re-embedded on re-ingestion.
+# The model is loaded by the first ingest or upload, not when the module is imported.
+cached_embeddings = LazyResource("cached_embeddings", load_cached_embeddings)
 
 def extract_text_pdf(pdf_path):
-    text_by_page = []
+    """
+    Extract the text layer of every page. Pages without text are kept with empty text
+    and the document is flagged "OCR required" so that only those pages get OCR'd.
+    """
     try:
         pdf = fitz.open(pdf_path)
     except Exception as e:
         return [], "Can't open the file ERROR"
-    for page_num in range(len(pdf)):
-        page = pdf[page_num]
-        text = page.get_text()
-        # we need to clean the text here.
-        if not text:
-            OCR_LIST.append(pdf_path)
-            return [], "OCR required - ERROR"
-        else:
-            text_by_page.append((page_num, text))
+    with pdf:
+        text_by_page = [(page_num, pdf[page_num].get_text()) for page_num in range(len(pdf))]
+    # we need to clean the text here.
+    if any(not text.strip() for _, text in text_by_page):
+        return text_by_page, "OCR required - ERROR"
     return text_by_page, "Text extraction done"
 
 def process_ocr_document(pdf_path):
-    """ Extract text using OCR from each page of the PDF """
+    """ Extract text of a PDF, running OCR only on the pages that have no text layer """
     try:
-        """ Extract text using OCR from each page of the PDF """
-        text_by_page = []
-        doc = DocumentFile.from_pdf(pdf_path)
-        result = model(doc)
-        for page_num, page in enumerate(result.pages, start=1):
-            page_text = ""
-            words = []
-            for block in page.blocks:
-                for line in block.lines:
-                    for word in line.words:
-                        words.append(word)
-            sorted_words = sorted(words, key=lambda word: (word.geometry[0][1], word.geometry[0][0]))
-            page_text = " ".join([word.value for word in sorted_words])
-            text_by_page.append((page_num, page_text))
-        return text_by_page, "text extraction done"
+        text_by_page, message = extract_text_pdf(pdf_path)
+        if not text_by_page:
+            return [], message
+        return ocr_engine.fill_empty_pages(pdf_path, text_by_page), "text extraction done"
     except Exception as e:
         logger.error(f"Error extracting OCR text from {pdf_path}: {e}")
         return [], f"OCR FILE ERROR : {e}"
@@ -132,145 +130,258 @@ def process_docx(file_path):
         return [], f"DOCX FILE ERROR : {e}"
 
 
+def iter_text_pages(f, page_chars=STREAM_PAGE_CHARS):
+    """
+    Read an open text file block by block and yield (page_number, text) pseudo-pages of about
+    page_chars characters, each ending at a line break unless a single line is longer than that.
+    """
+    page_num, rest = 1, ""
+    while True:
+        block = f.read(page_chars)
+        if not block:
+            break
+        text = rest + block
+        cut = text.rfind('\n') + 1 or len(text)
+        rest = text[cut:]
+        yield page_num, text[:cut]
+        page_num += 1
+    if rest:
+        yield page_num, rest
+
+
+def iter_row_pages(rows, page_chars=STREAM_PAGE_CHARS):
+    """
+    Group (row_number, line) pairs into pseudo-pages of about page_chars characters.
+    Yields (first_row, last_row, text).
+    """
+    lines, size, first_row = [], 0, None
+    for row_num, line in rows:
+        if first_row is None:
+            first_row = row_num
+        lines.append(line)
+        size += len(line) + 1
+        if size >= page_chars:
+            yield first_row, row_num, "\n".join(lines)
+            lines, size, first_row = [], 0, None
+    if lines:
+        yield first_row, row_num, "\n".join(lines)
+
+
+def _txt_pages(f):
+    with f:
+        yield from iter_text_pages(f)
+
+
 def process_txt(file_path):
-    """ Process .txt file and extract text """
+    """ Process .txt file as a stream of pseudo-pages, see iter_text_pages """
     try:
-        with open(file_path, 'r') as f:
-            text = f.read()
-        return [(1, text)], "text extraction done"  # Text file considered as one page
+        f = open(file_path, 'r')
     except Exception as e:
         logger.error(f"Error processing TXT file {file_path}: {e}")
         return [], f"TEXT FILE ERROR : {e}"
+    return _txt_pages(f), "text extraction done"
+
+
+def _sheet_rows(worksheet):
+    """ Non-empty rows of a worksheet as (row_number, comma separated values), skipping empty cells """
+    for row_num, row in enumerate(worksheet.iter_rows(values_only=True), start=1):
+        row_values = []
+        for value in row:
+            if value is not None:
+                cell_value = str(value).strip()
+                if cell_value:
+                    row_values.append(cell_value)
+        if row_values:
+            yield row_num, ",".join(row_values)
+
+
+def _xlsx_pages(workbook):
+    try:
+        for sheet_name in workbook.sheetnames:
+            for first_row, last_row, text in iter_row_pages(_sheet_rows(workbook[sheet_name])):
+                yield f"{sheet_name} rows {first_row}-{last_row}", f"Sheet: {sheet_name}\n" + text
+    finally:
+        workbook.close()
 
 
 def process_xlsx(file_path):
     """ 
-    Process .xlsx file and extract text sheet by sheet with improved handling:
-    - Skips empty cells
-    - Properly handles None values
-    - Maintains sheet structure
-    - Includes sheet names in output
+    Process .xlsx file sheet by sheet as a stream of row-range pseudo-pages:
+    - Reads the workbook in read-only mode, one row at a time
+    - Skips empty cells and rows
+    - Labels pages "<sheet> rows <first>-<last>" and starts each with the sheet name
     """
     try:
-        workbook = openpyxl.load_workbook(file_path)
-        text_by_sheet = []
-        
-        for sheet_name in workbook.sheetnames:
-            worksheet = workbook[sheet_name]
-            sheet_content = []
-            
-            has_content = False
-            
-            for row in worksheet.iter_rows():
-                row_values = []
-                for cell in row:
-                    if cell.value is not None:
-                        cell_value = str(cell.value).strip()
-                        if cell_value:  
-                            row_values.append(cell_value)
-                            has_content = True
-                
-                if row_values: 
-                    sheet_content.append(",".join(row_values))
-            
-            if has_content:
-                sheet_text = f"Sheet: {sheet_name}\n" + "\n".join(sheet_content)
-                text_by_sheet.append((sheet_name, sheet_text))
-        
-        return text_by_sheet, "text extraction done" if text_by_sheet else "No content found in Excel file"
+        pages = _xlsx_pages(openpyxl.load_workbook(file_path, read_only=True))
+        # Read up to the first page with content so empty workbooks are still reported as such
+        first_page = next(pages, None)
     except Exception as e:
         logger.exception(f"Error processing XLSX file {file_path}")
         return [], f"EXCEL FILE ERROR : {e}"
+    if first_page is None:
+        return [], "No content found in Excel file"
+    return itertools.chain([first_page], pages), "text extraction done"
+
+
+def _csv_pages(f):
+    with f:
+        rows = ((row_num, ",".join(row)) for row_num, row in enumerate(csv.reader(f), start=1))
+        for first_row, last_row, text in iter_row_pages(rows):
+            yield f"rows {first_row}-{last_row}", text
 
 
 def process_csv(file_path):
-    """ Process .csv file and extract text """
+    """ Process .csv file as a stream of row-range pseudo-pages labelled "rows <first>-<last>" """
     try:
-        with open(file_path, 'r') as f:
-            reader = csv.reader(f)
-            text = "\n".join([",".join(row) for row in reader])
-        return [(1, text)], "text extraction done"  # Consider CSV as one page
+        f = open(file_path, 'r')
     except Exception as e:
         logger.error(f"Error processing CSV file {file_path}: {e}")
         return [()],  f"CSV FILE ERROR : {e}"
+    return _csv_pages(f), "text extraction done"
+
+
+_ELLIPSIS_RE = re.compile(r'\.{3,}')
+_RULE_RE = re.compile(r'[\-\+\|=]{2,}')
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+# Maps the UTF-8 bytes of a page to one ASCII character per character: 'a' for ASCII alphanumerics,
+# 'u' for non-ASCII characters, whitespace unchanged and '.' for the rest, so the lines of the
+# mask line up with the lines of the page
+_UTF8_MASK = bytes(
+    ord('u') if i >= 0x80 else ord('a') if chr(i).isalnum() else i if chr(i).isspace() else ord('.')
+    for i in range(256)
+)
+_UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+# Non-ASCII line boundaries of str.splitlines(), which the mask cannot keep
+_UNICODE_LINE_BREAKS = ('\x85', '\u2028', '\u2029')
+# Any run of two rule characters becomes b"--" once they are all mapped to '-'; UTF-8 never
+# encodes other characters with ASCII bytes
+_RULE_TO_DASH = bytes.maketrans(b'+|=', b'---')
+
+
+def _alnum_mask_lines(chunk):
+    """ The lines of the alphanumeric mask of chunk, or None if they would not line up with its lines """
+    if not chunk.isascii() and any(line_break in chunk for line_break in _UNICODE_LINE_BREAKS):
+        return None
+    encoded = chunk.encode('utf-8', 'surrogatepass')
+    return encoded.translate(_UTF8_MASK, _UTF8_CONTINUATION).decode('ascii').splitlines()
 
 
 def clean_text(text):
     """ Clean the extracted text by removing unwanted characters and formatting """
-    text = re.sub(r'\.{3,}', '.', text)
-    lines = text.split('\n')
-    cleaned_lines = [line.strip() for line in lines if len(line.split()) >= 4]
-    cleaned_text = '\n'.join(cleaned_lines)
-    cleaned_text = re.sub(r'^\s*$', '', cleaned_text, flags=re.MULTILINE)
-    return cleaned_text.strip()
+    # Lines of fewer than 4 words are dropped; collapsing "..." first would not change any word count
+    cleaned_lines = [line.strip() for line in text.split('\n') if len(line.split(None, 3)) == 4]
+    return _ELLIPSIS_RE.sub('.', '\n'.join(cleaned_lines)).strip()
 
 def clean_chunk(chunk):
     """
     Clean a text chunk by removing extra formatting characters.
     Processes text line-by-line, removing lines that consist mostly of formatting symbols,
     then collapses extra whitespace.
+    Alphanumerics are counted on a mask of the whole page; only the non-ASCII characters of a line
+    are looked at one by one.
     """
     lines = chunk.splitlines()
+    masks = _alnum_mask_lines(chunk)
     cleaned_lines = []
-    for line in lines:
+    for index, line in enumerate(lines):
         stripped_line = line.strip()
         if not stripped_line:
             continue
-        alnum_count = sum(1 for ch in stripped_line if ch.isalnum())
-        if len(stripped_line) > 0 and (alnum_count / len(stripped_line)) < 0.3:
+        if masks is None:
+            alnum_count = sum(1 for ch in stripped_line if ch.isalnum())
+        else:
+            alnum_count = masks[index].count('a')
+            if 'u' in masks[index]:
+                alnum_count += sum(1 for ch in _NON_ASCII_RE.findall(line) if ch.isalnum())
+        if (alnum_count / len(stripped_line)) < 0.3:
             continue
-        cleaned_lines.append(line)
+        # Whitespace around a line is collapsed below anyway
+        cleaned_lines.append(stripped_line)
     cleaned_chunk = " ".join(cleaned_lines)
-    cleaned_chunk = re.sub(r'[\-\+\|=]{2,}', ' ', cleaned_chunk)
-    cleaned_chunk = re.sub(r'\s+', ' ', cleaned_chunk)
-    return cleaned_chunk.strip()
+    if b'--' in cleaned_chunk.encode('utf-8', 'surrogatepass').translate(_RULE_TO_DASH):
+        cleaned_chunk = _RULE_RE.sub(' ', cleaned_chunk)
+    # Same as re.sub(r'\s+', ' ', ...).strip(): \s and str.split() share the definition of whitespace
+    return " ".join(cleaned_chunk.split())
 
 
-def read_and_split_text(text_by_page, chunk_size=800, overlap_size=200):
+def iter_chunks(text_by_page, chunk_size=800, overlap_size=200):
     """
     Create chunks using a sliding window approach while tracking page numbers.
     Each chunk is built by concatenating cleaned paragraphs until it reaches at least
     chunk_size characters, then extended until the end of the sentence if needed.
-    Returns a list of tuples: (chunk_text, page_number).
+    Pages are consumed one at a time, so text_by_page can be a generator of any length.
+    Yields tuples: (chunk_text, start_page, end_page), the pages holding its first and last character.
+
+    The window is a span [start, end) of one buffer moved by offsets instead of rebuilding the
+    string, pages are located by an index of the offsets where they begin, and the search for the
+    next period resumes where the previous one stopped, so the text is scanned in linear time.
+    The buffer is compacted to the unread window whenever a page is appended.
     """
-    logger.info(f"Creating chunks from {len(text_by_page)} pages...")
-    
-    chunks = []
-    current_text = ""
-    current_pages = set()
-    
+    buffer, start, end = "", 0, 0
+    page_starts, page_nums = [], []  # offset in buffer where each page's text begins
+    # First period at or after the last search start, or -1; text in [searched_from, scanned) has none
+    period, scanned = -1, 0
+
+    def page_at(offset):
+        return page_nums[bisect.bisect_right(page_starts, offset) - 1]
+
     for page_num, text in text_by_page:
         cleaned_para = clean_chunk(text)
         if not cleaned_para:
             continue
-            
-        current_text += cleaned_para + " "
-        current_pages.add(page_num)
-        
-        while len(current_text) >= chunk_size:
-            chunk = current_text[:chunk_size]
-            
-            if len(current_text) > chunk_size and current_text[chunk_size] == '.':
-                chunk = current_text[:chunk_size+1]
-            elif not chunk.rstrip().endswith('.'):
-                period_index = current_text.find('.', chunk_size)
-                if period_index != -1:
-                    chunk = current_text[:period_index + 1]
-            
-            chunk = chunk.strip()
+
+        # Keep the unread window (pages reaching into it included) and append the page behind it
+        keep = max(bisect.bisect_right(page_starts, start) - 1, 0)
+        page_starts = [max(offset - start, 0) for offset in page_starts[keep:]]
+        page_nums = page_nums[keep:]
+        period = period - start if period >= start else -1
+        scanned = max(scanned - start, 0)
+        buffer = buffer[start:end]
+        page_starts.append(len(buffer))
+        page_nums.append(page_num)
+        buffer += cleaned_para + " "
+        start, end = 0, len(buffer)
+
+        while end - start >= chunk_size:
+            chunk_end = start + chunk_size
+            last_char = chunk_end - 1
+            while last_char > start and buffer[last_char].isspace():
+                last_char -= 1
+            if end - start > chunk_size and buffer[chunk_end] == '.':
+                chunk_end += 1
+            elif buffer[last_char] != '.':
+                # First period at or after start + chunk_size within the window
+                if period < start + chunk_size:
+                    period = buffer.find('.', max(start + chunk_size, scanned), end)
+                    scanned = end if period == -1 else period
+                if period != -1:
+                    chunk_end = period + 1
+
+            window = buffer[start:chunk_end]
+            chunk = window.strip()
             if chunk:
-                start_page = min(current_pages) if current_pages else page_num
-                end_page = max(current_pages) if current_pages else page_num
-                chunks.append((chunk, start_page, end_page))
-            
-            current_text = current_text[len(chunk) - overlap_size:].strip()
-            current_pages = {page_num}
-    
-    if current_text.strip():
-        start_page = min(current_pages) if current_pages else page_num
-        end_page = max(current_pages) if current_pages else page_num
-        chunks.append((current_text.strip(), start_page, end_page))
-    
+                chunk_start = start + len(window) - len(window.lstrip())
+                yield chunk, page_at(chunk_start), page_at(chunk_start + len(chunk) - 1)
+
+            # The window moves to overlap_size characters before the end of the chunk, stripped
+            step = len(chunk) - overlap_size
+            start = start + step if step >= 0 else max(start, end + step)
+            while start < end and buffer[start].isspace():
+                start += 1
+            while end > start and buffer[end - 1].isspace():
+                end -= 1
+
+    window = buffer[start:end]
+    if window.strip():
+        chunk = window.strip()
+        chunk_start = start + len(window) - len(window.lstrip())
+        yield chunk, page_at(chunk_start), page_at(chunk_start + len(chunk) - 1)
+
+
+def read_and_split_text(text_by_page, chunk_size=800, overlap_size=200):
+    """ All chunks of text_by_page as a list of (chunk_text, start_page, end_page), see iter_chunks """
+    logger.info("Creating chunks...")
+    chunks = list(iter_chunks(text_by_page, chunk_size, overlap_size))
     logger.info(f"Created {len(chunks)} chunks")
     return chunks
 
@@ -298,104 +409,23 @@ def process_document(file_path):
     except Exception as e:
         return [], f"Error processing document {file_path}\n{e}"
 
-def create_langchain_documents(found_files, collection_name):
+def create_langchain_documents(found_files, collection_name, workers=None):
     """
     Create langchain documents from the extracted and processed text.
-    Now uses sliding window chunking for better text segmentation.
-    Improved page number handling to avoid unnecessary ranges.
+    Files are extracted and chunked in parallel by the ingest pipeline, embedded in
+    batches across files and inserted into Milvus; progress is yielded per file.
     """
-    db_utility.create_user_access(collection_name)
-    db_utility.chunking_monitor()
-    db_utility.create_error_files(collection_name)
-
-    # Process found files
-    for file_index, file in enumerate(found_files):
-        text_by_page, message = process_document(file)
-        if text_by_page and 'error' not in message.lower():
-            chunks = read_and_split_text(text_by_page)
-            logger.info(f"Current processing file {file} with {len(chunks)} chunks")
-            
-            if chunks:
-                documents = []
-                for chunk, start_page, end_page in chunks:
-                    doc = Document(
-                        page_content=chunk,
-                        metadata={
-                            'source': file,
-                            'page': str(start_page)
-                        }
-                    )
-                    documents.append(doc)
-
-                if documents:
-                    try:
-                        Milvus.from_documents(
-                            documents,
-                            embeddings,
-                            collection_name=collection_name,
-                            connection_args={'uri': "http://localhost:19530"}
-                        )
-                        db_utility.insert_user_access(file, 'YES', message, collection_name)
-                    except Exception as e:
-                        error_message = f"Error inserting into Milvus: {str(e)}"
-                        logger.error(error_message)
-                        db_utility.store_error_files_with_error(collection_name, file, error_message)
-            else:
-                db_utility.store_error_files_with_error(collection_name, file, "No valid chunks generated")
-                
-        elif "error" in message.lower() and "ocr" not in message.lower():
-            db_utility.store_error_files_with_error(collection_name, file, message)
-            logger.error(f"Error in the document - Skipping {file}")
-            
-        progress_percentage = (file_index + 1) / len(found_files) * 100
-        yield {"progress_percentage": progress_percentage, "current_progress": file_index + 1, "total_files": len(found_files)}
-
-    # Process OCR files
-    for ocr_file_index, ocr_file in enumerate(tqdm(OCR_LIST, desc="Overall Progress")):
-        tqdm().set_description(f"Processing File: {ocr_file}")
-        text_by_page, message = process_ocr_document(ocr_file)
-        if text_by_page:
-            chunks = read_and_split_text(text_by_page)
-            logger.info(f"Current processing OCR file {ocr_file} with {len(chunks)} chunks")
-            
-            if chunks:
-                documents = []
-                for chunk, start_page, end_page in chunks:
-                    doc = Document(
-                        page_content=chunk,
-                        metadata={
-                            'source': ocr_file,
-                            'page': str(start_page)
-                        }
-                    )
-                    documents.append(doc)
-                    
-                if documents:
-                    try:
-                        Milvus.from_documents(
-                            documents,
-                            embeddings,
-                            collection_name=collection_name,
-                            connection_args={'uri': "http://localhost:19530"}
-                        )
-                        db_utility.update_ocr_status(ocr_file, collection_name)
-                    except Exception as e:
-                        error_message = f"Error inserting OCR document into Milvus: {str(e)}"
-                        logger.error(error_message)
-                        db_utility.store_error_files_with_error(collection_name, ocr_file, error_message)
-                        
-        progress_percentage = (ocr_file_index + 1) / len(OCR_LIST) * 100
-        yield {"progress_percentage": progress_percentage, "current_progress": ocr_file_index + 1, "total_files": len(OCR_LIST)}
-
+    from cohere_app.Chunking_UI.ingest_pipeline import IngestPipeline
+    yield from IngestPipeline(collection_name, workers=workers).run(found_files)
 
 
 def create_faiss_index(doc_path: str, faiss_folder: str):
     text_by_page, message = process_document(doc_path)
     
-    if doc_path in OCR_LIST and not text_by_page:
-        text_by_page, message = process_ocr_document(doc_path)
+    if text_by_page and "ocr" in message.lower():
+        text_by_page = ocr_engine.fill_empty_pages(doc_path, text_by_page)
     if not text_by_page:
-        raise ValueError("failed to extract text from document: {message}")
+        raise ValueError(f"failed to extract text from document: {message}")
 
     documents = []
     for page_num, page_text in text_by_page:
@@ -407,7 +437,7 @@ def create_faiss_index(doc_path: str, faiss_folder: str):
         documents.append(doc)
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=50)
     split_docs = text_splitter.split_documents(documents)
-    faiss_index = FAISS.from_documents(split_docs, embeddings)
+    faiss_index = FAISS.from_documents(split_docs, cached_embeddings.get())
     desktop_path = os.path.join(os.path.expanduser("~"), "Desktop", faiss_folder)
     os.makedirs(desktop_path, exist_ok=True)
     faiss_index.save_local(desktop_path)
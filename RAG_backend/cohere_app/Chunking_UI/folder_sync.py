@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import hashlib
+from pymilvus import connections, utility, Collection
+from .enable_logging import logger
+from cohere_app.Chunking_UI import db_utility
+from cohere_app.Chunking_UI.milvus_writer import MILVUS_ALIAS, host, port
+from cohere_app.Chunking_UI import file_catalog
+from cohere_app.lexical_index import lexical_index
+
+DELETE_BATCH_SIZE = 100
+
+
+def parse_extensions(extensions):
+    """ EXTENSIONS may be a list or a string such as ".pdf,.docx" or "['.pdf', '.docx']" """
+    if isinstance(extensions, str):
+        extensions = re.split(r'[\s,\[\]\'"]+', extensions)
+    return tuple(ext for ext in extensions if ext)
+
+
+def scan_folder(root_dir, extensions):
+    """ Walk root_dir once and return {path: (size, mtime_ns)} of every file with a matching extension """
+    extensions = parse_extensions(extensions)
+    found = {}
+    stack = [root_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(extensions) and entry.is_file():
+                    stat = entry.stat()
+                    found[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return found
+
+
+def content_hash(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def plan_sync(collection_name, source, extensions):
+    """
+    Compare the folder against the collection manifest in a single scan.
+    Only files whose size or mtime moved are hashed, so an unchanged share costs one stat per file.
+    Only files under source are ever planned for deletion. Files of the folder ingested without a manifest entry (before the manifest existed, or by a plain
+    ingest) are found in the user_access table, and count as deleted once they are gone from disk.
+    Returns a dict of added, modified and deleted paths, the unchanged count and the
+    (size, mtime_ns, hash) of every added or modified file for the manifest.
+    """
+    db_utility.create_user_access(collection_name)
+    db_utility.create_file_manifest(collection_name)
+    manifest = db_utility.fetch_file_manifest(collection_name)
+    already_chunked = set(db_utility.fetch_all_documents(collection_name))
+    scanned = scan_folder(source, extensions)
+
+    added, modified, adopted, touched = [], [], [], []
+    pending = {}
+    unchanged = 0
+    for path, (size, mtime_ns) in scanned.items():
+        known = manifest.get(path)
+        if known is None:
+            if path in already_chunked:
+                # Ingested before the manifest existed: trust it and start tracking it
+                adopted.append((path, size, mtime_ns, content_hash(path)))
+            else:
+                added.append(path)
+                pending[path] = (size, mtime_ns, content_hash(path))
+        elif known[0] == size and known[1] == mtime_ns:
+            unchanged += 1
+        else:
+            file_hash = content_hash(path)
+            if file_hash == known[2]:
+                touched.append((path, size, mtime_ns, file_hash))
+                unchanged += 1
+            else:
+                modified.append(path)
+                pending[path] = (size, mtime_ns, file_hash)
+
+    # A collection may hold several folders, only files of this one can have been deleted from it
+    folder = os.path.join(os.path.normpath(source), "")
+    deleted = [path for path in manifest if path not in scanned and path.startswith(folder)]
+    deleted += sorted(path for path in already_chunked
+                      if path not in manifest and path not in scanned and path.startswith(folder))
+    if adopted or touched:
+        db_utility.upsert_file_manifest(collection_name, adopted + touched)
+    logger.info(f"Sync plan for {collection_name}: {len(added)} added, {len(modified)} modified, "
+                f"{len(deleted)} deleted, {unchanged + len(adopted)} unchanged")
+    return {
+        "added": added,
+        "modified": modified,
+        "deleted": deleted,
+        "unchanged": unchanged + len(adopted),
+        "pending": pending,
+    }
+
+
+def remove_sources(collection_name, sources):
+    """ Delete the vectors, lexical index entries, catalog and user access rows of the given source files """
+    if not sources:
+        return
+    connections.connect(MILVUS_ALIAS, host=host, port=port)
+    if utility.has_collection(collection_name, using=MILVUS_ALIAS):
+        collection = Collection(collection_name, using=MILVUS_ALIAS)
+        for start in range(0, len(sources), DELETE_BATCH_SIZE):
+            collection.delete(f"source in {json.dumps(sources[start:start + DELETE_BATCH_SIZE])}")
+    lexical_index.delete_sources(collection_name, sources)
+    file_catalog.remove_files(collection_name, sources)
+    db_utility.delete_user_access(collection_name, sources)
+
+
+def apply_sync(collection_name, plan, workers=None):
+    """
+    Remove the vectors of deleted and modified files, re-chunk added and modified ones,
+    and record every file that was ingested successfully in the manifest.
+    Yields the progress of create_langchain_documents.
+    """
+    from cohere_app.Chunking_UI.file_process import create_langchain_documents
+
+    remove_sources(collection_name, plan["deleted"] + plan["modified"])
+    if plan["deleted"]:
+        db_utility.delete_file_manifest(collection_name, plan["deleted"])
+
+    to_chunk = plan["added"] + plan["modified"]
+    if to_chunk:
+        yield from create_langchain_documents(to_chunk, collection_name, workers=workers)
+
+    # Files that failed are left out of the manifest so the next sync retries them
+    chunked = set(db_utility.fetch_all_documents(collection_name))
+    entries = [(path, *plan["pending"][path]) for path in to_chunk if path in chunked]
+    if entries:
+        db_utility.upsert_file_manifest(collection_name, entries)
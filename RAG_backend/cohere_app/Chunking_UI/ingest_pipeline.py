@@ -0,0 +1,322 @@
+import os
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from .enable_logging import logger
+from cohere_app.Chunking_UI import db_utility
+from cohere_app.Chunking_UI.milvus_writer import MilvusIngestWriter
+from cohere_app.Chunking_UI import file_catalog
+from cohere_app.Chunking_UI.file_process import process_document, extract_text_pdf, read_and_split_text, iter_chunks, cached_embeddings
+from cohere_app.Chunking_UI.ocr_engine import ocr_engine
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+# Upper bound of the workers a create_collection request may ask for
+MAX_INGEST_WORKERS = max(INGEST_WORKERS, os.cpu_count() or 1)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 64))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))
+# TXT/CSV/XLSX files from this size on are chunked as a stream in the parent process and
+# embedded and inserted in parts of INGEST_STREAM_PART_CHUNKS chunks instead of as a whole
+INGEST_STREAM_MIN_BYTES = int(os.getenv("INGEST_STREAM_MIN_BYTES", 32 * 1024 * 1024))
+INGEST_STREAM_PART_CHUNKS = int(os.getenv("INGEST_STREAM_PART_CHUNKS", 256))
+STREAMED_EXTENSIONS = ('.txt', '.csv', '.xlsx')
+
+_DONE = object()
+
+
+def extract_and_chunk(file_path):
+    """
+    Pool worker: extract the text of one file and split it into chunks.
+    Returns (file_path, chunks, message, last) where chunks is None when no text could be extracted
+    and last is always True, the file being a single part.
+    """
+    try:
+        text_by_page, message = process_document(file_path)
+        if text_by_page and 'error' not in message.lower():
+            return file_path, read_and_split_text(text_by_page), message, True
+        return file_path, None, message, True
+    except Exception as e:
+        return file_path, None, f"Error processing document {file_path}\n{e}", True
+
+
+def is_streamed(file_path):
+    """ Large TXT/CSV/XLSX files, whose chunks are too many to pass around at once """
+    try:
+        return file_path.endswith(STREAMED_EXTENSIONS) and os.path.getsize(file_path) >= INGEST_STREAM_MIN_BYTES
+    except OSError:
+        return False
+
+
+class IngestPipeline:
+    """
+    Staged ingest of a list of files into a Milvus collection:
+    a process pool extracts and chunks files, a bounded queue feeds a single batched
+    embedding stage, and the calling thread buffers the vectors into bulk Milvus inserts
+    and yields progress as files are acknowledged.
+    Large TXT/CSV/XLSX files skip the pool: a stream stage chunks them page by page and
+    sends their chunks in parts, so their size never has to fit in memory.
+    """
+
+    def __init__(self, collection_name, workers=None, queue_size=INGEST_QUEUE_SIZE, embed_batch_size=EMBED_BATCH_SIZE,
+                 stream_part_chunks=INGEST_STREAM_PART_CHUNKS):
+        self.collection_name = collection_name
+        self.workers = min(max(1, int(workers or INGEST_WORKERS)), MAX_INGEST_WORKERS)
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+        self.stream_part_chunks = stream_part_chunks
+        self._stop = threading.Event()
+        self._errors = []
+        self.chunks_written = 0
+        self.files_failed = 0
+
+    def _put(self, target_queue, item):
+        while not self._stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source_queue):
+        while not self._stop.is_set():
+            try:
+                return source_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _extract_stage(self, found_files, extracted):
+        try:
+            # spawn, since this runs on a job thread of a server that already runs torch and gRPC threads,
+            # and forking such a process can deadlock the child
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                pending = {}
+                files = iter(found_files)
+                while not self._stop.is_set():
+                    # Keep a bounded number of files in flight so results never pile up in memory
+                    for file in files:
+                        pending[pool.submit(extract_and_chunk, file)] = file
+                        if len(pending) >= self.workers * 2:
+                            break
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file = pending.pop(future)
+                        try:
+                            self._put(extracted, future.result())
+                        except Exception as e:
+                            self._put(extracted, (file, None, f"Error processing document {file}\n{e}", True))
+        except Exception as e:
+            logger.exception("Extraction stage failed")
+            self._errors.append(e)
+        finally:
+            self._put(extracted, _DONE)
+
+    def _stream_file(self, file, extracted):
+        """ Chunk one large file as its pages are read, putting its chunks in parts of stream_part_chunks """
+        try:
+            text_by_page, message = process_document(file)
+            if not text_by_page or 'error' in message.lower():
+                self._put(extracted, (file, None, message, True))
+                return
+            part = []
+            for chunk in iter_chunks(text_by_page):
+                part.append(chunk)
+                if len(part) >= self.stream_part_chunks:
+                    self._put(extracted, (file, part, message, False))
+                    part = []
+                if self._stop.is_set():
+                    return
+            self._put(extracted, (file, part, message, True))
+        except Exception as e:
+            self._put(extracted, (file, None, f"Error processing document {file}\n{e}", True))
+
+    def _stream_stage(self, streamed_files, extracted):
+        try:
+            for file in streamed_files:
+                if self._stop.is_set():
+                    break
+                logger.info(f"Streaming large file {file}")
+                self._stream_file(file, extracted)
+        except Exception as e:
+            logger.exception("Stream stage failed")
+            self._errors.append(e)
+        finally:
+            self._put(extracted, _DONE)
+
+    def embed(self, items):
+        """ Embed the chunks of several files in one model call, returns (file, chunks, message, vectors, last) """
+        texts = [chunk for _, chunks, _, _ in items for chunk, _, _ in chunks]
+        vectors = cached_embeddings.get().embed_documents(texts) if texts else []
+        embedded = []
+        offset = 0
+        for file, chunks, message, last in items:
+            embedded.append((file, chunks, message, vectors[offset:offset + len(chunks)], last))
+            offset += len(chunks)
+        return embedded
+
+    def _embed_stage(self, extracted, embedded, producers=1):
+        batch, batch_chunks = [], 0
+        try:
+            while not self._stop.is_set():
+                item = self._get(extracted)
+                if item is _DONE:
+                    producers -= 1
+                    if producers:
+                        continue
+                    break
+                file, chunks, message, last = item
+                if not chunks:
+                    self._put(embedded, (file, chunks, message, [], last))
+                    continue
+                batch.append(item)
+                batch_chunks += len(chunks)
+                if batch_chunks >= self.embed_batch_size:
+                    for result in self.embed(batch):
+                        self._put(embedded, result)
+                    batch, batch_chunks = [], 0
+            if batch:
+                for result in self.embed(batch):
+                    self._put(embedded, result)
+        except Exception as e:
+            logger.exception("Embedding stage failed")
+            self._errors.append(e)
+        finally:
+            self._put(embedded, _DONE)
+
+    def _store_error(self, file, message):
+        self.files_failed += 1
+        db_utility.store_error_files_with_error(self.collection_name, file, message)
+
+    def _progress(self, completed, total_files):
+        return {
+            "progress_percentage": completed / total_files * 100,
+            "current_progress": completed,
+            "total_files": total_files,
+            "chunks_completed": self.chunks_written,
+            "files_failed": self.files_failed,
+        }
+
+    def _record(self, results):
+        """ Record the outcome of flushed files, only now that Milvus has acknowledged them """
+        for result in results:
+            if result["error"]:
+                self._store_error(result["file"], result["error"])
+            else:
+                self.chunks_written += len(result["pks"])
+                db_utility.insert_user_access(result["file"], 'YES', result["message"], self.collection_name)
+        file_catalog.record_files(self.collection_name, results)
+        return len(results)
+
+    def run(self, found_files):
+        """
+        Ingest found_files, yielding progress as files complete in the same shape as
+        create_langchain_documents plus running chunks_completed and files_failed counts.
+        """
+        db_utility.create_user_access(self.collection_name)
+        db_utility.chunking_monitor()
+        db_utility.create_error_files(self.collection_name)
+        file_catalog.ensure_file_catalog(self.collection_name)
+
+        streamed = {file for file in found_files if is_streamed(file)}
+        streamed_files = [file for file in found_files if file in streamed]
+        pooled_files = [file for file in found_files if file not in streamed]
+        extracted = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        stages = [
+            threading.Thread(target=self._extract_stage, args=(pooled_files, extracted), daemon=True),
+            threading.Thread(target=self._stream_stage, args=(streamed_files, extracted), daemon=True),
+            threading.Thread(target=self._embed_stage, args=(extracted, embedded, 2), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+
+        writer = MilvusIngestWriter(self.collection_name)
+        ocr_files = []
+        completed = 0
+        try:
+            while True:
+                item = embedded.get()
+                if item is _DONE:
+                    break
+                file, chunks, message, vectors, last = item
+                finished = 0
+                if writer.is_open(file):
+                    # A later part of a streamed file; its final part may be empty, or None when extraction broke off
+                    error = message if chunks is None else None
+                    finished = self._record(writer.add(file, chunks or [], vectors, message, last=last, error=error))
+                elif chunks:
+                    logger.info(f"Current processing file {file} with {len(chunks)} chunks")
+                    finished = self._record(writer.add(file, chunks, vectors, message, last=last))
+                elif chunks is not None:
+                    self._store_error(file, "No valid chunks generated")
+                    finished = 1
+                elif "ocr" in message.lower():
+                    ocr_files.append(file)
+                    finished = 1
+                else:
+                    if "error" in message.lower():
+                        self._store_error(file, message)
+                        logger.error(f"Error in the document - Skipping {file}")
+                    finished = 1
+
+                if finished:
+                    completed += finished
+                    yield self._progress(completed, len(found_files))
+            completed += self._record(writer.flush())
+        finally:
+            self._stop.set()
+            for stage in stages:
+                stage.join()
+        if self._errors:
+            raise self._errors[0]
+        if found_files:
+            yield self._progress(completed, len(found_files))
+
+        yield from self.run_ocr(ocr_files, writer)
+
+    def _record_ocr(self, results):
+        for result in results:
+            if result["error"]:
+                self._store_error(result["file"], result["error"])
+            else:
+                # OCR files never got a user access row, so record them here rather than updating one
+                self.chunks_written += len(result["pks"])
+                db_utility.insert_user_access(result["file"], 'YES', 'text extraction done', self.collection_name)
+        file_catalog.record_files(self.collection_name, results)
+        return len(results)
+
+    def run_ocr(self, ocr_files, writer):
+        """
+        OCR the pages without a text layer of the PDFs found during extraction, merge them back
+        with the text pages and ingest the result through the same embed/insert stages.
+        """
+        documents = ((ocr_file, extract_text_pdf(ocr_file)[0]) for ocr_file in ocr_files)
+        completed = 0
+        for ocr_file, text_by_page, ocr_error in ocr_engine.fill_empty_pages_many(documents):
+            chunks = read_and_split_text(text_by_page) if text_by_page and not ocr_error else []
+            finished = 1
+            if ocr_error:
+                self._store_error(ocr_file, ocr_error)
+            elif chunks:
+                logger.info(f"Current processing OCR file {ocr_file} with {len(chunks)} chunks")
+                try:
+                    (file, chunks, message, vectors, _), = self.embed([(ocr_file, chunks, "text extraction done", True)])
+                    finished = self._record_ocr(writer.add(file, chunks, vectors, message))
+                except Exception as e:
+                    error_message = f"Error inserting OCR document into Milvus: {str(e)}"
+                    logger.error(error_message)
+                    self._store_error(ocr_file, error_message)
+            else:
+                self._store_error(ocr_file, "No valid chunks generated")
+
+            if finished:
+                completed += finished
+                yield self._progress(completed, len(ocr_files))
+        if ocr_files:
+            completed += self._record_ocr(writer.flush())
+            yield self._progress(completed, len(ocr_files))
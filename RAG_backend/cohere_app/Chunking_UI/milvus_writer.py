@@ -0,0 +1,203 @@
+import os
+from dotenv import load_dotenv
+from .enable_logging import logger
+from cohere_app.lexical_index import lexical_index
+from cohere_app.Chunking_UI.collection_builder import collection_builder, host, port, DEFAULT_PARTITION
+
+load_dotenv()
+
+INGEST_FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", 5000))
+# Kept well under the 64 MB default gRPC message limit of Milvus
+INGEST_FLUSH_BYTES = int(os.getenv("INGEST_FLUSH_BYTES", 32 * 1024 * 1024))
+MILVUS_ALIAS = "ingest"
+
+
+def pages_of(chunks):
+    """ Pages the chunks cover: every page of numeric start-end ranges, the labels of CSV and XLSX row ranges """
+    pages = set()
+    for _, start_page, end_page in chunks:
+        if isinstance(start_page, int) and isinstance(end_page, int):
+            pages.update(range(start_page, end_page + 1))
+        else:
+            pages.update((start_page, end_page))
+    return pages
+
+
+class MilvusIngestWriter:
+    """
+    Collects chunks of many files into column-oriented batches (source, page, text, vector)
+    and inserts them, per partition, over a single connection once flush_rows rows or flush_bytes bytes are pending.
+    A file is only reported back as written after every insert holding its chunks was acknowledged;
+    when a batch insert fails its files are retried one at a time, so only the ones Milvus rejects fail.
+    Acknowledged chunks are also added to the lexical index under their Milvus primary keys.
+    Large files can arrive in several parts; they are reported once with the final part, and their
+    earlier parts are rolled back if any part fails.
+    """
+
+    def __init__(self, collection_name, flush_rows=INGEST_FLUSH_ROWS, flush_bytes=INGEST_FLUSH_BYTES):
+        self.collection_name = collection_name
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.collection = None
+        # file -> {"pks", "pages", "error"} of files whose final part has not been flushed yet
+        self.open_files = {}
+        self._reset()
+
+    def _reset(self):
+        self.columns = {"source": [], "page": [], "text": [], "vector": []}
+        self.files = []
+        self.pending_bytes = 0
+
+    @property
+    def pending_rows(self):
+        return len(self.columns["text"])
+
+    def is_open(self, file):
+        return file in self.open_files
+
+    def add(self, file, chunks, vectors, message, last=True, error=None):
+        """
+        Buffer the chunks of one file, or of one part of it with last=False for all but the final part.
+        error fails the file, e.g. when its extraction broke off after earlier parts were added.
+        Returns the per-file results of any flush this triggered, see flush() for their shape.
+        """
+        for (chunk, start_page, _), vector in zip(chunks, vectors):
+            page = str(start_page)
+            self.columns["source"].append(file)
+            self.columns["page"].append(page)
+            self.columns["text"].append(chunk)
+            self.columns["vector"].append(vector)
+            self.pending_bytes += len(file) + len(page) + len(chunk.encode('utf-8')) + 4 * len(vector)
+        self.files.append({"file": file, "message": message, "rows": len(chunks), "pages": pages_of(chunks),
+                           "last": last, "error": error})
+        if not last:
+            self.open_files.setdefault(file, {"pks": [], "pages": set(), "error": None})
+
+        if self.pending_rows >= self.flush_rows or self.pending_bytes >= self.flush_bytes:
+            return self.flush()
+        return []
+
+    def _insert_columns(self, rows, partition):
+        data = [[self.columns[field.name][row] for row in rows]
+                for field in self.collection.schema.fields if not field.auto_id]
+        partition_name = None if partition == DEFAULT_PARTITION else partition
+        return self.collection.insert(data, partition_name=partition_name).primary_keys
+
+    def _insert(self, rows):
+        """
+        Insert the buffered rows, each into the partition of its file; returns their primary keys in the
+        order of rows. On failure the rows already inserted are deleted again before the error is raised.
+        """
+        sources = self.columns["source"]
+        partitions = collection_builder.partitions_for(self.collection, {sources[row] for row in rows})
+        rows_by_partition = {}
+        for row in rows:
+            rows_by_partition.setdefault(partitions[sources[row]], []).append(row)
+        primary_keys = {}
+        try:
+            for partition, partition_rows in rows_by_partition.items():
+                # A single oversized file can exceed the byte budget on its own, so insert in row slices
+                for start in range(0, len(partition_rows), self.flush_rows):
+                    batch = partition_rows[start:start + self.flush_rows]
+                    primary_keys.update(zip(batch, self._insert_columns(batch, partition)))
+        except Exception:
+            if primary_keys:
+                # Do not leave half of a batch behind for files that will be reported as failed
+                self._delete(list(primary_keys.values()))
+            raise
+        return [primary_keys[row] for row in rows]
+
+    def _insert_each_file(self, files):
+        """
+        Insert the rows of every buffered file on its own, after the insert of the whole batch failed,
+        so only the files Milvus rejects are failed. Returns the primary key of every buffered row,
+        None for rows of failed files, and the error of every file.
+        """
+        primary_keys = [None] * self.pending_rows
+        errors = []
+        offset = 0
+        for entry in files:
+            rows = range(offset, offset + entry["rows"])
+            offset += entry["rows"]
+            error = None
+            if rows:
+                try:
+                    primary_keys[rows.start:rows.stop] = self._insert(rows)
+                except Exception as e:
+                    error = f"Error inserting into Milvus: {str(e)}"
+                    logger.error(f"{error} ({entry['file']})")
+            errors.append(error)
+        return primary_keys, errors
+
+    def _index_lexical(self, primary_keys):
+        # BM25 side of hybrid search; a failure here only costs keyword recall, the file stays stored
+        rows = [row for row, pk in enumerate(primary_keys) if pk is not None]
+        try:
+            lexical_index.add(self.collection_name, [primary_keys[row] for row in rows],
+                              [self.columns["source"][row] for row in rows], [self.columns["text"][row] for row in rows])
+        except Exception as e:
+            logger.error(f"Could not add chunks to the lexical index of {self.collection_name}: {e}")
+
+    def _delete(self, primary_keys):
+        try:
+            lexical_index.delete_pks(self.collection_name, primary_keys)
+        except Exception as e:
+            logger.error(f"Could not remove chunks from the lexical index of {self.collection_name}: {e}")
+        try:
+            for start in range(0, len(primary_keys), self.flush_rows):
+                self.collection.delete(f"pk in {list(primary_keys[start:start + self.flush_rows])}")
+        except Exception as delete_error:
+            logger.error(f"Could not roll back partial insert: {delete_error}")
+
+    def flush(self):
+        """
+        Insert everything buffered. Returns one dict per buffered file, or per final part of a file
+        added in parts: {"file", "message", "pks", "pages", "error"} where pages counts the pages its
+        chunks cover and error is None once the file is stored.
+        """
+        if not self.files:
+            return []
+        files = self.files
+        primary_keys = [None] * self.pending_rows
+        errors = [None] * len(files)
+        try:
+            if self.pending_rows:
+                if self.collection is None:
+                    self.collection = collection_builder.get_or_create(
+                        self.collection_name, len(self.columns["vector"][0]), MILVUS_ALIAS)
+                try:
+                    primary_keys = self._insert(range(self.pending_rows))
+                except Exception as e:
+                    logger.error(f"Error inserting into Milvus: {str(e)}; retrying the {len(files)} files one at a time")
+                    primary_keys, errors = self._insert_each_file(files)
+                self._index_lexical(primary_keys)
+        except Exception as e:
+            error = f"Error inserting into Milvus: {str(e)}"
+            logger.error(error)
+            errors = [error] * len(files)
+        finally:
+            self._reset()
+
+        results = []
+        offset = 0
+        for entry, error in zip(files, errors):
+            pks = [] if error else primary_keys[offset:offset + entry["rows"]]
+            offset += entry["rows"]
+            pages = entry["pages"]
+            file_error = error or entry["error"]
+            streamed = self.open_files.get(entry["file"])
+            if streamed is not None:
+                streamed["pks"].extend(pks)
+                streamed["pages"].update(pages)
+                streamed["error"] = streamed["error"] or file_error
+                if not entry["last"]:
+                    continue
+                del self.open_files[entry["file"]]
+                pks, pages, file_error = streamed["pks"], streamed["pages"], streamed["error"]
+                if file_error and pks:
+                    self._delete(pks)
+                    pks = []
+            results.append({"file": entry["file"], "message": entry["message"], "pks": pks, "pages": len(pages),
+                            "error": file_error})
+        logger.info(f"Flushed {offset} chunks of {len(files)} files into {self.collection_name}")
+        return results
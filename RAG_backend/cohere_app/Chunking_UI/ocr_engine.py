@@ -0,0 +1,196 @@
+import os
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import fitz
+import numpy as np
+from dotenv import load_dotenv
+from .enable_logging import logger
+
+load_dotenv()
+
+OCR_DPI = int(os.getenv("OCR_DPI", 144))
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", 8))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", min(4, os.cpu_count() or 1)))
+OCR_THREADS_PER_WORKER = int(os.getenv("OCR_THREADS_PER_WORKER", 1))
+
+_predictor = None
+
+
+def _init_worker(threads):
+    """ Load the doctr predictor once per pool process """
+    global _predictor
+    import torch
+    from doctr.models import ocr_predictor
+    torch.set_num_threads(threads)
+    _predictor = ocr_predictor(pretrained=True)
+
+
+def ocr_page_text(page):
+    """ Join the words of a doctr page top-to-bottom, left-to-right """
+    words = [word for block in page.blocks for line in block.lines for word in line.words]
+    sorted_words = sorted(words, key=lambda word: (word.geometry[0][1], word.geometry[0][0]))
+    return " ".join([word.value for word in sorted_words])
+
+
+def rasterize_page(pdf, page_num, dpi):
+    pixmap = pdf[page_num].get_pixmap(dpi=dpi, alpha=False)
+    return np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+
+
+def _ocr_batch(pdf_path, page_numbers, dpi):
+    with fitz.open(pdf_path) as pdf:
+        images = [rasterize_page(pdf, page_num, dpi) for page_num in page_numbers]
+    result = _predictor(images)
+    return [(page_num, ocr_page_text(page)) for page_num, page in zip(page_numbers, result.pages)]
+
+
+class OcrEngine:
+    """
+    Page-level OCR over a pool of processes that each hold a doctr predictor.
+    Only the requested pages are rasterized, in batches of batch_size pages per task,
+    and a batch that fails leaves its pages empty instead of failing the whole document.
+    A worker dying, e.g. killed for memory, breaks the pool; it is then replaced by a new one
+    and only the document being collected fails.
+    """
+
+    def __init__(self, workers=OCR_WORKERS, batch_size=OCR_BATCH_SIZE, dpi=OCR_DPI, threads_per_worker=OCR_THREADS_PER_WORKER):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.dpi = dpi
+        self.threads_per_worker = threads_per_worker
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn, since forking a process that already runs torch threads can deadlock
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.threads_per_worker,),
+                )
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """ Drop a broken pool so the next submit starts a new one """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, pdf_path, page_numbers):
+        """ (pool, [(batch, future)]) of the pages; a pool found broken is discarded and BrokenProcessPool raised """
+        pool = self._get_pool()
+        try:
+            return pool, [
+                (batch, pool.submit(_ocr_batch, pdf_path, batch, self.dpi))
+                for batch in (page_numbers[i:i + self.batch_size] for i in range(0, len(page_numbers), self.batch_size))
+            ]
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def _resubmit_lost(self, pdf_path, futures):
+        """ Submit again, to the current pool, the batches whose task was lost with a broken pool """
+        pool = self._get_pool()
+        try:
+            return pool, [
+                (batch, future) if future.done() and not isinstance(future.exception(), BrokenProcessPool)
+                else (batch, pool.submit(_ocr_batch, pdf_path, batch, self.dpi))
+                for batch, future in futures
+            ]
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def _submit_retrying(self, submit, pdf_path, pages):
+        """
+        (pool, futures, None) of submit(pdf_path, pages), retried once on a new pool when the pool
+        breaks while the batches are submitted; (None, [], error) when the new one breaks too
+        """
+        try:
+            return (*submit(pdf_path, pages), None)
+        except BrokenProcessPool as e:
+            logger.error(f"OCR pool broke while queuing {pdf_path}, restarting the OCR pool: {e}")
+        try:
+            return (*submit(pdf_path, pages), None)
+        except BrokenProcessPool as e:
+            return None, [], f"OCR failed, its worker process died: {e}"
+
+    @staticmethod
+    def _collect(pdf_path, futures):
+        """ {page_num: text} of the batches; raises BrokenProcessPool when the pool lost a worker """
+        texts = {}
+        for batch, future in futures:
+            try:
+                texts.update(future.result())
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                logger.error(f"OCR failed for pages {batch} of {pdf_path}: {e}")
+        return texts
+
+    def ocr_pages(self, pdf_path, page_numbers):
+        """ Returns {page_num: text} for the given 0-based page numbers """
+        pool, futures = self._submit(pdf_path, list(page_numbers))
+        try:
+            return self._collect(pdf_path, futures)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def fill_empty_pages(self, pdf_path, text_by_page):
+        """ OCR the pages of text_by_page that have no text and return all pages in page order """
+        empty_pages = [page_num for page_num, text in text_by_page if not text.strip()]
+        texts = self.ocr_pages(pdf_path, empty_pages) if empty_pages else {}
+        return [(page_num, texts.get(page_num, text)) for page_num, text in text_by_page]
+
+    def fill_empty_pages_many(self, documents):
+        """
+        documents: iterable of (pdf_path, text_by_page). Yields (pdf_path, merged text_by_page, error)
+        per document in order, error being None unless the OCR of the document was lost with a worker.
+        Pages of up to workers * 2 documents are queued on the pool at a time.
+        """
+        in_flight = deque()
+        documents = iter(documents)
+        while True:
+            # Keep a bounded number of documents queued so their pages and results never pile up in memory
+            for pdf_path, text_by_page in documents:
+                empty_pages = [page_num for page_num, text in text_by_page if not text.strip()]
+                in_flight.append((pdf_path, text_by_page, *self._submit_retrying(self._submit, pdf_path, empty_pages)))
+                if len(in_flight) >= self.workers * 2:
+                    break
+            if not in_flight:
+                return
+            pdf_path, text_by_page, pool, futures, error = in_flight.popleft()
+            if error:
+                yield pdf_path, text_by_page, error
+                continue
+            try:
+                texts = self._collect(pdf_path, futures)
+            except BrokenProcessPool as e:
+                logger.error(f"OCR worker died during {pdf_path}, restarting the OCR pool: {e}")
+                self._discard_pool(pool)
+                # The other queued documents lost their pending batches with the pool
+                in_flight = deque(
+                    (path, pages, queued_pool, queued, queued_error) if queued_error
+                    else (path, pages, *self._submit_retrying(self._resubmit_lost, path, queued))
+                    for path, pages, queued_pool, queued, queued_error in in_flight
+                )
+                yield pdf_path, text_by_page, f"OCR failed, its worker process died: {e}"
+                continue
+            yield pdf_path, [(page_num, texts.get(page_num, text)) for page_num, text in text_by_page], None
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+ocr_engine = OcrEngine()
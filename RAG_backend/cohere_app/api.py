@@ -1,36 +1,46 @@
 
-# from sentence_transformers import SentenceTransformer
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from threading import Thread
-from sentence_transformers import SentenceTransformer
-from functools import lru_cache 
+# import numpy as np
+import time
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 from pymilvus import connections, Collection
 from .models import CurrentUsingCollection
 import re, os
 from dotenv import load_dotenv
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
 from .Chunking_UI.file_process import create_faiss_index
+from .Chunking_UI.collection_builder import collection_builder
+from .embedding_service import EmbeddingBatcher
+from .retrieval_cache import retrieval_cache
+from .lexical_index import lexical_index, reciprocal_rank_fusion, HYBRID_SEARCH, LEXICAL_SEARCH_LIMIT
+from .session_store import session_store, new_session
+from .faiss_cache import faiss_cache
+from .llm_client import LLMClient
+from .context_assembler import context_assembler
+from .reranker import reranker
+from .search_profiles import search_profiles
+from .guardrail_engine import guardrail_engine
+from .forbidden_bank import ForbiddenBank, load_forbidden_phrases
+from .lazy_resource import LazyResource
+from .Chunking_UI.enable_logging import logger
+from .model_registry import model_registry, embedding_model_id
+from asgiref.sync import sync_to_async
 # from guardrails import Guard
 # from guardrails.hub import ToxicLanguage
 # from guardrails.types import OnFailAction
 load_dotenv()
 
-import requests
-import json
-
 host = os.getenv("HOST")
 port = os.getenv("PORT")
-embedding_model = SentenceTransformer('/home/qa-prod/Desktop/QA/RAG_backend/cohere_app/embedding_model')
-embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2', model_kwargs={'device': "cpu"})
+# Models, the forbidden bank and the Milvus collection are loaded on first use, see lazy_resource.
+# Query encoding, ingestion and uploads share one instance of the embedding model, see model_registry
+embedding_model = LazyResource("embedding_model", model_registry.sentence_transformer)
+embeddings = LazyResource("embeddings", model_registry.embeddings)
+# Shared by the guardrail check and the Milvus search so each query is encoded once
+embedding_service = LazyResource("embedding_service", lambda: EmbeddingBatcher(embedding_model.get()))
 
-url = "http://172.16.34.235:8080/v1/chat/completions"
-headers = {
-    "Content-Type": "application/json"
-}
+url = os.getenv("TGI_URL", "http://172.16.34.235:8080/v1/chat/completions")
 
 prompt = """
 You are an AI assistant designed to assist users by providing simple and clear answers to their questions.
@@ -49,50 +59,18 @@ FORBIDDEN_TERMS = [
     "homicide", "massacre"
 ]
 
-# Positive/neutral terms related to L&T that are acceptable
-NEUTRAL_POSITIVE_TERMS = [
-    "CEO of L&T", "L&T achievements", "L&T growth", "L&T company", 
-    "L&T business", "L&T leadership", "L&T innovation", "L&T history",
-    "Larsen and Toubro", "L&T CEO", "Larsen and Toubro achievements", 
-    "Larsen and Toubro growth", "Larsen and Toubro leadership"
-]
-
-# Precompute the embeddings for forbidden terms
-forbidden_embeddings = embedding_model.encode(FORBIDDEN_TERMS)
-
-# Define regex patterns for additional guardrails
-FORBIDDEN_REGEX_PATTERNS = [
-    r"\bkill\b", r"\bmurder\b", r"\bassassinat(e|ion)\b", r"\bhomicide\b", r"\bmassacre\b",
-    r"\bLarsen\s*and\s*Toubro\b", r"\bpolitical\b", r"\bscandal\b", r"\bvulgar\b",
-    r"\boffensive\b", r"\bcorruption\b", r"\bsexual\b", r"\bharassment\b", r"\babuse\b", 
-    r"\bviolence\b", r"\bracism\b", r"\bterrorism\b", r"\bhate\b", r"\billegal\b", r"\bextremism\b",
-    r"\bfraud\b", r"\bbribery\b", r"\bdiscrimination\b", r"\bprotest\b", r"\bcontroversy\b", 
-    r"\bmisinformation\b"
-]
-
+# Precompute the embeddings for forbidden terms, plus any phrases from FORBIDDEN_BANK_FILE; loaded from disk after the first start
+forbidden_bank = LazyResource(
+    "forbidden_bank",
+    lambda: ForbiddenBank(load_forbidden_phrases(FORBIDDEN_TERMS), embedding_model.get(), embedding_model_id())
+)
 
-forbidden_embeddings = embedding_model.encode(FORBIDDEN_TERMS)
-
-def contains_forbidden_regex(user_input):
-    for pattern in FORBIDDEN_REGEX_PATTERNS:
-        if re.search(pattern, user_input, flags=re.IGNORECASE):
-            return True
-    return False
-
-def contains_forbidden_terms(user_input, threshold=0.7):
-    # Generate the embedding for the user's query
-    user_input_embedding = embedding_model.encode([user_input])
-    # Compute cosine similarity between the user's query and forbidden terms embeddings
-    similarities = cosine_similarity(user_input_embedding, forbidden_embeddings)
-    max_similarity = np.max(similarities)
-    return max_similarity >= threshold
-
-# Function to check if the query contains neutral/positive L&T terms (for allowing these queries)
-def contains_positive_lnt_terms(user_input):
-    for term in NEUTRAL_POSITIVE_TERMS:
-        if term.lower() in user_input.lower():
-            return True
-    return False
+def contains_forbidden_terms(user_input, threshold=0.7, user_input_embedding=None):
+    # Generate the embedding for the user's query unless the caller already has it
+    if user_input_embedding is None:
+        user_input_embedding = embedding_service.get().encode(user_input)
+    # Cosine similarity against the forbidden bank, stopping at the first phrase over the threshold
+    return forbidden_bank.get().matches(user_input_embedding, threshold)
 
 # guard = Guard().use(
 #     ToxicLanguage(threshold=0.5, validation_method="sentence", on_fail=OnFailAction.EXCEPTION)
@@ -110,56 +88,51 @@ def get_current_using_collection_value():
     except Exception as e:
         return str(e) 
 
-collection_name = get_current_using_collection_value()
-
-if collection_name:
-    MILVUS_COLLECTION = collection_name
+llm_client = LLMClient(url, prompt)
 
 def generate_streaming_response(question, context):
-    data = {
-        "model": "tgi",
-        "messages": [
-            {
-                "role": "system",
-                "content": prompt
-            },
-            {
-                "role": "user",
-                "content": f"Refer to the Context scrapped from Vector Database {context} and answer for user question {question}"     
-            }
-        ],
-        "stream": True,
-        "max_tokens": 1500
-    }
-
-    with requests.post(url, headers=headers, data=json.dumps(data), proxies={"http": None, "https": None}, stream=True) as response:
-        if response.status_code == 200:
-            for chunk in response.iter_lines():
-                if chunk:
-                    decoded_chunk = chunk.decode('utf-8')
-                    if decoded_chunk.startswith("data:"):
-                        decoded_chunk = decoded_chunk[5:].strip()
-                    
-                    if decoded_chunk == "[DONE]":
-                        break
-                    
-                    try:
-                        chunk_data = json.loads(decoded_chunk)
-                        content = chunk_data.get('choices', [{}])[0].get('delta', {}).get('content', '')
-                        
-                        if content:
-                            yield content
-                    except json.JSONDecodeError as e:
-                        print(f"JSON Decode Error: {e}")
-                        print(f"Raw chunk (decoded): {decoded_chunk}")
-                    except Exception as e:
-                        print(f"Error processing chunk: {e}")
-        else:
-            print(f"Error: {response.status_code}")
+    # Streams over the client's pooled keep-alive session instead of a new connection per answer
+    return llm_client.stream_chat(question, context)
 
-connections.connect("default", host=host, port= port)
-collection = Collection(MILVUS_COLLECTION)
-collection.load()
+
+# Collection name -> loaded Collection, each loaded once per process
+_milvus_collections = {}
+_milvus_collections_lock = Lock()
+
+
+def open_milvus_collection(collection_name):
+    """ Connect to Milvus and load collection_name on its first use """
+    collection = _milvus_collections.get(collection_name)
+    if collection is None:
+        with _milvus_collections_lock:
+            collection = _milvus_collections.get(collection_name)
+            if collection is None:
+                connections.connect("default", host=host, port= port)
+                collection = Collection(collection_name)
+                collection.load()
+                _milvus_collections[collection_name] = collection
+    return collection
+
+
+def forget_milvus_collection(collection_name):
+    """ The collection was dropped, a new one of that name is opened and loaded again """
+    with _milvus_collections_lock:
+        _milvus_collections.pop(collection_name, None)
+
+
+def load_milvus_collection():
+    """
+    The collection selected in CurrentUsingCollection. The selection is read on every call, so a
+    change made through update_current_collection on any server process applies to the next query.
+    """
+    collection_name = get_current_using_collection_value()
+    if not collection_name:
+        raise RuntimeError("No current collection selected")
+    return open_milvus_collection(collection_name)
+
+
+# Only for warm_up, which loads the collection selected at start; queries call load_milvus_collection
+milvus_collection = LazyResource("milvus_collection", load_milvus_collection)
 # embedding_model = SentenceTransformer('/home/aicoe/Desktop/Qa-v1/RAG_backend/cohere_app/embedding_model')
 # embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2', model_kwargs={'device': "cpu"})
 
@@ -168,95 +141,12 @@ def clean_string(input_string):
     cleaned_string = cleaned_string.strip()
     return cleaned_string
 
-user_sessions = {}
-search_params = {"metric_type": "L2", "params": {"ef": 30}}
-
-def process_query(user_input, mode, selected_file, system_id, batch_size=3):
-    try:
-        # Check if the user input contains toxic language
-        # guard.validate(user_input)
-
-        # If the input contains positive/neutral content related to L&T, allow it
-        if contains_positive_lnt_terms(user_input):
-            pass  # Allow the query to proceed without any blocking
-        else:
-            # If it's not positive/neutral, check if it's forbidden
-            if contains_forbidden_regex(user_input) or contains_forbidden_terms(user_input):
-                yield "Sorry, I cannot process your request as it contains inappropriate or sensitive content."
-                return
-
-        if mode == "qa":
-            connections.connect("default", host=host, port=port)
-            # Initialize session if not already present
-            if system_id not in user_sessions:
-                user_sessions[system_id] = {
-                    'results': [],
-                    'current_index': 0,
-                    'last_query': None
-                }
-            session = user_sessions[system_id]
-
-            # Handle "continue" command to fetch next batch of results
-            if user_input.lower() == "continue":
-                if not session['last_query']:
-                    yield "No previous query found. Please enter a new question."
-                    return
-                elif session['current_index'] >= len(session['results']):
-                    yield "No more results to display."
-                    return
-            else:
-                session['last_query'] = user_input
-                query_vector = embedding_model.encode([user_input]).tolist()
-
-                # Optional file filtering using selected_file
-                if selected_file:
-                    formatted_files = ", ".join([f"'{file}'" for file in selected_file])
-                    expr = f"source in [{formatted_files}]"
-                else:
-                    expr = None
+# BM25 searches run here while the query is encoded and searched in Milvus
+lexical_search_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LEXICAL_SEARCH_WORKERS", 4)), thread_name_prefix="lexical_search")
 
-                search_results = collection.search(
-                    data=query_vector,
-                    anns_field="vector",
-                    param=search_params,
-                    limit=15,
-                    output_fields=["source", "page", "text"],
-                    consistency_level="Strong",
-                    expr=expr
-                )
-
-                # Flatten the search results
-                all_hits = []
-                for hits in search_results:
-                    all_hits.extend(hits)
-                session['results'] = all_hits
-                session['current_index'] = 0
-
-            # Retrieve the current batch of results
-            start_index = session['current_index']
-            end_index = start_index + batch_size
-            batch_results = session['results'][start_index:end_index]
-            session['current_index'] = end_index
-
-            # Build the response context from the batch results
-            context = '\n---\n'.join(
-                f"File: {hit.entity.get('source')}\nPage: {hit.entity.get('page')}\nText: {hit.entity.get('text')}"
-                for hit in batch_results
-            )
-            current_question = session['last_query'] if user_input.lower() == "continue" else user_input
-            
-            # Stream the response
-            for chunk in generate_streaming_response(current_question, context):
-                yield chunk
-
-            sources = [
-                f"Source: {hit.entity.get('source')} | Page: {hit.entity.get('page')}"
-                for hit in batch_results
-            ]
-            yield '\n'.join(sources)
+BLOCKED_MESSAGE = "Sorry, I cannot process your request as it contains inappropriate or sensitive content."
 
-        elif mode == "chat":
-            context = """
+CHAT_CONTEXT = """
             
 You are a highly intelligent, helpful assistant designed to provide concise and respectful answers to user queries. Your main objectives are:
 
@@ -304,83 +194,207 @@ Make sure to verify every query before providing an answer to ensure it aligns w
                     """
 
 
-            # Initialize session if not already present
-            if system_id not in user_sessions:
-                user_sessions[system_id] = {
-                    'results': [],
-                    'current_index': 0,
-                    'last_query': None
-                }
-            session = user_sessions[system_id]
-
-            # Handle the "continue" command
-            if user_input.lower() == "continue":
-                if not session['last_query']:
-                    yield "No previous query found. Please enter a new question."
-                    return
-                elif session['current_index'] >= len(session['results']):
-                    yield "No more results to display."
-                    return
-            else:
-                session['last_query'] = user_input
-                query_vector = embedding_model.encode([user_input]).tolist()
-
-            current_question = session['last_query'] if user_input.lower() == "continue" else user_input
-            for chunk in generate_streaming_response(current_question, context):
-                yield chunk
+def fetch_entities(collection, pks, known=None):
+    """ source, page and text of the given primary keys of collection in the given order, skipping ones deleted since """
+    known = {} if known is None else known
+    missing = [pk for pk in pks if pk not in known]
+    if missing:
+        for row in collection.query(expr=f"pk in {missing}", output_fields=["source", "page", "text"]):
+            known[row["pk"]] = row
+    return [known[pk] for pk in pks if pk in known]
+
+
+def prepare_query(user_input, mode, selected_file, system_id, batch_size=None):
+    """
+    Guardrails, session handling and retrieval of process_query, everything before the LLM call.
+    Returns (reply, question, context, sources): reply is a message to send instead of an answer,
+    sources is None in chat mode.
+    The context holds as many hits as fit the token budget of context_assembler, at most batch_size
+    when given; "continue" carries on after the last hit used.
+    """
+    # Check if the user input contains toxic language
+    # guard.validate(user_input)
+
+    query_embedding = None
+    # Allow-list phrases and forbidden patterns are matched in one pass
+    verdict = guardrail_engine.check(user_input)
+    # If the input contains positive/neutral content related to L&T, allow it
+    if verdict.action == "allow":
+        pass  # Allow the query to proceed without any blocking
+    else:
+        # If it's not positive/neutral, check if it's forbidden
+        if verdict.action == "block":
+            logger.info(f"Query blocked by guardrail rule {verdict.rule}")
+            return BLOCKED_MESSAGE, None, None, None
+        query_embedding = embedding_service.get().encode(user_input)
+        if contains_forbidden_terms(user_input, user_input_embedding=query_embedding):
+            return BLOCKED_MESSAGE, None, None, None
+
+    if mode not in ("qa", "chat"):
+        return "", None, None, None
+
+    # Initialize session if not already present
+    session = session_store.get(system_id) or new_session()
+
+    # Handle "continue" command to fetch next batch of results
+    if user_input.lower() == "continue":
+        if not session['last_query']:
+            return "No previous query found. Please enter a new question.", None, None, None
+        elif session['current_index'] >= len(session['results']):
+            return "No more results to display.", None, None, None
+    else:
+        session['last_query'] = user_input
+    current_question = session['last_query'] if user_input.lower() == "continue" else user_input
+
+    if mode == "qa":
+        # "continue" pages through the hits of the collection they were searched in
+        if user_input.lower() == "continue" and session.get('collection'):
+            collection = open_milvus_collection(session['collection'])
+        else:
+            collection = load_milvus_collection()
+        searched_entities = {}
+        if user_input.lower() != "continue":
+            generation = retrieval_cache.generation(collection.name)
+            all_hits = retrieval_cache.get(collection.name, user_input, selected_file, query_embedding, generation)
+            if all_hits is None:
+                lexical_future = None
+                if HYBRID_SEARCH and lexical_index.exists(collection.name):
+                    lexical_future = lexical_search_pool.submit(
+                        lexical_index.search, collection.name, user_input, LEXICAL_SEARCH_LIMIT, selected_file)
+                if query_embedding is None:
+                    query_embedding = embedding_service.get().encode(user_input)
+                query_vector = [query_embedding.tolist()]
+
+                # Optional file filtering using selected_file
+                if selected_file:
+                    formatted_files = ", ".join([f"'{file}'" for file in selected_file])
+                    expr = f"source in [{formatted_files}]"
+                else:
+                    expr = None
+
+                # ef or nprobe, limit and consistency come from the collection's search profile
+                profile = search_profiles.for_collection(collection.name)
+                search_results = collection.search(
+                    data=query_vector,
+                    anns_field="vector",
+                    param=search_profiles.search_params(collection, profile),
+                    limit=profile.limit,
+                    output_fields=["source", "page", "text"],
+                    consistency_level=profile.consistency_level,
+                    expr=expr,
+                    # Only the folders of the selected files when the collection is partitioned by folder
+                    partition_names=collection_builder.search_partitions(collection, selected_file)
+                )
+
+                # Flatten the search results to (pk, score), keeping the entities for the first page
+                all_hits = []
+                for hits in search_results:
+                    for hit in hits:
+                        all_hits.append([hit.id, hit.distance])
+                        searched_entities[hit.id] = {field: hit.entity.get(field) for field in ("source", "page", "text")}
+                        searched_entities[hit.id]["pk"] = hit.id
+                if lexical_future is not None:
+                    # Hits found by either search are ranked by reciprocal-rank fusion; the ones only
+                    # BM25 found are fetched from Milvus with the rest of the batch
+                    waited_from = time.perf_counter()
+                    lexical_hits = lexical_future.result()
+                    lexical_index.record_added_latency((time.perf_counter() - waited_from) * 1000)
+                    all_hits = reciprocal_rank_fusion([all_hits, lexical_hits])
+                reranked = True
+                if reranker.enabled:
+                    # "continue" pages through this order too
+                    fetch_entities(collection, [pk for pk, _ in all_hits[:reranker.top_n]], searched_entities)
+                    all_hits, reranked = reranker.rerank(user_input, all_hits, searched_entities)
+                # An order the re-ranker ran out of time for is not cached, the next ask finds its scores cached
+                if reranked:
+                    retrieval_cache.put(collection.name, user_input, selected_file, all_hits, query_embedding, generation)
+            session['results'] = all_hits
+            session['current_index'] = 0
+            session['collection'] = collection.name
+
+        # Retrieve the candidates of this answer and pack as many as fit the token budget
+        start_index = session['current_index']
+        max_chunks = batch_size or context_assembler.max_chunks
+        candidate_pks = [pk for pk, _ in session['results'][start_index:start_index + max_chunks]]
+        batch_results = fetch_entities(collection, candidate_pks, searched_entities)
+        context, sources, consumed = context_assembler.assemble(batch_results, current_question, prompt, max_chunks)
+
+        # Hits deleted since the search are skipped, so continue after the last entity used
+        if consumed < len(batch_results):
+            session['current_index'] = start_index + candidate_pks.index(batch_results[consumed]["pk"])
+        else:
+            session['current_index'] = start_index + len(candidate_pks)
+        session_store.save(system_id, session)
+        return None, current_question, context, sources
+
+    session_store.save(system_id, session)
+    return None, current_question, CHAT_CONTEXT, None
+
+
+def process_query(user_input, mode, selected_file, system_id, batch_size=None):
+    try:
+        reply, question, context, sources = prepare_query(user_input, mode, selected_file, system_id, batch_size)
+        if reply is not None:
+            if reply:
+                yield reply
+            return
+
+        # Stream the response
+        for chunk in generate_streaming_response(question, context):
+            yield chunk
+        if sources is not None:
+            yield '\n'.join(sources)
 
     except Exception as e:
         yield f"Error occurred: {str(e)}"
 
 
-@lru_cache(maxsize=None)
-def get_all_files_from_milvus():
-    connections.connect("default", host=host, port= port)
-    collection = Collection(MILVUS_COLLECTION)
-    iterator = collection.query_iterator(batch_size=1000,output_fields=["source"])
-    results=[]
-    while True:
-        result = iterator.next()
-        if not result:
-            iterator.close()
-            break
-        results.extend(result)
-    
-    database_files = []
-    for result in results:
-        database_files.append(result['source'])
-    database_files = list(set(database_files))
-    connections.disconnect("default")
-    return database_files
-
-
-@lru_cache(maxsize=None)
-def get_all_files_from_milvus():
-    connections.connect("default", host=host, port= port)
-    collection = Collection(MILVUS_COLLECTION)
-    iterator = collection.query_iterator(batch_size=1000,output_fields=["source"])
-    results=[]
-    while True:
-        result = iterator.next()
-        if not result:
-            iterator.close()
-            break
-        results.extend(result)
-    
-    database_files = []
-    for result in results:
-        database_files.append(result['source'])
-    database_files = list(set(database_files))
-    connections.disconnect("default")
-    return database_files
+async def aprocess_query(user_input, mode, selected_file, system_id, batch_size=None):
+    """ process_query for the ASGI views: retrieval runs in a worker thread, the answer streams on the event loop """
+    try:
+        reply, question, context, sources = await sync_to_async(prepare_query, thread_sensitive=False)(
+            user_input, mode, selected_file, system_id, batch_size
+        )
+        if reply is not None:
+            if reply:
+                yield reply
+            return
+
+        async for chunk in llm_client.astream_chat(question, context):
+            yield chunk
+        if sources is not None:
+            yield '\n'.join(sources)
+
+    except Exception as e:
+        yield f"Error occurred: {str(e)}"
 
 
-def chat_with_uploaded_document(faiss_folder, query, top_k = 3):
-    desktop_path = os.path.join(os.path.expanduser("~"), "Desktop", faiss_folder)
-    faiss_index = FAISS.load_local(desktop_path, embeddings, allow_dangerous_deserialization = True)
+def uploaded_document_context(faiss_folder, query, top_k=3):
+    # Follow-up questions reuse the index kept in memory since the first turn
+    faiss_index = faiss_cache.get(
+        faiss_folder,
+        lambda desktop_path: FAISS.load_local(desktop_path, embeddings.get(), allow_dangerous_deserialization = True)
+    )
     search_results = faiss_index.similarity_search(query, k=top_k)
     context = ""
     for i, result in enumerate(search_results):
         context+= result.page_content
-    for chunk in generate_streaming_response(query, context):
-            yield chunk
\ No newline at end of file
+    return context
+
+
+def chat_with_uploaded_document(faiss_folder, query, top_k = 3):
+    try:
+        context = uploaded_document_context(faiss_folder, query, top_k)
+        for chunk in generate_streaming_response(query, context):
+            yield chunk
+    except Exception as e:
+        yield f"Error occurred: {str(e)}"
+
+
+async def achat_with_uploaded_document(faiss_folder, query, top_k=3):
+    try:
+        context = await sync_to_async(uploaded_document_context, thread_sensitive=False)(faiss_folder, query, top_k)
+        async for chunk in llm_client.astream_chat(query, context):
+            yield chunk
+    except Exception as e:
+        yield f"Error occurred: {str(e)}"
@@ -1,6 +1,26 @@
+import os
+import sys
+import threading
 from django.apps import AppConfig
 
 
+def should_warm_up():
+    """ RAG_WARM_UP is set, and this process serves requests rather than running a management command """
+    if os.getenv("RAG_WARM_UP", "false").lower() not in ("1", "true", "yes"):
+        return False
+    if os.path.basename(sys.argv[0]) == "manage.py":
+        # runserver's autoreloader parent only watches files, the child it starts sets RUN_MAIN
+        return sys.argv[1:2] == ["runserver"] and os.environ.get("RUN_MAIN") == "true"
+    return True
+
+
 class CohereAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cohere_app'
+
+    def ready(self):
+        if should_warm_up():
+            from . import api, views  # register their lazy resources
+            from .lazy_resource import warm_up
+            # In the background so the server accepts requests while the models load
+            threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
@@ -0,0 +1,185 @@
+import os
+import math
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+from .lazy_resource import LazyResource
+from .llm_client import LLM_MAX_TOKENS
+
+load_dotenv()
+
+# Tokenizer of the model behind TGI_URL, a local folder or a hub name; empty estimates the counts
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "")
+# Most tokens of retrieved context sent with one question
+LLM_CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", 2000))
+# Most hits packed into one answer, further ones are left for "continue"
+LLM_CONTEXT_MAX_CHUNKS = int(os.getenv("LLM_CONTEXT_MAX_CHUNKS", 8))
+# Context length of the served model; when set the budget also leaves room for the prompt and the answer
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", 0))
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", 50000))
+
+# Used without a tokenizer, about right for English text and BPE vocabularies
+CHARS_PER_TOKEN = 4
+# Chat template tokens around the messages, not visible in their text
+TEMPLATE_TOKENS = 32
+PASSAGE_SEPARATOR = '\n---\n'
+# Sliding-window chunks overlap by 200 characters, see iter_chunks
+MERGE_PROBE_CHARS = 64
+MERGE_MAX_OVERLAP = 1000
+
+
+def load_llm_tokenizer():
+    if not LLM_TOKENIZER:
+        return None
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(LLM_TOKENIZER)
+    except Exception as e:
+        logger.error(f"Could not load LLM tokenizer {LLM_TOKENIZER}, estimating token counts: {e}")
+        return None
+
+
+llm_tokenizer = LazyResource("llm_tokenizer", load_llm_tokenizer)
+
+
+def format_passage(source, page, text):
+    return f"File: {source}\nPage: {page}\nText: {text}"
+
+
+def merge_overlapping(first, second):
+    """
+    One text covering both when one contains the other or they are neighbouring chunks that
+    overlap, in document order; None otherwise.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for head, tail in ((first, second), (second, first)):
+        probe = tail[:MERGE_PROBE_CHARS]
+        index = head.find(probe, max(0, len(head) - MERGE_MAX_OVERLAP))
+        if index != -1 and tail.startswith(head[index:]):
+            return head + tail[len(head) - index:]
+    return None
+
+
+class ContextAssembler:
+    """
+    Packs the best hits of a query into the LLM context up to a token budget instead of a fixed
+    number of hits. Hits of the same source and page that overlap are merged into one passage.
+    Token counts come from the served model's tokenizer, run locally, and are cached per chunk.
+    """
+
+    def __init__(self, budget=LLM_CONTEXT_TOKEN_BUDGET, max_chunks=LLM_CONTEXT_MAX_CHUNKS,
+                 context_window=LLM_CONTEXT_WINDOW, max_new_tokens=LLM_MAX_TOKENS, cache_size=TOKEN_COUNT_CACHE_SIZE):
+        self.budget = budget
+        self.max_chunks = max_chunks
+        self.context_window = context_window
+        self.max_new_tokens = max_new_tokens
+        self.cache_size = cache_size
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.assembled = 0
+        self.context_tokens = 0
+        self.passages = 0
+        self.merged = 0
+
+    def count(self, text, key=None):
+        """ Tokens of text for the served model, cached under key when one is given """
+        if key is not None:
+            with self._lock:
+                tokens = self._counts.get(key)
+                if tokens is not None:
+                    self._counts.move_to_end(key)
+                    self.cache_hits += 1
+                    return tokens
+                self.cache_misses += 1
+        tokenizer = llm_tokenizer.get()
+        if tokenizer is not None:
+            tokens = len(tokenizer.encode(text, add_special_tokens=False))
+        else:
+            tokens = math.ceil(len(text) / CHARS_PER_TOKEN)
+        if key is not None:
+            with self._lock:
+                self._counts[key] = tokens
+                while len(self._counts) > self.cache_size:
+                    self._counts.popitem(last=False)
+        return tokens
+
+    def budget_for(self, question, system_prompt=""):
+        """ Context tokens that fit with this question, keeping room for the answer in the model's window """
+        if not self.context_window:
+            return self.budget
+        prompt_tokens = self.count(system_prompt, key=("prompt", system_prompt)) + self.count(question) + TEMPLATE_TOKENS
+        return max(0, min(self.budget, self.context_window - self.max_new_tokens - prompt_tokens))
+
+    def assemble(self, entities, question="", system_prompt="", max_chunks=None):
+        """
+        Pack entities (dicts with source, page, text and optionally pk), best first.
+        Returns (context, sources, consumed) where consumed is how many entities were used or merged
+        away; the rest did not fit and are left for the next page of results.
+        At least one entity is used, even when it alone is over the budget.
+        """
+        budget = self.budget_for(question, system_prompt)
+        separator_tokens = self.count(PASSAGE_SEPARATOR, key=("separator",))
+        passages = []
+        used_tokens = 0
+        consumed = 0
+        merged_hits = 0
+        for entity in entities[:max_chunks or self.max_chunks]:
+            source, page, text = entity.get('source'), entity.get('page'), entity.get('text') or ""
+            merged = None
+            for passage in passages:
+                if passage["source"] == source and passage["page"] == page:
+                    merged_text = merge_overlapping(passage["text"], text)
+                    if merged_text is not None:
+                        merged = passage
+                        break
+            if merged is not None:
+                tokens = self.count(format_passage(source, page, merged_text)) + merged["separator_tokens"]
+                if used_tokens + tokens - merged["tokens"] > budget:
+                    break
+                used_tokens += tokens - merged["tokens"]
+                merged.update(text=merged_text, tokens=tokens)
+                merged_hits += 1
+            else:
+                key = (source, entity['pk']) if entity.get('pk') is not None else None
+                passage_separator_tokens = separator_tokens if passages else 0
+                tokens = self.count(format_passage(source, page, text), key=key) + passage_separator_tokens
+                if passages and used_tokens + tokens > budget:
+                    break
+                passages.append({"source": source, "page": page, "text": text, "tokens": tokens,
+                                 "separator_tokens": passage_separator_tokens})
+                used_tokens += tokens
+            consumed += 1
+
+        with self._lock:
+            self.assembled += 1
+            self.context_tokens += used_tokens
+            self.passages += len(passages)
+            self.merged += merged_hits
+        context = PASSAGE_SEPARATOR.join(format_passage(p["source"], p["page"], p["text"]) for p in passages)
+        sources = [f"Source: {p['source']} | Page: {p['page']}" for p in passages]
+        return context, sources, consumed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "tokenizer": LLM_TOKENIZER or "estimate",
+                "budget": self.budget,
+                "max_chunks": self.max_chunks,
+                "context_window": self.context_window,
+                "cached_counts": len(self._counts),
+                "cache_hit_rate": self.cache_hits / lookups if lookups else 0,
+                "contexts": self.assembled,
+                "average_context_tokens": self.context_tokens / self.assembled if self.assembled else 0,
+                "average_passages": self.passages / self.assembled if self.assembled else 0,
+                "merged_hits": self.merged,
+            }
+
+
+context_assembler = ContextAssembler()
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 5))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 64))
+
+
+class EmbeddingBatcher:
+    """
+    In-process micro-batcher for query embeddings.
+    Queries submitted by concurrent requests within a short window are encoded
+    together in a single model.encode call, and every caller gets its own vector back.
+    """
+
+    def __init__(self, model, window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch_size=EMBEDDING_MAX_BATCH_SIZE):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._condition = threading.Condition()
+        self._worker = None
+        self.batches = 0
+        self.queries = 0
+
+    def encode(self, text):
+        """ Return the embedding of a single text, batched with any other in-flight queries """
+        future = Future()
+        with self._condition:
+            self._pending.append((text, future))
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        return future.result()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Identical questions asked at the same time are only encoded once
+            unique_texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = self.model.encode(unique_texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            vector_by_text = dict(zip(unique_texts, vectors))
+            for text, future in batch:
+                future.set_result(vector_by_text[text])
+            self.batches += 1
+            self.queries += len(batch)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "average_batch_size": self.queries / self.batches if self.batches else 0,
+        }
@@ -0,0 +1,84 @@
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FAISS_CACHE_MAX_BYTES = int(os.getenv("FAISS_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def user_faiss_path(faiss_folder):
+    return os.path.join(os.path.expanduser("~"), "Desktop", faiss_folder)
+
+
+def folder_signature(path):
+    """ (name, mtime, size) of the files of path, which changes whenever the index is saved again; None if path is missing """
+    try:
+        return tuple(sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                            for entry in os.scandir(path) if entry.is_file()))
+    except FileNotFoundError:
+        return None
+
+
+def signature_size(signature):
+    return sum(size for _, _, size in signature or ())
+
+
+class FaissIndexCache:
+    """
+    In-memory cache of the per-user FAISS indexes built from uploaded documents.
+    Entries are evicted least recently used first once their on-disk size adds up to max_bytes,
+    and dropped explicitly when the user's index is rebuilt or deleted. Each entry keeps the mtime and
+    size of the index files; a hit whose files changed on disk, e.g. rebuilt by another server process,
+    is read again.
+    """
+
+    def __init__(self, max_bytes=FAISS_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on invalidate so a load that raced with an upload or logout is not cached
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, faiss_folder, loader):
+        """ Return the index of faiss_folder, calling loader(path) to read it from disk on a miss """
+        path = user_faiss_path(faiss_folder)
+        signature = folder_signature(path)
+        with self._lock:
+            entry = self._entries.get(faiss_folder)
+            if entry is not None and entry[2] == signature:
+                self._entries.move_to_end(faiss_folder)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generations.get(faiss_folder, 0)
+
+        index = loader(path)
+        # Taken before the load, so files rewritten during it make the next get read them again
+        size = signature_size(signature)
+        with self._lock:
+            if self._generations.get(faiss_folder, 0) != generation:
+                return index
+            previous = self._entries.pop(faiss_folder, None)
+            if previous is not None:
+                self.total_bytes -= previous[1]
+            self._entries[faiss_folder] = (index, size, signature)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+        return index
+
+    def invalidate(self, faiss_folder):
+        with self._lock:
+            self._generations[faiss_folder] = self._generations.get(faiss_folder, 0) + 1
+            entry = self._entries.pop(faiss_folder, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+
+
+faiss_cache = FaissIndexCache()
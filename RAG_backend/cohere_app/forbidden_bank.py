@@ -0,0 +1,140 @@
+import os
+import hashlib
+import numpy as np
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+
+load_dotenv()
+
+FORBIDDEN_BANK_DIR = os.getenv("FORBIDDEN_BANK_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rag_forbidden_bank"))
+# Optional text file with one extra forbidden example phrase per line
+FORBIDDEN_BANK_FILE = os.getenv("FORBIDDEN_BANK_FILE", "")
+# Banks up to this many phrases are scanned exactly, larger ones through the cluster index
+FORBIDDEN_BANK_EXACT_MAX_ROWS = int(os.getenv("FORBIDDEN_BANK_EXACT_MAX_ROWS", 2048))
+# Clusters scored per query when the cluster index is in use
+FORBIDDEN_BANK_NPROBE = int(os.getenv("FORBIDDEN_BANK_NPROBE", 8))
+KMEANS_ITERATIONS = 10
+
+
+def load_forbidden_phrases(base_terms, bank_file=FORBIDDEN_BANK_FILE):
+    """ base_terms followed by the phrases of bank_file, without blanks or duplicates """
+    phrases = list(base_terms)
+    if bank_file and os.path.exists(bank_file):
+        with open(bank_file, "r", encoding="utf-8") as f:
+            phrases.extend(line.strip() for line in f)
+    return list(dict.fromkeys(phrase for phrase in phrases if phrase))
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_clusters(matrix, exact_max_rows=FORBIDDEN_BANK_EXACT_MAX_ROWS):
+    """
+    Spherical k-means over the unit rows of matrix, about sqrt(n) clusters.
+    Returns (order, offsets, centroids): rows order[offsets[c]:offsets[c + 1]] belong to cluster c.
+    A bank of at most exact_max_rows rows is kept as a single cluster and scanned exactly.
+    """
+    count = matrix.shape[0]
+    if count <= exact_max_rows:
+        return np.arange(count), np.array([0, count]), None
+    n_clusters = int(np.sqrt(count))
+    rng = np.random.default_rng(0)
+    centroids = matrix[rng.choice(count, n_clusters, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, matrix)
+        empty = np.bincount(assignment, minlength=n_clusters) == 0
+        sums[empty] = centroids[empty]
+        centroids = normalize_rows(sums)
+    assignment = np.argmax(matrix @ centroids.T, axis=1)
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_clusters))])
+    return order, offsets, centroids
+
+
+class ForbiddenBank:
+    """
+    Unit-length float32 embeddings of the forbidden example phrases, persisted under directory
+    keyed by model and phrase list so a restart loads the bank instead of re-encoding it.
+    Cosine similarity is the dot product of unit vectors; large banks are grouped into clusters and
+    a query only scores the rows of the nprobe clusters closest to it, best cluster first.
+    """
+
+    def __init__(self, phrases, model, model_name, directory=FORBIDDEN_BANK_DIR, nprobe=FORBIDDEN_BANK_NPROBE):
+        self.phrases = list(phrases)
+        self.model = model
+        self.model_name = model_name
+        self.directory = directory
+        self.nprobe = nprobe
+        self.matrix, self.order, self.offsets, self.centroids = self._load()
+
+    def _path(self):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.model_name.encode("utf-8"))
+        for phrase in self.phrases:
+            digest.update(b"\0" + phrase.encode("utf-8"))
+        return os.path.join(self.directory, f"{digest.hexdigest()}.npz")
+
+    def _load(self):
+        path = self._path()
+        if os.path.exists(path):
+            try:
+                with np.load(path) as saved:
+                    centroids = saved["centroids"] if saved["centroids"].size else None
+                    if saved["matrix"].shape[0] == len(self.phrases):
+                        return saved["matrix"], saved["order"], saved["offsets"], centroids
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Re-encoding forbidden bank, could not read {path}: {e}")
+
+        matrix = normalize_rows(self.model.encode(self.phrases, batch_size=256))
+        order, offsets, centroids = build_clusters(matrix)
+        # Rows stored cluster by cluster so each probe scores one contiguous slice
+        matrix = np.ascontiguousarray(matrix[order])
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, matrix=matrix, order=order, offsets=offsets,
+                         centroids=centroids if centroids is not None else np.empty(0, dtype=np.float32))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Forbidden bank not persisted to {path}: {e}")
+        return matrix, order, offsets, centroids
+
+    def best_match(self, query_embedding, threshold=None):
+        """
+        Return (phrase, similarity) of the closest forbidden phrase found. With a threshold,
+        scoring stops at the first cluster that holds a phrase at or above it.
+        """
+        query = normalize_rows(query_embedding).reshape(-1)
+        if self.centroids is None:
+            clusters = [0]
+        else:
+            centroid_scores = self.centroids @ query
+            nprobe = min(self.nprobe, len(centroid_scores))
+            clusters = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            clusters = clusters[np.argsort(-centroid_scores[clusters])]
+
+        best_row, best_score = -1, -1.0
+        for cluster in clusters:
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            if start == end:
+                continue
+            scores = self.matrix[start:end] @ query
+            row = int(np.argmax(scores))
+            if scores[row] > best_score:
+                best_row, best_score = start + row, float(scores[row])
+            if threshold is not None and best_score >= threshold:
+                break
+        if best_row < 0:
+            return None, -1.0
+        return self.phrases[self.order[best_row]], best_score
+
+    def matches(self, query_embedding, threshold):
+        _, score = self.best_match(query_embedding, threshold)
+        return score >= threshold
@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import namedtuple
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+
+load_dotenv()
+
+# Optional JSON file {"forbidden_patterns": [...], "allow_terms": [...]} overriding the rules below.
+# It is re-read when it changes, at most once per GUARDRAIL_RELOAD_INTERVAL seconds.
+GUARDRAIL_RULES_FILE = os.getenv("GUARDRAIL_RULES_FILE", "")
+GUARDRAIL_RELOAD_INTERVAL = float(os.getenv("GUARDRAIL_RELOAD_INTERVAL", 30))
+
+# Positive/neutral terms related to L&T that are acceptable
+NEUTRAL_POSITIVE_TERMS = [
+    "CEO of L&T", "L&T achievements", "L&T growth", "L&T company",
+    "L&T business", "L&T leadership", "L&T innovation", "L&T history",
+    "Larsen and Toubro", "L&T CEO", "Larsen and Toubro achievements",
+    "Larsen and Toubro growth", "Larsen and Toubro leadership"
+]
+
+# Define regex patterns for additional guardrails
+FORBIDDEN_REGEX_PATTERNS = [
+    r"\bkill\b", r"\bmurder\b", r"\bassassinat(e|ion)\b", r"\bhomicide\b", r"\bmassacre\b",
+    r"\bLarsen\s*and\s*Toubro\b", r"\bpolitical\b", r"\bscandal\b", r"\bvulgar\b",
+    r"\boffensive\b", r"\bcorruption\b", r"\bsexual\b", r"\bharassment\b", r"\babuse\b",
+    r"\bviolence\b", r"\bracism\b", r"\bterrorism\b", r"\bhate\b", r"\billegal\b", r"\bextremism\b",
+    r"\bfraud\b", r"\bbribery\b", r"\bdiscrimination\b", r"\bprotest\b", r"\bcontroversy\b",
+    r"\bmisinformation\b"
+]
+
+# action is "allow" when an allow-list phrase is present, "block" when only a forbidden
+# pattern matched and None when neither did; rule is the phrase or pattern that decided it
+GuardrailVerdict = namedtuple("GuardrailVerdict", ["action", "rule"])
+
+_NO_MATCH = GuardrailVerdict(None, None)
+
+
+def lowercase_pattern(pattern):
+    """ Lowercase the literal text of a regex, leaving escapes such as \\S or \\B alone """
+    return re.sub(r'\\.|[^\\]+', lambda m: m.group() if m.group().startswith('\\') else m.group().lower(), pattern)
+
+
+def compile_rule_set(action, patterns, flags=0):
+    """
+    Compile a rule set into one alternation, plus the individual rules used to tell which one fired.
+    Without IGNORECASE or named groups the re module can use its literal-prefix scan, which is what
+    makes the single alternation cheap on lowercased text.
+    """
+    rules = [(re.compile(pattern, flags), GuardrailVerdict(action, original)) for pattern, original in patterns]
+    combined = re.compile("|".join(f"(?:{pattern})" for pattern, _ in patterns) or r"(?!)", flags)
+    return combined, rules
+
+
+def compile_rules(forbidden_patterns, allow_terms):
+    """
+    Returns the (alternation, rules) of the allow-list phrases, of the lowercased forbidden patterns
+    for ASCII text, and of the forbidden patterns with IGNORECASE for any other text
+    """
+    allow = compile_rule_set("allow", [(re.escape(term.lower()), term) for term in allow_terms])
+    forbidden = compile_rule_set("block", [(lowercase_pattern(pattern), pattern) for pattern in forbidden_patterns])
+    forbidden_unicode = compile_rule_set("block", [(pattern, pattern) for pattern in forbidden_patterns], re.IGNORECASE)
+    return allow, forbidden, forbidden_unicode
+
+
+def _fired_rule(match, rules, text):
+    # The alternation takes the first alternative that matches at match.start(), so does this
+    for rule, verdict in rules:
+        if rule.match(text, match.start()):
+            return verdict
+    return rules[0][1]
+
+
+class GuardrailEngine:
+    """
+    Keyword guardrails with each rule set compiled into a single alternation, so the query is
+    lowercased once and scanned once per rule set instead of once per rule. An allow-list phrase
+    anywhere in the query allows it, otherwise any forbidden pattern blocks it, the same decision
+    as checking NEUTRAL_POSITIVE_TERMS and then FORBIDDEN_REGEX_PATTERNS one by one.
+    Lowercasing only matches IGNORECASE for ASCII: "İ".lower() is two characters and "ſ" stays
+    as it is, where IGNORECASE matches both to i and s. Other queries are searched for forbidden
+    patterns with IGNORECASE over their original text, as the per-pattern checks did.
+    """
+
+    def __init__(self, forbidden_patterns=FORBIDDEN_REGEX_PATTERNS, allow_terms=NEUTRAL_POSITIVE_TERMS,
+                 rules_file=GUARDRAIL_RULES_FILE, reload_interval=GUARDRAIL_RELOAD_INTERVAL):
+        self.default_forbidden_patterns = list(forbidden_patterns)
+        self.default_allow_terms = list(allow_terms)
+        self.rules_file = rules_file
+        self.reload_interval = reload_interval
+        self._rules_mtime = None
+        self._next_reload_check = 0.0
+        self._lock = threading.Lock()
+        self.forbidden_patterns = self.default_forbidden_patterns
+        self.allow_terms = self.default_allow_terms
+        self._compiled = compile_rules(self.forbidden_patterns, self.allow_terms)
+        if self.rules_file:
+            self.reload()
+
+    def reload(self):
+        """ Re-read the rules file and swap the compiled rules in; the current rules stay on any error """
+        with self._lock:
+            self._next_reload_check = time.monotonic() + self.reload_interval
+            if not self.rules_file or not os.path.exists(self.rules_file):
+                return False
+            try:
+                mtime = os.path.getmtime(self.rules_file)
+                with open(self.rules_file, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                forbidden_patterns = config.get("forbidden_patterns", self.default_forbidden_patterns)
+                allow_terms = config.get("allow_terms", self.default_allow_terms)
+                compiled = compile_rules(forbidden_patterns, allow_terms)
+            except Exception as e:
+                logger.warning(f"Guardrail rules not reloaded from {self.rules_file}: {e}")
+                return False
+            self.forbidden_patterns = forbidden_patterns
+            self.allow_terms = allow_terms
+            self._compiled = compiled
+            self._rules_mtime = mtime
+            return True
+
+    def _maybe_reload(self):
+        if not self.rules_file or time.monotonic() < self._next_reload_check:
+            return
+        try:
+            mtime = os.path.getmtime(self.rules_file)
+        except OSError:
+            self._next_reload_check = time.monotonic() + self.reload_interval
+            return
+        if mtime != self._rules_mtime:
+            self.reload()
+        else:
+            self._next_reload_check = time.monotonic() + self.reload_interval
+
+    def check(self, user_input):
+        """ Return the GuardrailVerdict of user_input """
+        self._maybe_reload()
+        (allow, allow_rules), forbidden_ascii, forbidden_unicode = self._compiled
+        text = user_input.lower()
+        match = allow.search(text)
+        if match:
+            return _fired_rule(match, allow_rules, text)
+        if user_input.isascii():
+            forbidden, forbidden_rules = forbidden_ascii
+        else:
+            (forbidden, forbidden_rules), text = forbidden_unicode, user_input
+        match = forbidden.search(text)
+        if match:
+            return _fired_rule(match, forbidden_rules, text)
+        return _NO_MATCH
+
+    def is_allowed(self, user_input):
+        return self.check(user_input).action == "allow"
+
+    def is_blocked(self, user_input):
+        return self.check(user_input).action == "block"
+
+
+guardrail_engine = GuardrailEngine()
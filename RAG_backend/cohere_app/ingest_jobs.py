@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+from .Chunking_UI import db_utility
+
+load_dotenv()
+
+INGEST_JOB_CONCURRENCY = int(os.getenv("INGEST_JOB_CONCURRENCY", 2))
+# Finished jobs kept around so their final progress can still be fetched
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", 100))
+# How often a server process writes the progress and heartbeat of its jobs to the ingest_jobs table,
+# and at most how often it reads which collections the other processes are ingesting
+INGEST_JOB_SYNC_SECONDS = float(os.getenv("INGEST_JOB_SYNC_SECONDS", 2))
+# An active job without a heartbeat for this long belongs to a process that stopped, and is failed
+INGEST_JOB_STALE_SECONDS = float(os.getenv("INGEST_JOB_STALE_SECONDS", 60))
+
+
+class IngestJob:
+    """ Progress, throughput and errors of one background collection ingest """
+
+    def __init__(self, collection_name, source):
+        self.job_id = uuid.uuid4().hex
+        self.collection_name = collection_name
+        self.source = source
+        self.status = "queued"
+        self.message = "Queued"
+        self.current_progress = 0
+        self.total_files = 0
+        self.progress_percentage = 0.0
+        self.files_processed = 0
+        self.chunks_completed = 0
+        self.files_failed = 0
+        self.errors = []
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def update(self, progress):
+        """ Take one progress dict yielded by create_langchain_documents """
+        if progress["total_files"] != self.total_files or progress["current_progress"] < self.current_progress:
+            # The OCR pass restarts the per-file counters
+            self.current_progress = 0
+        self.files_processed += progress["current_progress"] - self.current_progress
+        self.current_progress = progress["current_progress"]
+        self.total_files = progress["total_files"]
+        self.progress_percentage = progress["progress_percentage"]
+        self.chunks_completed = progress.get("chunks_completed", self.chunks_completed)
+        self.files_failed = progress.get("files_failed", self.files_failed)
+
+    def to_row(self):
+        """ The job as a row of the ingest_jobs table """
+        return {
+            "job_id": self.job_id,
+            "collection_name": self.collection_name,
+            "source": self.source,
+            "status": self.status,
+            "message": self.message,
+            "current_progress": self.current_progress,
+            "total_files": self.total_files,
+            "progress_percentage": self.progress_percentage,
+            "files_processed": self.files_processed,
+            "chunks_completed": self.chunks_completed,
+            "files_failed": self.files_failed,
+            "errors": json.dumps(self.errors),
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "heartbeat_at": time.time(),
+            "active_collection": self.collection_name if self.active else None,
+        }
+
+    @classmethod
+    def from_row(cls, row):
+        """ A job read back from the ingest_jobs table, possibly run by another server process """
+        job = cls(row["collection_name"], row["source"])
+        for name in ("job_id", "status", "message", "current_progress", "total_files", "progress_percentage",
+                     "files_processed", "chunks_completed", "files_failed", "submitted_at", "started_at", "finished_at"):
+            setattr(job, name, row[name])
+        job.errors = json.loads(row["errors"] or "[]")
+        return job
+
+    def to_dict(self):
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+        return {
+            "job_id": self.job_id,
+            "collection_name": self.collection_name,
+            "source": self.source,
+            "status": self.status,
+            "message": self.message,
+            "current_progress": self.current_progress,
+            "total_files": self.total_files,
+            "progress_percentage": self.progress_percentage,
+            "files_processed": self.files_processed,
+            "chunks_completed": self.chunks_completed,
+            "files_failed": self.files_failed,
+            "files_per_second": self.files_processed / elapsed if elapsed else 0,
+            "chunks_per_second": self.chunks_completed / elapsed if elapsed else 0,
+            "elapsed_seconds": elapsed,
+            "errors": self.errors,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestJobManager:
+    """
+    Runs collection ingests in a bounded pool of background threads, independent of the
+    HTTP request that submitted them, and keeps their progress addressable by job ID.
+    Jobs are shared with the other server processes through the ingest_jobs table: a collection
+    has one active job across all of them, and any process can report the progress of any job.
+    """
+
+    def __init__(self, max_workers=INGEST_JOB_CONCURRENCY, history=INGEST_JOB_HISTORY,
+                 sync_seconds=INGEST_JOB_SYNC_SECONDS, stale_seconds=INGEST_JOB_STALE_SECONDS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest-job")
+        self.history = history
+        self.sync_seconds = sync_seconds
+        self.stale_seconds = stale_seconds
+        # The active jobs of this process
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        # Rows are built and written under it, so a stale progress write never lands after a final one
+        self._save_lock = threading.Lock()
+        self._table_ready = False
+        self._sync_thread = None
+        # grace_seconds -> (refresh after, collections), see active_collections
+        self._active_cache = {}
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            db_utility.create_ingest_jobs()
+            self._table_ready = True
+
+    def submit(self, collection_name, source, target, *args):
+        """
+        Queue target(job, *args) and return the job, or None when the collection
+        already has an active job in any server process.
+        """
+        job = IngestJob(collection_name, source)
+        with self._lock:
+            if any(active.collection_name == collection_name for active in self._jobs.values()):
+                return None
+            self._ensure_table()
+            now = time.time()
+            db_utility.fail_stale_ingest_jobs(now - self.stale_seconds, now)
+            if not db_utility.insert_ingest_job(job.to_row()):
+                return None
+            self._jobs[job.job_id] = job
+            self._active_cache.clear()
+            if self._sync_thread is None:
+                self._sync_thread = threading.Thread(target=self._sync_loop, name="ingest-job-sync", daemon=True)
+                self._sync_thread.start()
+        self._executor.submit(self._run, job, target, args)
+        return job
+
+    def _save(self, jobs):
+        with self._save_lock:
+            try:
+                db_utility.update_ingest_jobs([job.to_row() for job in jobs])
+            except Exception as e:
+                logger.error(f"Could not save the progress of ingest jobs: {e}")
+
+    def _sync_loop(self):
+        # Progress of running jobs is written here rather than on every update, and keeps them alive
+        while True:
+            time.sleep(self.sync_seconds)
+            with self._lock:
+                jobs = list(self._jobs.values())
+            if jobs:
+                self._save(jobs)
+
+    def _run(self, job, target, args):
+        job.status = "running"
+        job.started_at = time.time()
+        self._save([job])
+        try:
+            target(job, *args)
+            job.status = "completed"
+        except Exception as e:
+            logger.exception(f"Ingest job {job.job_id} for {job.collection_name} failed")
+            job.status = "failed"
+            job.errors.append(str(e))
+            job.message = f"Error occurred: {str(e)}"
+        finally:
+            job.finished_at = time.time()
+            self._save([job])
+            with self._lock:
+                del self._jobs[job.job_id]
+                self._active_cache.clear()
+            try:
+                db_utility.prune_ingest_jobs(self.history)
+            except Exception as e:
+                logger.error(f"Could not prune ingest jobs: {e}")
+
+    def active_collections(self, grace_seconds=0):
+        """
+        Collections with a queued or running job in any server process, or one that finished less than
+        grace_seconds ago. The other processes' jobs are read at most once per sync_seconds.
+        """
+        now = time.time()
+        with self._lock:
+            local = {job.collection_name for job in self._jobs.values()}
+            refresh_after, collections = self._active_cache.get(grace_seconds, (0, set()))
+            if now < refresh_after:
+                return local | collections
+            # Until this read completes, concurrent callers use the previous result
+            self._active_cache[grace_seconds] = (now + self.sync_seconds, collections)
+        try:
+            self._ensure_table()
+            collections = db_utility.fetch_active_ingest_collections(now - self.stale_seconds, now - grace_seconds)
+        except Exception as e:
+            logger.error(f"Could not read the active ingest jobs: {e}")
+        with self._lock:
+            self._active_cache[grace_seconds] = (now + self.sync_seconds, collections)
+        return local | collections
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        self._ensure_table()
+        rows = db_utility.fetch_ingest_jobs(job_id=job_id)
+        return IngestJob.from_row(rows[0]) if rows else None
+
+    def list_jobs(self):
+        self._ensure_table()
+        now = time.time()
+        db_utility.fail_stale_ingest_jobs(now - self.stale_seconds, now)
+        with self._lock:
+            local = dict(self._jobs)
+        # This process's jobs are reported from memory, they are ahead of their rows
+        return [(local.get(row["job_id"]) or IngestJob.from_row(row)).to_dict()
+                for row in db_utility.fetch_ingest_jobs(limit=self.history)]
+
+
+ingest_jobs = IngestJobManager()
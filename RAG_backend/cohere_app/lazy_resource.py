@@ -0,0 +1,63 @@
+import time
+import threading
+from .Chunking_UI.enable_logging import logger
+
+# Every LazyResource created, in creation order, for warm_up
+_resources = []
+_resources_lock = threading.Lock()
+
+
+class LazyResource:
+    """
+    A heavy object (model, Milvus connection, ...) built by factory on the first get() instead of at import.
+    Concurrent first calls wait for a single build; a failed build is retried on the next get().
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        with _resources_lock:
+            _resources.append(self)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                started_at = time.perf_counter()
+                self._value = self.factory()
+                self._loaded = True
+                logger.info(f"Loaded {self.name} in {time.perf_counter() - started_at:.2f}s")
+        return self._value
+
+    def reset(self):
+        """ Drop the value so the next get() builds it again """
+        with self._lock:
+            self._value = None
+            self._loaded = False
+
+
+def warm_up(names=None):
+    """
+    Build the registered resources now rather than on the first request that needs them.
+    Returns {name: seconds taken, or the error message}.
+    """
+    with _resources_lock:
+        resources = [resource for resource in _resources if names is None or resource.name in names]
+    timings = {}
+    for resource in resources:
+        started_at = time.perf_counter()
+        try:
+            resource.get()
+            timings[resource.name] = time.perf_counter() - started_at
+        except Exception as e:
+            logger.error(f"Warm-up of {resource.name} failed: {e}")
+            timings[resource.name] = f"Error: {e}"
+    return timings
@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import deque
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+
+load_dotenv()
+
+# One SQLite FTS5 database per collection. Not a cache: collections ingested before it existed,
+# or whose index was deleted, need LexicalIndex.backfill
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", os.path.join(os.path.expanduser("~"), ".local", "share", "rag_lexical_index"))
+# "false" to search Milvus only
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+LEXICAL_SEARCH_LIMIT = int(os.getenv("LEXICAL_SEARCH_LIMIT", 15))
+# k of reciprocal-rank fusion, 60 as in the original paper
+RRF_K = int(os.getenv("RRF_K", 60))
+# Most query words turned into search terms
+LEXICAL_MAX_TERMS = int(os.getenv("LEXICAL_MAX_TERMS", 32))
+# Words in a larger share of the chunks are left out of the search: scoring them costs a scan of most
+# of the index and, like "what" or "the", they say little about which chunk answers
+LEXICAL_MAX_DOC_FRACTION = float(os.getenv("LEXICAL_MAX_DOC_FRACTION", 0.1))
+
+_WORD_PART_RE = re.compile(r'[^\W_]+')
+_COLLECTION_NAME_RE = re.compile(r'[^\w\-]')
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(text, tokenize = 'unicode61 remove_diacritics 2');
+CREATE TABLE IF NOT EXISTS chunk_sources (pk INTEGER PRIMARY KEY, source TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS chunk_sources_source ON chunk_sources (source);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunk_terms USING fts5vocab(chunks, row);
+"""
+
+
+def query_terms(query, max_terms=LEXICAL_MAX_TERMS):
+    """
+    Search terms of query as tuples of tokens. Identifiers such as SE-1030 or 9.7.6.3 are split
+    into their parts by the tokenizer, so they become phrases of those parts.
+    """
+    terms = []
+    for word in query.split():
+        parts = tuple(part.lower() for part in _WORD_PART_RE.findall(word))
+        if parts:
+            terms.append(parts)
+    return list(dict.fromkeys(terms))[:max_terms]
+
+
+def build_match_query(terms):
+    """ FTS5 query matching chunks that contain any of terms, "" for none """
+    return " OR ".join('"' + " ".join(parts) + '"' for parts in terms)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """ Fuse lists of (pk, score), each best first, into [pk, fused score] best first """
+    fused = {}
+    for ranking in rankings:
+        for rank, (pk, _) in enumerate(ranking):
+            fused[pk] = fused.get(pk, 0.0) + 1.0 / (k + rank + 1)
+    return [[pk, score] for pk, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)]
+
+
+class LexicalIndex:
+    """
+    On-disk BM25 index over chunk text, one SQLite FTS5 database per collection with the Milvus
+    primary key as rowid. Written by the ingest writer as Milvus acknowledges inserts and kept in
+    step with file and collection deletes. Records the latency of every search.
+    """
+
+    def __init__(self, index_dir=LEXICAL_INDEX_DIR):
+        self.index_dir = index_dir
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._generations = {}
+        self.search_ms = deque(maxlen=1000)
+        self.added_ms = deque(maxlen=1000)
+
+    def path(self, collection_name):
+        return os.path.join(self.index_dir, _COLLECTION_NAME_RE.sub("_", collection_name) + ".sqlite3")
+
+    def exists(self, collection_name):
+        return os.path.exists(self.path(collection_name))
+
+    def _connection(self, collection_name, create=False):
+        # sqlite3 connections stay in the thread that opened them; drop() bumps the generation so
+        # connections other threads hold on the deleted file are reopened
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        generation = self._generations.get(collection_name, 0)
+        connection, opened_generation = connections.get(collection_name, (None, None))
+        if connection is not None and opened_generation != generation:
+            connection.close()
+            connection = None
+        if connection is None:
+            if not create and not self.exists(collection_name):
+                return None
+            os.makedirs(self.index_dir, exist_ok=True)
+            connection = sqlite3.connect(self.path(collection_name))
+            # Readers are not blocked while ingestion writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            connections[collection_name] = (connection, generation)
+        return connection
+
+    def add(self, collection_name, pks, sources, texts):
+        """ Index the chunks Milvus stored under pks """
+        with self._write_lock:
+            connection = self._connection(collection_name, create=True)
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO chunks (rowid, text) VALUES (?, ?)", zip(pks, texts))
+                connection.executemany("INSERT OR REPLACE INTO chunk_sources (pk, source) VALUES (?, ?)", zip(pks, sources))
+
+    def delete_pks(self, collection_name, pks):
+        connection = self._connection(collection_name)
+        if connection is None or not pks:
+            return
+        with self._write_lock, connection:
+            connection.executemany("DELETE FROM chunks WHERE rowid = ?", ((pk,) for pk in pks))
+            connection.executemany("DELETE FROM chunk_sources WHERE pk = ?", ((pk,) for pk in pks))
+
+    def delete_sources(self, collection_name, sources):
+        """ Drop every chunk of the given source files """
+        connection = self._connection(collection_name)
+        if connection is None or not sources:
+            return
+        with self._write_lock, connection:
+            for source in sources:
+                pks = [row[0] for row in connection.execute("SELECT pk FROM chunk_sources WHERE source = ?", (source,))]
+                connection.executemany("DELETE FROM chunks WHERE rowid = ?", ((pk,) for pk in pks))
+                connection.execute("DELETE FROM chunk_sources WHERE source = ?", (source,))
+
+    def drop(self, collection_name):
+        """ Delete the index of a dropped collection """
+        with self._write_lock:
+            self._generations[collection_name] = self._generations.get(collection_name, 0) + 1
+            connection, _ = getattr(self._local, "connections", {}).pop(collection_name, (None, None))
+            if connection is not None:
+                connection.close()
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.path(collection_name) + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def backfill(self, collection, batch_size=1000):
+        """ Rebuild the index of a pymilvus Collection from the chunks stored in it, returns the chunk count """
+        self.drop(collection.name)
+        iterator = collection.query_iterator(batch_size=batch_size, output_fields=["source", "text"])
+        indexed = 0
+        while True:
+            rows = iterator.next()
+            if not rows:
+                iterator.close()
+                break
+            self.add(collection.name, [row["pk"] for row in rows], [row["source"] for row in rows], [row["text"] for row in rows])
+            indexed += len(rows)
+        logger.info(f"Indexed {indexed} chunks of {collection.name} for lexical search")
+        return indexed
+
+    def search(self, collection_name, query, limit=LEXICAL_SEARCH_LIMIT, sources=None):
+        """
+        BM25 search, returns up to limit (pk, score) best first; score is FTS5's bm25, lower is better.
+        Failures are logged and return no hits, so the vector search still answers.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        started_at = time.perf_counter()
+        try:
+            connection = self._connection(collection_name)
+            results = self._search(connection, terms, limit, sources) if connection is not None else []
+        except sqlite3.Error as e:
+            logger.error(f"Lexical search in {collection_name} failed: {e}")
+            results = []
+        self.search_ms.append((time.perf_counter() - started_at) * 1000)
+        return results
+
+    def _search(self, connection, terms, limit, sources):
+        words = [parts[0] for parts in terms if len(parts) == 1]
+        if words:
+            chunk_count = connection.execute("SELECT count(*) FROM chunk_sources").fetchone()[0]
+            common = {term for term, in connection.execute(
+                f"SELECT term FROM chunk_terms WHERE term IN ({', '.join('?' * len(words))}) AND doc > ?",
+                words + [chunk_count * LEXICAL_MAX_DOC_FRACTION])}
+            terms = [parts for parts in terms if len(parts) > 1 or parts[0] not in common]
+        if not terms:
+            return []
+        sql = "SELECT rowid, bm25(chunks) FROM chunks WHERE chunks MATCH ?"
+        params = [build_match_query(terms)]
+        if sources:
+            sql += f" AND rowid IN (SELECT pk FROM chunk_sources WHERE source IN ({', '.join('?' * len(sources))}))"
+            params.extend(sources)
+        sql += " ORDER BY bm25(chunks) LIMIT ?"
+        params.append(limit)
+        return connection.execute(sql, params).fetchall()
+
+    def record_added_latency(self, milliseconds):
+        """ Time a hybrid search waited on top of the vector search alone """
+        self.added_ms.append(milliseconds)
+
+    @staticmethod
+    def _percentiles(samples):
+        samples = sorted(samples)
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": len(samples),
+            "average_ms": sum(samples) / len(samples),
+            "p50_ms": samples[len(samples) // 2],
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        }
+
+    def stats(self):
+        return {
+            "enabled": HYBRID_SEARCH,
+            "search": self._percentiles(self.search_ms),
+            "added_latency": self._percentiles(self.added_ms),
+        }
+
+
+lexical_index = LexicalIndex()
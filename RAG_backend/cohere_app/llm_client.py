@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+
+load_dotenv()
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 200))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 50))
+# Upper bound on concurrent upstream streams, further requests wait for a free slot
+LLM_MAX_CONCURRENT_STREAMS = int(os.getenv("LLM_MAX_CONCURRENT_STREAMS", 256))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 120))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", 30))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 1500))
+
+_DONE = object()
+
+
+def parse_sse_line(line):
+    """ Return the delta content of one SSE line, _DONE at the end of the stream, or None """
+    if not line:
+        return None
+    if line.startswith("data:"):
+        line = line[5:].strip()
+    if line == "[DONE]":
+        return _DONE
+    try:
+        chunk_data = json.loads(line)
+        return chunk_data.get('choices', [{}])[0].get('delta', {}).get('content', '') or None
+    except json.JSONDecodeError as e:
+        print(f"JSON Decode Error: {e}")
+        print(f"Raw chunk (decoded): {line}")
+    except Exception as e:
+        print(f"Error processing chunk: {e}")
+    return None
+
+
+class LLMClient:
+    """
+    Streaming client for the TGI chat completions endpoint with pooled keep-alive connections.
+    stream_chat serves the sync WSGI views, astream_chat the ASGI ones; both record the
+    time to first token of every request.
+    """
+
+    def __init__(self, url, system_prompt, max_tokens=LLM_MAX_TOKENS):
+        self.url = url
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.headers = {"Content-Type": "application/json"}
+        self.session = requests.Session()
+        self.session.trust_env = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_MAX_KEEPALIVE_CONNECTIONS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._async_clients = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.ttft_samples = deque(maxlen=1000)
+
+    def build_payload(self, question, context):
+        return {
+            "model": "tgi",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self.system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": f"Refer to the Context scrapped from Vector Database {context} and answer for user question {question}"
+                }
+            ],
+            "stream": True,
+            "max_tokens": self.max_tokens
+        }
+
+    def _record_ttft(self, started_at, metrics):
+        ttft_ms = (time.perf_counter() - started_at) * 1000
+        self.ttft_samples.append(ttft_ms)
+        if metrics is not None:
+            metrics["ttft_ms"] = ttft_ms
+        logger.info(f"LLM time to first token: {ttft_ms:.0f} ms")
+
+    def _upstream_error(self, status_code, body):
+        logger.error(f"LLM request to {self.url} failed with status {status_code}: {body[:500]}")
+        return RuntimeError(f"LLM request failed with status {status_code}")
+
+    def stream_chat(self, question, context, metrics=None):
+        """ Yield the content deltas of one answer over the pooled sync session """
+        started_at = time.perf_counter()
+        first_token = True
+        with self.session.post(self.url, headers=self.headers, data=json.dumps(self.build_payload(question, context)),
+                               stream=True, timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)) as response:
+            if response.status_code != 200:
+                raise self._upstream_error(response.status_code, response.text)
+            # SSE is UTF-8; decode_unicode would use ISO-8859-1 for a text/* response without a charset
+            for line in response.iter_lines():
+                content = parse_sse_line(line.decode('utf-8'))
+                if content is _DONE:
+                    break
+                if content:
+                    if first_token:
+                        self._record_ttft(started_at, metrics)
+                        first_token = False
+                    yield content
+
+    def _async_client(self):
+        # httpx clients are bound to the event loop they were first used on
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = httpx.AsyncClient(
+                    headers=self.headers,
+                    trust_env=False,
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS),
+                    timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT, pool=LLM_POOL_TIMEOUT),
+                )
+                self._async_clients[loop] = client
+                self._semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENT_STREAMS)
+            return client, self._semaphores[loop]
+
+    async def astream_chat(self, question, context, metrics=None):
+        """
+        Async generator of the content deltas of one answer. The upstream response is only read
+        as fast as the caller consumes it, and is closed if the caller stops early.
+        """
+        client, semaphore = self._async_client()
+        async with semaphore:
+            started_at = time.perf_counter()
+            first_token = True
+            async with client.stream("POST", self.url, json=self.build_payload(question, context)) as response:
+                if response.status_code != 200:
+                    raise self._upstream_error(response.status_code, (await response.aread()).decode('utf-8', 'replace'))
+                async for line in response.aiter_lines():
+                    content = parse_sse_line(line)
+                    if content is _DONE:
+                        break
+                    if content:
+                        if first_token:
+                            self._record_ttft(started_at, metrics)
+                            first_token = False
+                        yield content
+
+    def ttft_stats(self):
+        samples = sorted(self.ttft_samples)
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": len(samples),
+            "average_ms": sum(samples) / len(samples),
+            "p50_ms": samples[len(samples) // 2],
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        }
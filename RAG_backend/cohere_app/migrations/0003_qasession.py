@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cohere_app', '0002_delete_usernames'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QASession',
+            fields=[
+                ('session_key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.TextField()),
+                ('updated_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,153 @@
+import os
+import time
+import hashlib
+import threading
+from langchain_core.embeddings import Embeddings
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+
+load_dotenv()
+
+# Hub name of the embedding model, loaded when EMBEDDING_MODEL_PATH does not exist
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", 'sentence-transformers/all-MiniLM-L6-v2')
+# Local copy of the same model, loaded instead of the hub name when it exists
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", '/home/qa-prod/Desktop/QA/RAG_backend/cohere_app/embedding_model')
+# "torch"; "onnx" to run the model through the sentence-transformers ONNX Runtime backend
+# (needs sentence-transformers[onnx]); "onnx-int8" for this repo's int8 export, see onnx_embedding
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# ONNX file inside the model folder, e.g. onnx/model_qint8_avx2.onnx for an int8-quantized export
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "")
+# Files of a model folder up to this size are hashed by content for embedding_model_id, larger ones (the weights) by size and mtime
+MODEL_FINGERPRINT_CONTENT_BYTES = 1024 * 1024
+
+
+def embedding_model_source():
+    return EMBEDDING_MODEL_PATH if EMBEDDING_MODEL_PATH and os.path.isdir(EMBEDDING_MODEL_PATH) else EMBEDDING_MODEL_NAME
+
+
+def model_fingerprint(source):
+    """ Short hash of the files of a local model folder, None for a hub name """
+    if not os.path.isdir(source):
+        return None
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, source)}\0{stat.st_size}\0".encode("utf-8"))
+            if stat.st_size <= MODEL_FINGERPRINT_CONTENT_BYTES:
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+            else:
+                digest.update(str(stat.st_mtime_ns).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def embedding_model_id():
+    """
+    Names the vectors the configured model produces, for caches keyed by model: the folder or hub name
+    actually loaded and, for a folder, a fingerprint of its files, so replacing the model in place changes it.
+    """
+    source = embedding_model_source()
+    fingerprint = model_fingerprint(source)
+    model_id = f"{source}@{fingerprint}" if fingerprint else source
+    if EMBEDDING_BACKEND == "torch":
+        return model_id
+    return f"{model_id}:{EMBEDDING_BACKEND}:{EMBEDDING_ONNX_FILE}"
+
+
+def resident_memory():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def parameter_bytes(model):
+    if hasattr(model, "file_bytes"):
+        return model.file_bytes
+    try:
+        return sum(parameter.numel() * parameter.element_size() for parameter in model.parameters())
+    except Exception:
+        return None
+
+
+class SharedEmbeddings(Embeddings):
+    """ LangChain Embeddings over a registry model, encoding the way HuggingFaceEmbeddings does by default """
+
+    def __init__(self, model):
+        self.model = model
+
+    def embed_documents(self, texts):
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.model.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class ModelRegistry:
+    """
+    Loads each distinct (model, backend) once per process and hands the same instance to query
+    encoding, ingestion and FAISS uploads. Records the load time, parameter size and the growth
+    of the process resident memory while each model loaded.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._info = {}
+        self._lock = threading.Lock()
+
+    def sentence_transformer(self, source=None, backend=EMBEDDING_BACKEND, onnx_file=EMBEDDING_ONNX_FILE):
+        source = source or embedding_model_source()
+        key = (source, backend, onnx_file if backend == "onnx" else "")
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._load(key)
+                self._models[key] = model
+        return model
+
+    def _load(self, key):
+        source, backend, onnx_file = key
+        rss_before = resident_memory()
+        started_at = time.perf_counter()
+        if backend == "onnx-int8":
+            from .onnx_embedding import load_onnx_encoder
+            model = load_onnx_encoder(source)
+        else:
+            from sentence_transformers import SentenceTransformer
+            kwargs = {"device": "cpu"}
+            if backend != "torch":
+                kwargs["backend"] = backend
+                if onnx_file:
+                    kwargs["model_kwargs"] = {"file_name": onnx_file}
+            model = SentenceTransformer(source, **kwargs)
+        rss_after = resident_memory()
+        self._info[key] = {
+            "model": source,
+            "backend": backend,
+            "onnx_file": onnx_file,
+            "load_seconds": time.perf_counter() - started_at,
+            "parameter_bytes": parameter_bytes(model),
+            "resident_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+        }
+        logger.info(f"Loaded embedding model {source} ({backend}) in {self._info[key]['load_seconds']:.2f}s")
+        return model
+
+    def embeddings(self, source=None, backend=EMBEDDING_BACKEND, onnx_file=EMBEDDING_ONNX_FILE):
+        """ The shared model behind the LangChain Embeddings interface """
+        return SharedEmbeddings(self.sentence_transformer(source, backend, onnx_file))
+
+    def stats(self):
+        with self._lock:
+            models = [dict(info) for info in self._info.values()]
+        return {"models": models, "process_resident_bytes": resident_memory()}
+
+
+model_registry = ModelRegistry()
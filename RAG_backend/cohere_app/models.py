@@ -29,3 +29,13 @@ class CurrentUsingCollection(models.Model):
     def __str__(self):
         return self.current_using_collection
 
+
+
+class QASession(models.Model):
+    # Pagination state of a QA conversation, shared by every server process; see session_store
+    session_key = models.CharField(max_length=64, primary_key=True)
+    data = models.TextField()
+    updated_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.session_key
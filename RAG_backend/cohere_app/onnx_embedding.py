@@ -0,0 +1,140 @@
+import os
+import json
+import numpy as np
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+
+load_dotenv()
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rag_onnx_embedding"))
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", min(4, os.cpu_count() or 1)))
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", 32))
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model_int8.onnx"
+CONFIG_FILE = "onnx_config.json"
+
+
+def _sentence_transformer_settings(source):
+    """ max_seq_length and whether the model ends with a Normalize module, read like sentence-transformers does """
+    max_seq_length, normalize = 256, False
+    config_path = os.path.join(source, "sentence_bert_config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            max_seq_length = json.load(f).get("max_seq_length", max_seq_length)
+    modules_path = os.path.join(source, "modules.json")
+    if os.path.exists(modules_path):
+        with open(modules_path, "r", encoding="utf-8") as f:
+            normalize = any(module.get("type", "").endswith("Normalize") for module in json.load(f))
+    elif not os.path.isdir(source):
+        # Hub names such as sentence-transformers/all-MiniLM-L6-v2 end with Normalize
+        normalize = True
+    return max_seq_length, normalize
+
+
+def export_onnx_int8(source, output_dir):
+    """
+    Export the transformer of a sentence-transformers model to ONNX with dynamic batch and sequence
+    axes, then quantize its weights to int8 with ONNX Runtime dynamic quantization.
+    Needs torch, transformers and onnxruntime; returns output_dir.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    model = AutoModel.from_pretrained(source).eval()
+    max_seq_length, normalize = _sentence_transformer_settings(source)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(output_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, os.path.join(output_dir, INT8_FILE), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({"source": source, "max_seq_length": max_seq_length, "normalize": normalize}, f)
+    logger.info(f"Exported {source} to ONNX int8 in {output_dir}")
+    return output_dir
+
+
+def default_onnx_dir(source):
+    return os.path.join(ONNX_MODEL_DIR, os.path.basename(os.path.normpath(source)))
+
+
+class OnnxSentenceEncoder:
+    """
+    Int8 ONNX Runtime version of a sentence-transformers model with mean pooling.
+    encode() takes and returns what SentenceTransformer.encode does for the arguments this repo uses,
+    so it can stand in for the torch model in the registry.
+    """
+
+    def __init__(self, model_dir, intra_op_threads=ONNX_INTRA_OP_THREADS, batch_size=ONNX_BATCH_SIZE, model_file=INT8_FILE):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.model_dir = model_dir
+        self.model_path = os.path.join(model_dir, model_file)
+        self.max_seq_length = config["max_seq_length"]
+        self.normalize = config["normalize"]
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        # Requests are already parallel across threads, one operator at a time each
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    @property
+    def file_bytes(self):
+        return os.path.getsize(self.model_path)
+
+    def _encode_batch(self, texts):
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np")
+        inputs = {name: tokens[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(None, inputs)[0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+        # Similar lengths share a batch so little of it is padding, like sentence-transformers
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        vectors = [self._encode_batch([texts[i] for i in order[start:start + batch_size]])
+                   for start in range(0, len(texts), batch_size)]
+        embeddings = np.empty((len(texts), vectors[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(vectors)
+        return embeddings[0] if single else embeddings
+
+
+def load_onnx_encoder(source, model_dir=None):
+    """ The int8 encoder of source, exporting it on first use """
+    model_dir = model_dir or default_onnx_dir(source)
+    if not os.path.exists(os.path.join(model_dir, INT8_FILE)):
+        export_onnx_int8(source, model_dir)
+    return OnnxSentenceEncoder(model_dir)
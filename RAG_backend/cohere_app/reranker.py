@@ -0,0 +1,181 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+from .lazy_resource import LazyResource
+
+load_dotenv()
+
+# Cross-encoder scoring (question, chunk) pairs, a local folder or a hub name such as
+# cross-encoder/ms-marco-MiniLM-L-6-v2; empty keeps the retrieval order
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")
+# Hits re-ranked per question, the rest keep their retrieval order behind them
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", 20))
+# Longest a question waits for the cross-encoder before falling back to the retrieval order
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 300))
+# Tokens of question and chunk seen by the cross-encoder, longer pairs are truncated
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", 256))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 50000))
+# Forward passes running or queued at once; past it questions keep the retrieval order without waiting
+RERANK_MAX_PENDING = int(os.getenv("RERANK_MAX_PENDING", 2))
+
+
+def load_cross_encoder():
+    if not RERANKER_MODEL:
+        return None
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANKER_MODEL, device="cpu", max_length=RERANK_MAX_LENGTH)
+
+
+cross_encoder = LazyResource("cross_encoder", load_cross_encoder)
+
+
+def question_hash(question):
+    return hashlib.sha1(" ".join(question.split()).encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """
+    Re-orders the best hits of a question by a cross-encoder run on CPU, all uncached pairs in one
+    forward pass. Pair scores are cached by (question hash, pk). A question waits at most budget_ms;
+    past it the hits keep their retrieval order and the pass still finishes in the background, so
+    its scores are cached for the next time the question is asked. At most max_pending passes run or
+    wait at once, further questions keep their retrieval order straight away. Until the cross-encoder
+    is loaded (at start with RAG_WARM_UP) questions keep their retrieval order while it loads in the background.
+    """
+
+    def __init__(self, top_n=RERANK_TOP_N, budget_ms=RERANK_BUDGET_MS, cache_size=RERANK_CACHE_SIZE,
+                 max_pending=RERANK_MAX_PENDING):
+        self.top_n = top_n
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        # One forward pass at a time, torch already spreads each one over the CPU cores
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self._pending = 0
+        self._loading = False
+        self.reranked = 0
+        self.fallbacks = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.latency_ms = deque(maxlen=1000)
+
+    @property
+    def enabled(self):
+        return bool(RERANKER_MODEL) and self.top_n > 0
+
+    def _cached(self, keys):
+        with self._lock:
+            scores = {}
+            for key in keys:
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                    scores[key] = score
+            self.cache_hits += len(scores)
+            self.cache_misses += len(keys) - len(scores)
+            return scores
+
+    def _score(self, keys, pairs):
+        scores = cross_encoder.get().predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        scores = dict(zip(keys, (float(score) for score in scores)))
+        with self._lock:
+            self._scores.update(scores)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+        return scores
+
+    def _load(self):
+        try:
+            cross_encoder.get()
+        except Exception as e:
+            logger.error(f"Loading the re-ranker {RERANKER_MODEL} failed: {e}")
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _submit(self, missing, pairs):
+        """ Future of the forward pass scoring pairs, or None when the model is not loaded or too many passes are pending """
+        with self._lock:
+            if not cross_encoder.loaded:
+                if not self._loading:
+                    self._loading = True
+                    self._pool.submit(self._load)
+                return None
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+        future = self._pool.submit(self._score, missing, pairs)
+        future.add_done_callback(self._done)
+        return future
+
+    def rerank(self, question, hits, entities):
+        """
+        hits: [pk, score] best first; entities: pk -> entity with the text, for at least the top_n hits.
+        Returns (hits, reranked): the top_n hits ordered by cross-encoder score, which replaces
+        their score, followed by the others; reranked is False when the retrieval order was kept.
+        """
+        started_at = time.perf_counter()
+        head = [hit for hit in hits[:self.top_n] if hit[0] in entities]
+        digest = question_hash(question)
+        keys = [(digest, pk) for pk, _ in head]
+        scores = self._cached(keys)
+        missing = [key for key in keys if key not in scores]
+        try:
+            if missing:
+                pairs = [(question, entities[pk].get('text') or "") for _, pk in missing]
+                future = self._submit(missing, pairs)
+                if future is None:
+                    with self._lock:
+                        self.fallbacks += 1
+                    return hits, False
+                remaining_ms = self.budget_ms - (time.perf_counter() - started_at) * 1000
+                scores.update(future.result(timeout=max(0.0, remaining_ms) / 1000))
+        except TimeoutError:
+            logger.warning(f"Re-ranking {len(missing)} hits took over {self.budget_ms:.0f} ms, keeping the retrieval order")
+            with self._lock:
+                self.fallbacks += 1
+            return hits, False
+        except Exception as e:
+            logger.error(f"Re-ranking failed, keeping the retrieval order: {e}")
+            with self._lock:
+                self.fallbacks += 1
+            return hits, False
+
+        reranked = sorted(([pk, scores[(digest, pk)]] for pk, _ in head), key=lambda hit: hit[1], reverse=True)
+        head_pks = {pk for pk, _ in head}
+        with self._lock:
+            self.reranked += 1
+            self.latency_ms.append((time.perf_counter() - started_at) * 1000)
+        return reranked + [hit for hit in hits if hit[0] not in head_pks], True
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latency_ms)
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "model": RERANKER_MODEL or None,
+                "top_n": self.top_n,
+                "budget_ms": self.budget_ms,
+                "loaded": cross_encoder.loaded,
+                "pending": self._pending,
+                "reranked": self.reranked,
+                "fallbacks": self.fallbacks,
+                "cached_scores": len(self._scores),
+                "cache_hit_rate": self.cache_hits / lookups if lookups else 0,
+                "p50_ms": latencies[len(latencies) // 2] if latencies else None,
+                "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+            }
+
+
+reranker = Reranker()
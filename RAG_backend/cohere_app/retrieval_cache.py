@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+from .Chunking_UI import db_utility
+
+load_dotenv()
+
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 1024))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", 600))
+# Cosine similarity above which a cached query is reused for a new one, 0 disables the semantic tier
+RETRIEVAL_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("RETRIEVAL_CACHE_SEMANTIC_THRESHOLD", 0))
+# Longest a server process serves results of a collection another process has since changed
+RETRIEVAL_CACHE_GENERATION_SECONDS = float(os.getenv("RETRIEVAL_CACHE_GENERATION_SECONDS", 2))
+
+
+def normalize_query(query):
+    """ Lowercase, collapse whitespace and drop trailing punctuation so trivially different questions share an entry """
+    query = re.sub(r'\s+', ' ', query.lower()).strip()
+    return query.rstrip('?.! ')
+
+
+class RetrievalCache:
+    """
+    LRU + TTL cache of collection.search results, as compact [pk, score] lists, keyed on
+    (collection, normalized query, selected files).
+    An optional semantic tier serves a cached result when a new query embedding is within
+    the cosine threshold of a cached query for the same collection and file filter.
+    Entries carry the generation of their collection from the collection_generations table, which
+    invalidate bumps; an entry of an older generation is stale in every server process, at most
+    generation_seconds after the change. Without the table no result is cached.
+    """
+
+    def __init__(self, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES, ttl=RETRIEVAL_CACHE_TTL_SECONDS,
+                 semantic_threshold=RETRIEVAL_CACHE_SEMANTIC_THRESHOLD,
+                 generation_seconds=RETRIEVAL_CACHE_GENERATION_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.generation_seconds = generation_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # collection name -> (read again after, generation or None when it could not be read)
+        self._generations = {}
+        self._table_ready = False
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(collection_name, query, selected_file):
+        files = tuple(sorted(selected_file)) if selected_file else ()
+        return (collection_name, normalize_query(query), files)
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            db_utility.create_collection_generations()
+            self._table_ready = True
+
+    def generation(self, collection_name):
+        """
+        Current generation of collection_name, read from the table at most once per generation_seconds.
+        Pass it to get and put of the same search, so results of a search that raced with a change are not cached as fresh.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._generations.get(collection_name)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+        try:
+            self._ensure_table()
+            generation = db_utility.fetch_collection_generation(collection_name)
+        except Exception as e:
+            logger.error(f"Reading the generation of {collection_name} failed, not caching its results: {e}")
+            generation = None
+        with self._lock:
+            self._generations[collection_name] = (now + self.generation_seconds, generation)
+        return generation
+
+    def get(self, collection_name, query, selected_file, query_vector=None, generation=None):
+        if generation is None:
+            generation = self.generation(collection_name)
+        key = self.make_key(collection_name, query, selected_file)
+        now = time.monotonic()
+        with self._lock:
+            if generation is None:
+                self.misses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, entry_generation, _, results = entry
+                if expires_at > now and entry_generation == generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return results
+                del self._entries[key]
+
+            if self.semantic_threshold and query_vector is not None:
+                results = self._semantic_lookup(key, self._unit(query_vector), now, generation)
+                if results is not None:
+                    self.semantic_hits += 1
+                    return results
+
+            self.misses += 1
+            return None
+
+    def _semantic_lookup(self, key, unit_vector, now, generation):
+        best_key, best_score = None, self.semantic_threshold
+        for cached_key, (expires_at, entry_generation, cached_vector, _) in self._entries.items():
+            if cached_vector is None or expires_at <= now or entry_generation != generation:
+                continue
+            if cached_key[0] != key[0] or cached_key[2] != key[2]:
+                continue
+            score = float(np.dot(unit_vector, cached_vector))
+            if score >= best_score:
+                best_key, best_score = cached_key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key][3]
+
+    def put(self, collection_name, query, selected_file, results, query_vector=None, generation=None):
+        if generation is None:
+            generation = self.generation(collection_name)
+            if generation is None:
+                return
+        key = self.make_key(collection_name, query, selected_file)
+        unit_vector = self._unit(query_vector) if query_vector is not None else None
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, generation, unit_vector, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, collection_name):
+        """ Drop every cached result of a collection after its contents changed, in every server process """
+        try:
+            self._ensure_table()
+            db_utility.bump_collection_generation(collection_name)
+        except Exception as e:
+            logger.error(f"Bumping the generation of {collection_name} failed, other server processes may serve stale results: {e}")
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == collection_name]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            # Read again on the next search, after the bump
+            self._generations.pop(collection_name, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "semantic_threshold": self.semantic_threshold,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+retrieval_cache = RetrievalCache()
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import threading
+from collections import namedtuple, Counter
+from dotenv import load_dotenv
+from .Chunking_UI.enable_logging import logger
+from .ingest_jobs import ingest_jobs
+
+load_dotenv()
+
+# Profile of collections missing from SEARCH_PROFILES_FILE
+SEARCH_EF = int(os.getenv("SEARCH_EF", 30))
+# Clusters visited by searches of IVF_FLAT / IVF_SQ8 collections, see MILVUS_INDEX_TYPE
+SEARCH_NPROBE = int(os.getenv("SEARCH_NPROBE", 16))
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 15))
+# Consistency while the collection is not being ingested: Bounded, Session, Eventually or Strong
+SEARCH_CONSISTENCY = os.getenv("SEARCH_CONSISTENCY", "Bounded")
+# Optional JSON file {"<collection>": {"ef": 64, "nprobe": 16, "limit": 20, "consistency_level": "Session"}, ...};
+# missing keys take the defaults above. Re-read when it changes, at most once per SEARCH_PROFILES_RELOAD_INTERVAL seconds.
+# benchmarks/search_sweep.py measures the recall and latency of each ef to choose from.
+SEARCH_PROFILES_FILE = os.getenv("SEARCH_PROFILES_FILE", "")
+SEARCH_PROFILES_RELOAD_INTERVAL = float(os.getenv("SEARCH_PROFILES_RELOAD_INTERVAL", 30))
+# Searches stay Strong this long after an ingest of the collection ended, until its last inserts are visible
+INGEST_STRONG_GRACE_SECONDS = float(os.getenv("INGEST_STRONG_GRACE_SECONDS", 10))
+
+CONSISTENCY_LEVELS = ("Strong", "Bounded", "Session", "Eventually")
+
+SearchProfile = namedtuple("SearchProfile", ["ef", "nprobe", "limit", "consistency_level"])
+
+
+def make_profile(config, default):
+    """ SearchProfile from a dict of the profiles file, raising ValueError on invalid values """
+    profile = SearchProfile(
+        int(config.get("ef", default.ef)),
+        int(config.get("nprobe", default.nprobe)),
+        int(config.get("limit", default.limit)),
+        config.get("consistency_level", default.consistency_level),
+    )
+    if profile.consistency_level not in CONSISTENCY_LEVELS:
+        raise ValueError(f"consistency_level must be one of {', '.join(CONSISTENCY_LEVELS)}")
+    # Milvus rejects an HNSW search whose ef is below its limit
+    if profile.limit < 1 or profile.ef < profile.limit or profile.nprobe < 1:
+        raise ValueError(f"need 1 <= limit <= ef and nprobe >= 1, got limit {profile.limit}, ef {profile.ef}, nprobe {profile.nprobe}")
+    return profile
+
+
+class SearchProfiles:
+    """
+    ef (nprobe for IVF indexes), limit and consistency of collection.search per collection.
+    A collection being ingested, by any server process, is searched with Strong consistency so fresh inserts show up;
+    otherwise its profile's level is used, which does not wait for the latest timestamp.
+    """
+
+    def __init__(self, default=None, profiles_file=SEARCH_PROFILES_FILE,
+                 reload_interval=SEARCH_PROFILES_RELOAD_INTERVAL, grace_seconds=INGEST_STRONG_GRACE_SECONDS):
+        self.default = default or make_profile({}, SearchProfile(SEARCH_EF, SEARCH_NPROBE, SEARCH_LIMIT, SEARCH_CONSISTENCY))
+        self.profiles_file = profiles_file
+        self.reload_interval = reload_interval
+        self.grace_seconds = grace_seconds
+        self.profiles = {}
+        # collection name -> index type of its vector field, which decides between ef and nprobe
+        self._index_types = {}
+        self._profiles_mtime = None
+        self._next_reload_check = 0.0
+        self._lock = threading.Lock()
+        self.searches = Counter()
+        if self.profiles_file:
+            self.reload()
+
+    def reload(self):
+        """ Re-read the profiles file; the current profiles stay on any error """
+        with self._lock:
+            self._next_reload_check = time.monotonic() + self.reload_interval
+            if not self.profiles_file or not os.path.exists(self.profiles_file):
+                return False
+            try:
+                mtime = os.path.getmtime(self.profiles_file)
+                with open(self.profiles_file, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                profiles = {name: make_profile(profile, self.default) for name, profile in config.items()}
+            except Exception as e:
+                logger.warning(f"Search profiles not reloaded from {self.profiles_file}: {e}")
+                return False
+            self.profiles = profiles
+            self._profiles_mtime = mtime
+            return True
+
+    def _maybe_reload(self):
+        if not self.profiles_file or time.monotonic() < self._next_reload_check:
+            return
+        try:
+            mtime = os.path.getmtime(self.profiles_file)
+        except OSError:
+            self._next_reload_check = time.monotonic() + self.reload_interval
+            return
+        if mtime != self._profiles_mtime:
+            self.reload()
+        else:
+            self._next_reload_check = time.monotonic() + self.reload_interval
+
+    def for_collection(self, collection_name):
+        """ The SearchProfile to search collection_name with right now """
+        self._maybe_reload()
+        profile = self.profiles.get(collection_name, self.default)
+        if profile.consistency_level != "Strong" and collection_name in ingest_jobs.active_collections(self.grace_seconds):
+            profile = profile._replace(consistency_level="Strong")
+        with self._lock:
+            self.searches[profile.consistency_level] += 1
+        return profile
+
+    def search_params(self, collection, profile):
+        """ param of collection.search for profile, by the type of the collection's vector index """
+        index_type = self._index_types.get(collection.name)
+        if index_type is None:
+            index_type = next((index.params.get("index_type") for index in collection.indexes
+                               if index.field_name == "vector"), None) or "HNSW"
+            self._index_types[collection.name] = index_type
+        if index_type.startswith("IVF"):
+            return {"metric_type": "L2", "params": {"nprobe": profile.nprobe}}
+        return {"metric_type": "L2", "params": {"ef": profile.ef}}
+
+    def invalidate(self, collection_name):
+        """ Forget the index type of a dropped collection, a new one of that name may be indexed differently """
+        self._index_types.pop(collection_name, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "default": self.default._asdict(),
+                "profiles": {name: profile._asdict() for name, profile in self.profiles.items()},
+                "searches_by_consistency": dict(self.searches),
+            }
+
+
+search_profiles = SearchProfiles()
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "memory" keeps sessions in this process, "database" in the QASession table shared by all processes
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")
+SESSION_STORE_MAX_ENTRIES = int(os.getenv("SESSION_STORE_MAX_ENTRIES", 10000))
+SESSION_STORE_TTL_SECONDS = float(os.getenv("SESSION_STORE_TTL_SECONDS", 3600))
+# The database backend purges expired and surplus rows once every this many writes
+SESSION_STORE_PURGE_EVERY = int(os.getenv("SESSION_STORE_PURGE_EVERY", 500))
+
+
+def new_session():
+    """
+    results holds compact [pk, score] pairs in rank order, the entities are fetched
+    from the collection when a page of them is shown
+    """
+    return {'results': [], 'current_index': 0, 'last_query': None, 'collection': None}
+
+
+def session_key(system_id):
+    return hashlib.sha256(str(system_id).encode('utf-8')).hexdigest()
+
+
+class MemorySessionStore:
+    """ Per-process sessions, evicted least recently used first past max_entries or after ttl seconds idle """
+
+    def __init__(self, max_entries=SESSION_STORE_MAX_ENTRIES, ttl=SESSION_STORE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, system_id):
+        key = session_key(system_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            # Callers mutate the session and save it back, like they would with the database backend
+            return json.loads(data)
+
+    def save(self, system_id, session):
+        key = session_key(system_id)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, json.dumps(session))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "max_entries": self.max_entries,
+                    "ttl_seconds": self.ttl, "evictions": self.evictions}
+
+
+class DatabaseSessionStore:
+    """ Sessions in the QASession table so "continue" reaches the same state from any server process """
+
+    def __init__(self, max_entries=SESSION_STORE_MAX_ENTRIES, ttl=SESSION_STORE_TTL_SECONDS, purge_every=SESSION_STORE_PURGE_EVERY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, system_id):
+        from django.utils import timezone
+        from .models import QASession
+        row = QASession.objects.filter(
+            session_key=session_key(system_id),
+            updated_at__gte=timezone.now() - timedelta(seconds=self.ttl)
+        ).only("data").first()
+        return json.loads(row.data) if row else None
+
+    def save(self, system_id, session):
+        from django.utils import timezone
+        from .models import QASession
+        QASession.objects.update_or_create(
+            session_key=session_key(system_id),
+            defaults={"data": json.dumps(session), "updated_at": timezone.now()}
+        )
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.purge_every == 0
+        if purge:
+            self.purge()
+
+    def purge(self):
+        """ Delete expired sessions, then the least recently used ones past max_entries """
+        from django.utils import timezone
+        from .models import QASession
+        QASession.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=self.ttl)).delete()
+        cutoff = QASession.objects.order_by("-updated_at").values_list("updated_at", flat=True)[self.max_entries:self.max_entries + 1]
+        if cutoff:
+            QASession.objects.filter(updated_at__lte=cutoff[0]).delete()
+
+    def stats(self):
+        from .models import QASession
+        return {"backend": "database", "entries": QASession.objects.count(), "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl}
+
+
+def create_session_store(backend=SESSION_STORE_BACKEND):
+    if backend == "database":
+        return DatabaseSessionStore()
+    if backend != "memory":
+        raise ValueError(f"Unknown SESSION_STORE_BACKEND {backend!r}, expected 'memory' or 'database'")
+    return MemorySessionStore()
+
+
+session_store = create_session_store()
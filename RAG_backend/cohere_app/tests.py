@@ -1,3 +1,1147 @@
-from django.test import TestCase
+import io
+import os
+import re
+import json
+import hashlib
+import random
+import tempfile
+import threading
+from concurrent.futures import Future
+from unittest import mock
+import numpy as np
+import requests
+from django.test import SimpleTestCase
+from .Chunking_UI.embedding_cache import EmbeddingCache, KEY_SIZE
+from .Chunking_UI.milvus_writer import MilvusIngestWriter
+from .Chunking_UI.collection_builder import CollectionBuilder
+from .Chunking_UI.ocr_engine import OcrEngine, BrokenProcessPool
+from .Chunking_UI.folder_sync import content_hash, plan_sync
+from .Chunking_UI import file_catalog
+from .Chunking_UI.file_process import clean_chunk, clean_text, iter_chunks
+from .llm_client import LLMClient
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .ingest_jobs import IngestJob, IngestJobManager
+from .search_profiles import SearchProfile, SearchProfiles, make_profile
+from .lazy_resource import LazyResource
+from .reranker import Reranker
+from .faiss_cache import FaissIndexCache
+from .forbidden_bank import ForbiddenBank
+from .embedding_service import EmbeddingBatcher
+from .context_assembler import ContextAssembler
+from .session_store import MemorySessionStore, DatabaseSessionStore, create_session_store, new_session
+from .guardrail_engine import GuardrailEngine, FORBIDDEN_REGEX_PATTERNS, NEUTRAL_POSITIVE_TERMS
+from .retrieval_cache import RetrievalCache
+from . import model_registry
 
-# Create your tests here.
+
+class EmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def open_cache(self):
+        return EmbeddingCache("test-model", self.directory.name)
+
+    @staticmethod
+    def vectors(*values):
+        return np.array([[value] * 4 for value in values], dtype=np.float32)
+
+    def assert_cached(self, cache, texts, values):
+        found = cache.get_many([cache.key(text) for text in texts])
+        for text, vector, value in zip(texts, found, values):
+            self.assertIsNotNone(vector, text)
+            np.testing.assert_array_equal(vector, [value] * 4)
+
+    def test_put_and_get(self):
+        cache = self.open_cache()
+        cache.put_many([cache.key("a"), cache.key("b")], self.vectors(1, 2))
+        self.assert_cached(cache, ["a", "b"], [1, 2])
+        self.assertIsNone(cache.get_many([cache.key("c")])[0])
+
+    def test_reopen_keeps_vectors(self):
+        cache = self.open_cache()
+        cache.put_many([cache.key("a"), cache.key("b")], self.vectors(1, 2))
+        self.assert_cached(self.open_cache(), ["a", "b"], [1, 2])
+
+    def test_existing_keys_are_not_appended_again(self):
+        cache = self.open_cache()
+        cache.put_many([cache.key("a")], self.vectors(1))
+        cache.put_many([cache.key("a"), cache.key("b")], self.vectors(7, 2))
+        self.assert_cached(cache, ["a", "b"], [1, 2])
+        self.assertEqual(os.path.getsize(cache.keys_path), 2 * KEY_SIZE)
+
+    def test_half_written_append_is_discarded_on_open(self):
+        cache = self.open_cache()
+        cache.put_many([cache.key("a"), cache.key("b"), cache.key("c")], self.vectors(1, 2, 3))
+        # put_many interrupted after writing its vectors and before writing its keys
+        with open(cache.vectors_path, 'ab') as f:
+            f.write(self.vectors(9, 9).tobytes())
+        reopened = self.open_cache()
+        reopened.put_many([reopened.key("d"), reopened.key("e")], self.vectors(4, 5))
+        self.assert_cached(reopened, ["a", "b", "c", "d", "e"], [1, 2, 3, 4, 5])
+        self.assert_cached(self.open_cache(), ["a", "b", "c", "d", "e"], [1, 2, 3, 4, 5])
+
+    def test_half_written_append_is_discarded_by_the_next_put(self):
+        cache = self.open_cache()
+        cache.put_many([cache.key("a")], self.vectors(1))
+        # Another process died mid-append, leaving a partial vector and a partial key
+        with open(cache.vectors_path, 'ab') as f:
+            f.write(self.vectors(9).tobytes()[:6])
+        with open(cache.keys_path, 'ab') as f:
+            f.write(b"\x01" * (KEY_SIZE + 3))
+        cache.put_many([cache.key("d"), cache.key("e")], self.vectors(4, 5))
+        self.assert_cached(cache, ["a", "d", "e"], [1, 4, 5])
+        self.assert_cached(self.open_cache(), ["a", "d", "e"], [1, 4, 5])
+
+
+class LLMClientTests(SimpleTestCase):
+
+    @staticmethod
+    def response(status_code, body, content_type="text/event-stream"):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers["Content-Type"] = content_type
+        # As the HTTP adapter does: ISO-8859-1 for a text/* response without a charset
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        return response
+
+    @staticmethod
+    def sse(*deltas):
+        lines = [f"data: {json.dumps({'choices': [{'delta': {'content': delta}}]}, ensure_ascii=False)}" for delta in deltas]
+        return ("\n\n".join(lines + ["data: [DONE]"]) + "\n").encode("utf-8")
+
+    def stream(self, response):
+        client = LLMClient("http://llm.invalid/v1/chat/completions", "prompt")
+        with mock.patch.object(client.session, "post", return_value=response):
+            return list(client.stream_chat("question", "context"))
+
+    def test_stream_decodes_utf8_without_a_charset(self):
+        self.assertEqual(self.stream(self.response(200, self.sse("Größe ", "温度", " °C"))), ["Größe ", "温度", " °C"])
+
+    def test_error_status_raises(self):
+        with self.assertRaises(RuntimeError):
+            self.stream(self.response(503, b"overloaded", content_type="text/plain"))
+
+
+class FakeCollection:
+    """ The parts of pymilvus.Collection MilvusIngestWriter uses; inserts holding a source in reject fail """
+
+    class Field:
+        def __init__(self, name, auto_id=False):
+            self.name = name
+            self.auto_id = auto_id
+
+    def __init__(self, reject=()):
+        self.schema = mock.Mock(fields=[self.Field("source"), self.Field("page"), self.Field("text"),
+                                        self.Field("pk", auto_id=True), self.Field("vector")])
+        self.reject = set(reject)
+        self.rows = {}
+        self.next_pk = 1
+        self.inserts = 0
+
+    def insert(self, data, partition_name=None):
+        self.inserts += 1
+        if self.reject & set(data[0]):
+            raise RuntimeError("rejected")
+        pks = list(range(self.next_pk, self.next_pk + len(data[0])))
+        self.next_pk += len(pks)
+        self.rows.update((pk, (source, text)) for pk, source, text in zip(pks, data[0], data[2]))
+        return mock.Mock(primary_keys=pks)
+
+    def delete(self, expr):
+        for pk in json.loads(expr[len("pk in "):]):
+            self.rows.pop(pk, None)
+
+    def sources(self):
+        return sorted({source for source, _ in self.rows.values()})
+
+
+class MilvusIngestWriterTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch("cohere_app.Chunking_UI.milvus_writer.lexical_index")
+        self.lexical_index = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def writer(collection, **kwargs):
+        writer = MilvusIngestWriter("test", **kwargs)
+        writer.collection = collection
+        return writer
+
+    @staticmethod
+    def chunks(file, count, first_page=1):
+        return [(f"{file} chunk {i}", first_page + i, first_page + i) for i in range(count)], [[0.0, 1.0]] * count
+
+    def add(self, writer, file, count, **kwargs):
+        chunks, vectors = self.chunks(file, count, kwargs.pop("first_page", 1))
+        return writer.add(file, chunks, vectors, f"{file} done", **kwargs)
+
+    def test_flushes_once_the_row_budget_is_reached(self):
+        collection = FakeCollection()
+        writer = self.writer(collection, flush_rows=5)
+        self.assertEqual(self.add(writer, "a.pdf", 2), [])
+        results = self.add(writer, "b.pdf", 3)
+        self.assertEqual(collection.inserts, 1)
+        self.assertEqual([(result["file"], len(result["pks"]), result["pages"], result["error"]) for result in results],
+                         [("a.pdf", 2, 2, None), ("b.pdf", 3, 3, None)])
+        self.assertEqual(writer.pending_rows, 0)
+        self.assertEqual(self.lexical_index.add.call_args.args[1], results[0]["pks"] + results[1]["pks"])
+
+    def test_primary_keys_follow_buffer_order(self):
+        collection = FakeCollection()
+        writer = self.writer(collection, flush_rows=100)
+        self.add(writer, "a.pdf", 3)
+        self.add(writer, "b.pdf", 2)
+        for result in writer.flush():
+            self.assertEqual({collection.rows[pk][0] for pk in result["pks"]}, {result["file"]})
+
+    def test_failed_batch_only_fails_the_rejected_file(self):
+        collection = FakeCollection(reject={"bad.pdf"})
+        writer = self.writer(collection, flush_rows=100)
+        for file in ("a.pdf", "bad.pdf", "b.pdf"):
+            self.add(writer, file, 2)
+        results = {result["file"]: result for result in writer.flush()}
+        self.assertIsNone(results["a.pdf"]["error"])
+        self.assertIsNone(results["b.pdf"]["error"])
+        self.assertTrue(results["bad.pdf"]["error"])
+        self.assertEqual(results["bad.pdf"]["pks"], [])
+        self.assertEqual(collection.sources(), ["a.pdf", "b.pdf"])
+        self.assertEqual(sorted(collection.rows), sorted(results["a.pdf"]["pks"] + results["b.pdf"]["pks"]))
+        self.assertEqual(sorted(self.lexical_index.add.call_args.args[1]), sorted(collection.rows))
+
+    def test_file_in_parts_is_reported_once_with_its_last_part(self):
+        collection = FakeCollection()
+        writer = self.writer(collection, flush_rows=2)
+        self.assertEqual(self.add(writer, "big.xlsx", 2, last=False), [])
+        self.assertTrue(writer.is_open("big.xlsx"))
+        results = self.add(writer, "big.xlsx", 2, last=True, first_page=3)
+        self.assertEqual([(result["file"], len(result["pks"]), result["pages"]) for result in results], [("big.xlsx", 4, 4)])
+        self.assertFalse(writer.is_open("big.xlsx"))
+
+    def test_failed_part_rolls_back_the_earlier_parts(self):
+        collection = FakeCollection()
+        writer = self.writer(collection, flush_rows=2)
+        self.add(writer, "big.xlsx", 2, last=False)
+        self.assertEqual(len(collection.rows), 2)
+        results = self.add(writer, "big.xlsx", 0, last=True, error="extraction stopped")
+        results += writer.flush()
+        self.assertEqual([(result["file"], result["pks"], result["error"]) for result in results],
+                         [("big.xlsx", [], "extraction stopped")])
+        self.assertEqual(collection.rows, {})
+
+
+def previous_clean_text(text):
+    """ clean_text before its passes were fused """
+    text = re.sub(r'\.{3,}', '.', text)
+    lines = text.split('\n')
+    cleaned_lines = [line.strip() for line in lines if len(line.split()) >= 4]
+    cleaned_text = '\n'.join(cleaned_lines)
+    cleaned_text = re.sub(r'^\s*$', '', cleaned_text, flags=re.MULTILINE)
+    return cleaned_text.strip()
+
+
+def previous_clean_chunk(chunk):
+    """ clean_chunk before alphanumerics were counted on a page mask """
+    lines = chunk.splitlines()
+    cleaned_lines = []
+    for line in lines:
+        stripped_line = line.strip()
+        if not stripped_line:
+            continue
+        alnum_count = sum(1 for ch in stripped_line if ch.isalnum())
+        if len(stripped_line) > 0 and (alnum_count / len(stripped_line)) < 0.3:
+            continue
+        cleaned_lines.append(line)
+    cleaned_chunk = " ".join(cleaned_lines)
+    cleaned_chunk = re.sub(r'[\-\+\|=]{2,}', ' ', cleaned_chunk)
+    cleaned_chunk = re.sub(r'\s+', ' ', cleaned_chunk)
+    return cleaned_chunk.strip()
+
+
+class TextCleaningTests(SimpleTestCase):
+    # The characters the cleaning rules care about: letters and digits of several scripts, line
+    # separators, Unicode whitespace, rule characters and dots
+    ALPHABET = (
+        list("abcXYZ019") + ["é", "ß", "٣", "Ⅻ", "漢", "_", "²", "İ"]
+        + list(" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\x85\u00a0\u2028\u2029\u3000")
+        + list("-+|=.,;:()*#/") + ["...", "--", "==", "|"]
+    )
+
+    def random_texts(self, count, seed=0):
+        rng = random.Random(seed)
+        for _ in range(count):
+            alphabet = rng.sample(self.ALPHABET, rng.randint(2, len(self.ALPHABET)))
+            yield "".join(rng.choice(alphabet) for _ in range(rng.choice([0, 1, 5, 30, 200, 2000])))
+
+    def test_clean_chunk_matches_the_previous_version(self):
+        for text in self.random_texts(3000):
+            self.assertEqual(clean_chunk(text), previous_clean_chunk(text), repr(text))
+
+    def test_clean_text_matches_the_previous_version(self):
+        for text in self.random_texts(3000, seed=1):
+            self.assertEqual(clean_text(text), previous_clean_text(text), repr(text))
+
+    def test_pdf_like_pages(self):
+        page = "Fig. 3 torque of the valve assembly ......... 12.5\n-----------\n| == | -- |\nsee\n  hull section ±0.2 mm  "
+        self.assertEqual(clean_chunk(page), previous_clean_chunk(page))
+        self.assertEqual(clean_text(page), previous_clean_text(page))
+
+
+def previous_read_and_split_text(text_by_page, chunk_size=800, overlap_size=200):
+    """
+    read_and_split_text before iter_chunks, which rebuilt its window string. Its start page was the first page
+    added since the previous chunk; current_pages here keeps the page of every window character instead,
+    giving the pages of a chunk's first and last characters as iter_chunks does.
+    """
+    def strip(text, pages):
+        left, right = len(text) - len(text.lstrip()), len(text.rstrip())
+        return text[left:right], pages[left:right]
+
+    chunks = []
+    current_text = ""
+    current_pages = []
+
+    for page_num, text in text_by_page:
+        cleaned_para = clean_chunk(text)
+        if not cleaned_para:
+            continue
+
+        current_text += cleaned_para + " "
+        current_pages += [page_num] * (len(cleaned_para) + 1)
+
+        while len(current_text) >= chunk_size:
+            chunk = current_text[:chunk_size]
+
+            if len(current_text) > chunk_size and current_text[chunk_size] == '.':
+                chunk = current_text[:chunk_size+1]
+            elif not chunk.rstrip().endswith('.'):
+                period_index = current_text.find('.', chunk_size)
+                if period_index != -1:
+                    chunk = current_text[:period_index + 1]
+
+            chunk, chunk_pages = strip(chunk, current_pages[:len(chunk)])
+            if chunk:
+                chunks.append((chunk, chunk_pages[0], chunk_pages[-1]))
+
+            current_text, current_pages = strip(current_text[len(chunk) - overlap_size:], current_pages[len(chunk) - overlap_size:])
+
+    if current_text.strip():
+        chunk, chunk_pages = strip(current_text, current_pages)
+        chunks.append((chunk, chunk_pages[0], chunk_pages[-1]))
+    return chunks
+
+
+class ChunkerTests(SimpleTestCase):
+    WORDS = ["pressure", "valve", "assembly", "hull", "section", "torque", "weld", "12.5", "Fig.", "..", "-----", "|"]
+
+    def random_pages(self, rng):
+        pages = []
+        for page_num in range(rng.randint(0, 40)):
+            lines = []
+            for _ in range(rng.choice([0, 1, 3, 20, 80])):
+                line = " ".join(rng.choice(self.WORDS) for _ in range(rng.randint(1, 14)))
+                lines.append(line + ("." if rng.random() < 0.2 else ""))
+            pages.append((page_num + 1, "\n".join(lines)))
+        return pages
+
+    def test_matches_the_previous_chunker(self):
+        rng = random.Random(0)
+        for case in range(300):
+            text_by_page = self.random_pages(rng)
+            for chunk_size, overlap_size in ((800, 200), (120, 30), (60, 20)):
+                self.assertEqual(list(iter_chunks(iter(text_by_page), chunk_size, overlap_size)),
+                                 previous_read_and_split_text(text_by_page, chunk_size, overlap_size),
+                                 f"case {case}, chunk_size {chunk_size}")
+
+    def test_page_ranges(self):
+        text_by_page = [(1, "a" * 500), (2, "   \n---"), (3, "b" * 500 + "."), (4, "c" * 100)]
+        chunks = list(iter_chunks(text_by_page))
+        self.assertEqual([(len(chunk), start, end) for chunk, start, end in chunks], [(1002, 1, 3), (300, 3, 4)])
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+
+    def test_hits_found_by_both_rankings_come_first(self):
+        vector_hits = [[1, 0.1], [2, 0.2], [3, 0.3]]
+        lexical_hits = [(3, -9.0), (4, -5.0)]
+        fused = reciprocal_rank_fusion([vector_hits, lexical_hits], k=60)
+        self.assertEqual([pk for pk, _ in fused], [3, 1, 2, 4])
+        self.assertAlmostEqual(fused[0][1], 1 / 63 + 1 / 61)
+        self.assertAlmostEqual(fused[1][1], 1 / 61)
+
+    def test_ties_keep_the_order_of_the_first_ranking(self):
+        fused = reciprocal_rank_fusion([[[1, 0.5], [2, 0.6]], [(3, -1.0), (4, -0.5)]])
+        self.assertEqual([pk for pk, _ in fused], [1, 3, 2, 4])
+
+    def test_raw_scores_are_ignored(self):
+        self.assertEqual(reciprocal_rank_fusion([[[7, 1000.0]], [(8, -1000.0)]], k=0), [[7, 1.0], [8, 1.0]])
+
+    def test_empty_rankings(self):
+        self.assertEqual(reciprocal_rank_fusion([[], []]), [])
+        self.assertEqual([pk for pk, _ in reciprocal_rank_fusion([[[5, 0.1]], []])], [5])
+
+
+class LexicalIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = LexicalIndex(directory.name)
+        texts = ["hull welding procedure SE-1030", "valve torque table", "pump maintenance schedule"] + \
+                [f"general notes part {i}" for i in range(20)]
+        sources = ["a.pdf", "b.pdf", "c.pdf"] + ["d.pdf"] * 20
+        self.index.add("test", list(range(1, len(texts) + 1)), sources, texts)
+
+    def test_search_and_filter(self):
+        self.assertEqual([pk for pk, _ in self.index.search("test", "welding SE-1030", limit=5)], [1])
+        self.assertEqual([pk for pk, _ in self.index.search("test", "valve pump", limit=5, sources=["c.pdf"])], [3])
+        # "notes" is in most chunks and left out of the search
+        self.assertEqual(self.index.search("test", "notes"), [])
+
+    def test_deletes_and_drop(self):
+        self.index.delete_sources("test", ["a.pdf"])
+        self.index.delete_pks("test", [2])
+        self.assertEqual([pk for pk, _ in self.index.search("test", "welding valve pump")], [3])
+        self.index.drop("test")
+        self.assertFalse(self.index.exists("test"))
+        self.assertEqual(self.index.search("test", "pump"), [])
+
+
+class IngestJobTests(SimpleTestCase):
+
+    @staticmethod
+    def progress(current, total, chunks=0, failed=0):
+        return {"current_progress": current, "total_files": total, "progress_percentage": 100.0 * current / total,
+                "chunks_completed": chunks, "files_failed": failed}
+
+    def test_update_counts_files_across_the_ocr_pass(self):
+        job = IngestJob("docs", "/data/docs")
+        for progress in (self.progress(1, 4, 10), self.progress(3, 4, 25, 1), self.progress(4, 4, 40, 1)):
+            job.update(progress)
+        self.assertEqual((job.files_processed, job.current_progress, job.chunks_completed, job.files_failed), (4, 4, 40, 1))
+        # The OCR pass counts its own files from 0
+        job.update(self.progress(1, 2, 45, 1))
+        job.update(self.progress(2, 2, 50, 2))
+        self.assertEqual((job.files_processed, job.current_progress, job.total_files), (6, 2, 2))
+        self.assertEqual((job.chunks_completed, job.files_failed, job.progress_percentage), (50, 2, 100.0))
+
+    def test_row_round_trip(self):
+        job = IngestJob("docs", "/data/docs")
+        job.update(self.progress(2, 5, 12))
+        job.status, job.started_at = "running", job.submitted_at + 1
+        row = job.to_row()
+        self.assertEqual(row["active_collection"], "docs")
+        self.assertEqual(IngestJob.from_row(row).to_dict()["files_processed"], 2)
+        job.status, job.finished_at = "failed", job.started_at + 1
+        job.errors.append("boom")
+        row = job.to_row()
+        self.assertIsNone(row["active_collection"])
+        restored = IngestJob.from_row(row)
+        self.assertEqual((restored.job_id, restored.status, restored.errors), (job.job_id, "failed", ["boom"]))
+
+
+class IngestJobManagerTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch("cohere_app.ingest_jobs.db_utility")
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db.insert_ingest_job.return_value = True
+        self.db.fetch_active_ingest_collections.return_value = {"other"}
+        self.manager = IngestJobManager(max_workers=1, sync_seconds=60)
+
+    def test_one_active_job_per_collection(self):
+        release = threading.Event()
+        job = self.manager.submit("docs", "/data/docs", lambda job: release.wait(5))
+        self.assertIsNotNone(job)
+        self.assertIsNone(self.manager.submit("docs", "/data/docs", lambda job: None))
+        self.assertEqual(self.manager.active_collections(), {"docs", "other"})
+        self.assertIs(self.manager.get(job.job_id), job)
+        release.set()
+        self.manager._executor.shutdown(wait=True)
+        final_row = self.db.update_ingest_jobs.call_args.args[0][0]
+        self.assertEqual((final_row["status"], final_row["active_collection"]), ("completed", None))
+
+    def test_collection_active_in_another_process(self):
+        self.db.insert_ingest_job.return_value = False
+        self.assertIsNone(self.manager.submit("docs", "/data/docs", lambda job: None))
+
+    def test_jobs_of_other_processes_are_read_from_the_table(self):
+        job = IngestJob("docs", "/data/docs")
+        self.db.fetch_ingest_jobs.return_value = [job.to_row()]
+        self.assertEqual(self.manager.get(job.job_id).job_id, job.job_id)
+        self.assertEqual([entry["job_id"] for entry in self.manager.list_jobs()], [job.job_id])
+
+    def test_active_collections_are_read_at_most_once_per_sync_interval(self):
+        self.assertEqual(self.manager.active_collections(10), {"other"})
+        self.db.fetch_active_ingest_collections.return_value = set()
+        self.assertEqual(self.manager.active_collections(10), {"other"})
+        self.assertEqual(self.db.fetch_active_ingest_collections.call_count, 1)
+
+
+class SearchProfilesTests(SimpleTestCase):
+    DEFAULT = SearchProfile(30, 16, 15, "Bounded")
+
+    def setUp(self):
+        patcher = mock.patch("cohere_app.search_profiles.ingest_jobs")
+        self.ingest_jobs = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ingest_jobs.active_collections.return_value = set()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.profiles_file = os.path.join(directory.name, "profiles.json")
+
+    def profiles(self, config):
+        with open(self.profiles_file, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        return SearchProfiles(default=self.DEFAULT, profiles_file=self.profiles_file, reload_interval=0, grace_seconds=10)
+
+    def test_make_profile_fills_in_the_defaults(self):
+        self.assertEqual(make_profile({"ef": 64, "consistency_level": "Session"}, self.DEFAULT), SearchProfile(64, 16, 15, "Session"))
+        self.assertEqual(make_profile({"ef": "48", "limit": "20"}, self.DEFAULT), SearchProfile(48, 16, 20, "Bounded"))
+
+    def test_make_profile_rejects_invalid_values(self):
+        for config in ({"consistency_level": "Eventual"}, {"ef": 10}, {"limit": 0}, {"nprobe": 0}, {"ef": "many"}):
+            with self.assertRaises(ValueError, msg=config):
+                make_profile(config, self.DEFAULT)
+
+    def test_for_collection(self):
+        profiles = self.profiles({"manuals": {"ef": 64, "limit": 20}})
+        self.assertEqual(profiles.for_collection("manuals"), SearchProfile(64, 16, 20, "Bounded"))
+        self.assertEqual(profiles.for_collection("other"), self.DEFAULT)
+
+    def test_strong_while_the_collection_is_ingested(self):
+        profiles = self.profiles({"manuals": {"ef": 64}})
+        self.ingest_jobs.active_collections.return_value = {"manuals"}
+        self.assertEqual(profiles.for_collection("manuals"), SearchProfile(64, 16, 15, "Strong"))
+        self.assertEqual(profiles.for_collection("other").consistency_level, "Bounded")
+        self.ingest_jobs.active_collections.assert_called_with(10)
+        self.assertEqual(profiles.stats()["searches_by_consistency"], {"Strong": 1, "Bounded": 1})
+
+    def test_invalid_file_keeps_the_current_profiles(self):
+        profiles = self.profiles({"manuals": {"ef": 64}})
+        with open(self.profiles_file, "w", encoding="utf-8") as f:
+            json.dump({"manuals": {"ef": 1}}, f)
+        self.assertFalse(profiles.reload())
+        self.assertEqual(profiles.for_collection("manuals").ef, 64)
+
+    def test_search_params_follow_the_index_type(self):
+        profiles = self.profiles({})
+        profile = SearchProfile(64, 8, 15, "Bounded")
+        hnsw = mock.Mock(indexes=[mock.Mock(field_name="vector", params={"index_type": "HNSW"})])
+        hnsw.name = "hnsw"
+        ivf = mock.Mock(indexes=[mock.Mock(field_name="source", params={"index_type": "INVERTED"}),
+                                 mock.Mock(field_name="vector", params={"index_type": "IVF_SQ8"})])
+        ivf.name = "ivf"
+        self.assertEqual(profiles.search_params(hnsw, profile), {"metric_type": "L2", "params": {"ef": 64}})
+        self.assertEqual(profiles.search_params(ivf, profile), {"metric_type": "L2", "params": {"nprobe": 8}})
+
+
+class FakeCrossEncoder:
+    """ Scores a pair by the length of its text, each pass waiting for release when one is given """
+
+    def __init__(self, release=None):
+        self.release = release
+        self.passes = 0
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        self.passes += 1
+        if self.release is not None:
+            self.release.wait(5)
+        return [len(text) for _, text in pairs]
+
+
+class RerankerTests(SimpleTestCase):
+    HITS = [[1, 0.1], [2, 0.2], [3, 0.3]]
+    ENTITIES = {1: {"text": "a"}, 2: {"text": "ccc"}, 3: {"text": "bb"}}
+
+    def use_model(self, model, loaded=True):
+        resource = LazyResource("test_cross_encoder", lambda: model)
+        if loaded:
+            resource.get()
+        patcher = mock.patch("cohere_app.reranker.cross_encoder", resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return resource
+
+    def test_rerank_orders_the_head_by_score_and_caches_it(self):
+        model = FakeCrossEncoder()
+        self.use_model(model)
+        reranker = Reranker(top_n=2, budget_ms=5000)
+        hits, reranked = reranker.rerank("question", self.HITS, self.ENTITIES)
+        self.assertTrue(reranked)
+        self.assertEqual(hits, [[2, 3.0], [1, 1.0], [3, 0.3]])
+        reranker.rerank("question ", self.HITS, self.ENTITIES)
+        self.assertEqual(model.passes, 1)
+
+    def test_falls_back_while_the_model_loads(self):
+        resource = self.use_model(FakeCrossEncoder(), loaded=False)
+        reranker = Reranker(top_n=3, budget_ms=5000)
+        self.assertEqual(reranker.rerank("question", self.HITS, self.ENTITIES), (self.HITS, False))
+        reranker._pool.shutdown(wait=True)
+        self.assertTrue(resource.loaded)
+
+    def test_falls_back_without_queueing_past_max_pending(self):
+        release = threading.Event()
+        model = FakeCrossEncoder(release)
+        self.use_model(model)
+        reranker = Reranker(top_n=3, budget_ms=50, max_pending=1)
+        self.assertEqual(reranker.rerank("first", self.HITS, self.ENTITIES), (self.HITS, False))
+        self.assertEqual(reranker.rerank("second", self.HITS, self.ENTITIES), (self.HITS, False))
+        release.set()
+        reranker._pool.shutdown(wait=True)
+        self.assertEqual(model.passes, 1)
+        self.assertEqual(reranker.stats()["pending"], 0)
+        self.assertEqual(reranker.stats()["fallbacks"], 2)
+
+
+class FaissIndexCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        patcher = mock.patch("cohere_app.faiss_cache.user_faiss_path", lambda folder: os.path.join(self.root, folder))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loads = []
+
+    def save(self, folder, data, mtime_ns):
+        os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+        path = os.path.join(self.root, folder, "index.faiss")
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def loader(self, path):
+        self.loads.append(path)
+        with open(os.path.join(path, "index.faiss"), "rb") as f:
+            return f.read()
+
+    def test_hit_until_the_index_files_change(self):
+        cache = FaissIndexCache(max_bytes=1000)
+        self.save("alice", b"first", 10**18)
+        self.assertEqual(cache.get("alice", self.loader), b"first")
+        self.assertEqual(cache.get("alice", self.loader), b"first")
+        self.assertEqual(len(self.loads), 1)
+        # Rebuilt by another process: same size, new mtime
+        self.save("alice", b"fresh", 2 * 10**18)
+        self.assertEqual(cache.get("alice", self.loader), b"fresh")
+        self.assertEqual((len(self.loads), cache.hits, cache.misses, cache.total_bytes), (2, 1, 2, 5))
+
+    def test_evicts_least_recently_used_past_max_bytes(self):
+        cache = FaissIndexCache(max_bytes=10)
+        for folder in ("alice", "bob", "carol"):
+            self.save(folder, b"12345", 10**18)
+            cache.get(folder, self.loader)
+        self.assertEqual(list(cache._entries), ["bob", "carol"])
+        self.assertEqual(cache.total_bytes, 10)
+
+
+class RetrievalCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch("cohere_app.retrieval_cache.db_utility")
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db.fetch_collection_generation.return_value = 0
+
+    def test_hit_on_the_normalized_query(self):
+        cache = RetrievalCache(generation_seconds=60)
+        cache.put("docs", "What is RAG?", ["b", "a"], [[1, 0.5]])
+        self.assertEqual(cache.get("docs", "  what is   rag", ["a", "b"]), [[1, 0.5]])
+        self.assertIsNone(cache.get("docs", "what is rag", None))
+        self.assertEqual(self.db.fetch_collection_generation.call_count, 1)
+
+    def test_change_in_another_process_is_seen_after_generation_seconds(self):
+        cache = RetrievalCache(generation_seconds=0)
+        cache.put("docs", "question", None, [[1, 0.5]])
+        self.assertEqual(cache.get("docs", "question", None), [[1, 0.5]])
+        self.db.fetch_collection_generation.return_value = 1
+        self.assertIsNone(cache.get("docs", "question", None))
+
+    def test_invalidate_bumps_the_shared_generation(self):
+        cache = RetrievalCache(generation_seconds=60)
+        cache.put("docs", "question", None, [[1, 0.5]])
+        self.db.fetch_collection_generation.return_value = 1
+        cache.invalidate("docs")
+        self.db.bump_collection_generation.assert_called_once_with("docs")
+        self.assertIsNone(cache.get("docs", "question", None))
+        self.assertEqual(cache.generation("docs"), 1)
+
+    def test_results_of_a_search_that_raced_with_a_change_are_not_served(self):
+        cache = RetrievalCache(generation_seconds=0)
+        generation = cache.generation("docs")
+        self.db.fetch_collection_generation.return_value = 1
+        cache.put("docs", "question", None, [[1, 0.5]], generation=generation)
+        self.assertIsNone(cache.get("docs", "question", None))
+
+    def test_nothing_is_cached_without_the_generation_table(self):
+        self.db.fetch_collection_generation.side_effect = RuntimeError("no database")
+        cache = RetrievalCache(generation_seconds=60)
+        cache.put("docs", "question", None, [[1, 0.5]])
+        self.assertIsNone(cache.get("docs", "question", None))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class EmbeddingModelIdTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.model_dir = directory.name
+        self.write("config.json", '{"hidden_size": 384}')
+
+    def write(self, name, content):
+        with open(os.path.join(self.model_dir, name), "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def model_id(self, path, backend="torch"):
+        with mock.patch.object(model_registry, "EMBEDDING_MODEL_PATH", path), \
+                mock.patch.object(model_registry, "EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2"), \
+                mock.patch.object(model_registry, "EMBEDDING_BACKEND", backend):
+            return model_registry.embedding_model_id()
+
+    def test_hub_name_without_a_local_folder(self):
+        missing = os.path.join(self.model_dir, "missing")
+        self.assertEqual(self.model_id(missing), "sentence-transformers/all-MiniLM-L6-v2")
+        self.assertEqual(self.model_id(missing, "onnx"), "sentence-transformers/all-MiniLM-L6-v2:onnx:")
+
+    def test_local_folder_changes_the_id_when_replaced(self):
+        first = self.model_id(self.model_dir)
+        self.assertTrue(first.startswith(self.model_dir + "@"))
+        self.assertEqual(self.model_id(self.model_dir), first)
+        self.write("config.json", '{"hidden_size": 768}')
+        self.assertNotEqual(self.model_id(self.model_dir), first)
+
+
+class PlanSyncTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch("cohere_app.Chunking_UI.folder_sync.db_utility")
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.folder = os.path.join(directory.name, "docs")
+        os.makedirs(os.path.join(self.folder, "sub"))
+        self.db.fetch_file_manifest.return_value = {}
+        self.db.fetch_all_documents.return_value = []
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def entry(self, path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns, content_hash(path)
+
+    def test_added_modified_touched_and_deleted(self):
+        unchanged = self.write("unchanged.pdf", "same")
+        touched = self.write("sub/touched.pdf", "same bytes")
+        modified = self.write("modified.pdf", "new text")
+        added = self.write("added.pdf", "added")
+        self.write("notes.txt", "other extension")
+        gone = os.path.join(self.folder, "gone.pdf")
+        size, mtime_ns, file_hash = self.entry(touched)
+        self.db.fetch_file_manifest.return_value = {
+            unchanged: self.entry(unchanged),
+            touched: (size, mtime_ns - 1, file_hash),
+            modified: (3, 1, "old hash"),
+            gone: (1, 1, "hash"),
+        }
+        plan = plan_sync("docs", self.folder, ".pdf")
+        self.assertEqual((plan["added"], plan["modified"], plan["deleted"], plan["unchanged"]),
+                         ([added], [modified], [gone], 2))
+        self.assertEqual(sorted(plan["pending"]), sorted([added, modified]))
+        self.db.upsert_file_manifest.assert_called_once_with("docs", [(touched, *self.entry(touched))])
+
+    def test_first_sync_adopts_ingested_files_and_finds_removed_ones(self):
+        kept = self.write("kept.pdf", "kept")
+        removed = os.path.join(self.folder, "removed.pdf")
+        elsewhere = os.path.join(os.path.dirname(self.folder), "other", "elsewhere.pdf")
+        sibling = self.folder + "-old/sibling.pdf"
+        self.db.fetch_all_documents.return_value = [kept, removed, elsewhere, sibling]
+        plan = plan_sync("docs", self.folder, [".pdf"])
+        self.assertEqual((plan["added"], plan["modified"], plan["deleted"], plan["unchanged"]), ([], [], [removed], 1))
+        self.db.upsert_file_manifest.assert_called_once_with("docs", [(kept, *self.entry(kept))])
+
+    def test_files_of_another_folder_are_never_deleted(self):
+        kept = self.write("kept.pdf", "kept")
+        other_folder = os.path.join(os.path.dirname(self.folder), "other")
+        os.makedirs(other_folder)
+        other = os.path.join(other_folder, "x.pdf")
+        prefixed = self.folder + "-old/y.pdf"
+        self.db.fetch_file_manifest.return_value = {kept: self.entry(kept), other: (1, 1, "hash"), prefixed: (1, 1, "hash")}
+        self.db.fetch_all_documents.return_value = [kept, other, prefixed, os.path.join(other_folder, "z.pdf")]
+        plan = plan_sync("docs", self.folder, ".pdf")
+        self.assertEqual((plan["added"], plan["modified"], plan["deleted"], plan["unchanged"]), ([], [], [], 1))
+        plan = plan_sync("docs", other_folder, ".pdf")
+        self.assertEqual(plan["deleted"], [other, os.path.join(other_folder, "z.pdf")])
+
+
+class FileCatalogTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch("cohere_app.Chunking_UI.file_catalog.db_utility")
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db.file_catalog_exists.side_effect = lambda collection_name: collection_name != "old"
+        self.addCleanup(file_catalog._catalogs.clear)
+        self.scan_started = threading.Event()
+        self.release = threading.Event()
+
+    def slow_scan(self, collection_name):
+        self.scan_started.set()
+        self.release.wait(5)
+        return [("/data/a.pdf", "a.pdf", 3, 2, 10)]
+
+    def test_scan_of_one_collection_does_not_block_the_others(self):
+        with mock.patch("cohere_app.Chunking_UI.file_catalog.scan_collection", self.slow_scan):
+            scan = threading.Thread(target=file_catalog.ensure_file_catalog, args=("old",))
+            scan.start()
+            self.assertTrue(self.scan_started.wait(5))
+            other = threading.Thread(target=file_catalog.ensure_file_catalog, args=("new",))
+            other.start()
+            other.join(5)
+            self.assertFalse(other.is_alive())
+            self.assertIn("new", file_catalog._catalogs)
+            self.assertNotIn("old", file_catalog._catalogs)
+            self.release.set()
+            scan.join(5)
+        self.db.create_file_catalog.assert_called_once_with("old")
+        self.db.upsert_file_catalog.assert_called_once_with("old", [("/data/a.pdf", "a.pdf", 3, 2, 10)])
+        self.assertIn("old", file_catalog._catalogs)
+
+    def test_forget_checks_the_table_again(self):
+        file_catalog.ensure_file_catalog("new")
+        file_catalog.forget("new")
+        file_catalog.ensure_file_catalog("new")
+        self.assertEqual(self.db.file_catalog_exists.call_count, 2)
+
+
+def previous_guardrail_action(user_input):
+    """ The allow-list and forbidden pattern checks of api.py before GuardrailEngine """
+    for term in NEUTRAL_POSITIVE_TERMS:
+        if term.lower() in user_input.lower():
+            return "allow"
+    for pattern in FORBIDDEN_REGEX_PATTERNS:
+        if re.search(pattern, user_input, flags=re.IGNORECASE):
+            return "block"
+    return None
+
+
+class GuardrailEngineTests(SimpleTestCase):
+    # Words of the rules, cased and spelled with the characters whose lowercase differs from IGNORECASE
+    WORDS = ["kill", "KILL", "KİLL", "kİll", "ſcandal", "SCANDAL", "\u212aill", "Larsen and Toubro",
+             "LARSEN  AND TOUBRO", "l&t growth", "L&T CEO", "politics", "political", "hate", "whatever",
+             "assassination", "İ", "ı", "漢", "the", "of"]
+    SEPARATORS = [" ", "", ".", "\n", "-", "İ", "\u00a0"]
+
+    def random_queries(self, count, seed=0):
+        rng = random.Random(seed)
+        for _ in range(count):
+            parts = [rng.choice(self.WORDS) + rng.choice(self.SEPARATORS) for _ in range(rng.randint(1, 8))]
+            yield "".join(parts)
+
+    def test_matches_the_previous_checks(self):
+        engine = GuardrailEngine(rules_file="")
+        for query in self.random_queries(5000):
+            self.assertEqual(engine.check(query).action, previous_guardrail_action(query), msg=repr(query))
+
+    def test_non_ascii_case_variants_are_blocked(self):
+        engine = GuardrailEngine(rules_file="")
+        self.assertEqual(engine.check("how to KİLL a process"), ("block", r"\bkill\b"))
+        self.assertEqual(engine.check("the ſcandal"), ("block", r"\bscandal\b"))
+        self.assertEqual(engine.check("İstanbul office of Larsen and Toubro"), ("allow", "Larsen and Toubro"))
+        self.assertEqual(engine.check("İstanbul office").action, None)
+
+
+class CollectionBuilderTests(SimpleTestCase):
+
+    def setUp(self):
+        for name in ("Collection", "connections", "utility"):
+            patcher = mock.patch(f"cohere_app.Chunking_UI.collection_builder.{name}")
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.collection = self.Collection.return_value
+        self.collection.indexes = []
+
+    def test_new_collection_is_indexed_and_loaded(self):
+        self.utility.has_collection.return_value = False
+        CollectionBuilder(index_type="HNSW").get_or_create("docs", 384, "ingest")
+        self.assertEqual([c.args[0] for c in self.collection.create_index.call_args_list], ["vector", "source"])
+        self.collection.load.assert_called_once_with()
+
+    def test_existing_collection_gets_the_source_index_and_is_loaded(self):
+        self.utility.has_collection.return_value = True
+        CollectionBuilder(index_type="IVF_SQ8").get_or_create("docs", 384, "ingest")
+        self.assertEqual([c.args[0] for c in self.collection.create_index.call_args_list], ["source"])
+        self.collection.load.assert_called_once_with()
+
+
+class FakeOcrPool:
+    """ Runs OCR batches as "ocr <page>" at once; breaks on the submits of the documents in broken """
+
+    def __init__(self, broken):
+        self.broken = broken
+
+    def submit(self, fn, pdf_path, batch, dpi):
+        if pdf_path in self.broken:
+            self.broken.remove(pdf_path)
+            raise BrokenProcessPool("worker died")
+        future = Future()
+        future.set_result([(page_num, f"ocr {page_num}") for page_num in batch])
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class OcrEngineTests(SimpleTestCase):
+    DOCUMENTS = [("a.pdf", [(0, "text"), (1, "")]), ("b.pdf", [(0, "")]), ("c.pdf", [(0, "")])]
+
+    def engine(self, broken):
+        engine = OcrEngine(workers=1, batch_size=2)
+        pools = []
+
+        def new_pool():
+            if engine._pool is None:
+                engine._pool = FakeOcrPool(broken)
+                pools.append(engine._pool)
+            return engine._pool
+        engine._get_pool = new_pool
+        return engine, pools
+
+    def test_pool_broken_while_queuing_is_rebuilt_and_retried(self):
+        engine, pools = self.engine(["b.pdf"])
+        results = list(engine.fill_empty_pages_many(self.DOCUMENTS))
+        self.assertEqual(results, [
+            ("a.pdf", [(0, "text"), (1, "ocr 1")], None),
+            ("b.pdf", [(0, "ocr 0")], None),
+            ("c.pdf", [(0, "ocr 0")], None),
+        ])
+        self.assertEqual(len(pools), 2)
+
+    def test_only_the_document_that_breaks_the_new_pool_too_fails(self):
+        engine, pools = self.engine(["b.pdf", "b.pdf"])
+        results = list(engine.fill_empty_pages_many(self.DOCUMENTS))
+        self.assertEqual([(path, error is None) for path, _, error in results], [("a.pdf", True), ("b.pdf", False), ("c.pdf", True)])
+        self.assertEqual(results[1][1], [(0, "")])
+        self.assertEqual(results[2][1], [(0, "ocr 0")])
+        self.assertEqual(len(pools), 3)
+
+
+class FakePhraseEncoder:
+    """ A fixed random unit-ish vector per phrase, counting the phrases encoded """
+
+    def __init__(self, dim=16):
+        self.dim = dim
+        self.encoded = 0
+
+    def vector(self, phrase):
+        seed = int.from_bytes(hashlib.sha1(phrase.encode("utf-8")).digest()[:4], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+    def encode(self, phrases, batch_size=None):
+        self.encoded += len(phrases)
+        return np.stack([self.vector(phrase) for phrase in phrases])
+
+
+class ForbiddenBankTests(SimpleTestCase):
+    PHRASES = ["kill", "murder", "fraud", "bribery"]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.model = FakePhraseEncoder()
+
+    def bank(self, phrases=PHRASES, model=None, **kwargs):
+        return ForbiddenBank(phrases, model or self.model, "fake-model", directory=self.directory, **kwargs)
+
+    def test_saved_bank_is_loaded_without_encoding(self):
+        saved = self.bank()
+        self.assertEqual(self.model.encoded, len(self.PHRASES))
+        loaded = self.bank(model=mock.Mock(encode=mock.Mock(side_effect=AssertionError("re-encoded"))))
+        np.testing.assert_array_equal(loaded.matrix, saved.matrix)
+        self.assertEqual(loaded.best_match(self.model.vector("fraud"))[0], "fraud")
+
+    def test_unreadable_or_stale_file_is_encoded_again(self):
+        path = self.bank()._path()
+        with open(path, "wb") as f:
+            f.write(b"not a bank")
+        self.bank()
+        self.assertEqual(self.model.encoded, 2 * len(self.PHRASES))
+        with open(path, "wb") as f:
+            np.savez(f, matrix=np.zeros((1, 16), dtype=np.float32), order=np.arange(1), offsets=np.array([0, 1]),
+                     centroids=np.empty(0, dtype=np.float32))
+        self.assertEqual(self.bank().matrix.shape, (len(self.PHRASES), 16))
+        self.assertEqual(self.model.encoded, 3 * len(self.PHRASES))
+        # The bank re-encoded last replaced the stale file
+        self.bank(model=mock.Mock(encode=mock.Mock(side_effect=AssertionError("re-encoded"))))
+
+    def test_threshold_verdict(self):
+        bank = self.bank()
+        query = self.model.vector("murder") * 3
+        self.assertEqual(bank.best_match(query), ("murder", mock.ANY))
+        self.assertAlmostEqual(bank.best_match(query)[1], 1.0, places=5)
+        self.assertTrue(bank.matches(query, 0.7))
+        unrelated = self.model.vector("weather report")
+        self.assertLess(bank.best_match(unrelated)[1], 0.7)
+        self.assertFalse(bank.matches(unrelated, 0.7))
+
+    def test_clustered_bank_finds_the_phrase(self):
+        phrases = [f"phrase {i}" for i in range(3000)]
+        bank = self.bank(phrases, nprobe=1000)
+        self.assertIsNotNone(bank.centroids)
+        phrase, score = bank.best_match(self.model.vector("phrase 1234"), threshold=0.99)
+        self.assertEqual(phrase, "phrase 1234")
+        self.assertGreaterEqual(score, 0.99)
+
+
+class SessionStoreTests(SimpleTestCase):
+
+    def session(self, last_query):
+        session = new_session()
+        session['last_query'] = last_query
+        return session
+
+    def test_least_recently_used_session_is_evicted_at_the_cap(self):
+        store = MemorySessionStore(max_entries=2, ttl=60)
+        store.save("a", self.session("first"))
+        store.save("b", self.session("second"))
+        store.get("a")
+        store.save("c", self.session("third"))
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.get("a")['last_query'], "first")
+        self.assertEqual(store.get("c")['last_query'], "third")
+        self.assertEqual(store.stats()["evictions"], 1)
+
+    def test_idle_session_expires_after_the_ttl(self):
+        store = MemorySessionStore(max_entries=10, ttl=60)
+        with mock.patch("cohere_app.session_store.time.monotonic", return_value=1000.0):
+            store.save("a", self.session("question"))
+        with mock.patch("cohere_app.session_store.time.monotonic", return_value=1059.0):
+            self.assertEqual(store.get("a")['last_query'], "question")
+        with mock.patch("cohere_app.session_store.time.monotonic", return_value=1060.0):
+            self.assertIsNone(store.get("a"))
+        self.assertEqual(store.stats()["entries"], 0)
+
+    def test_callers_get_a_copy_to_save_back(self):
+        store = MemorySessionStore()
+        store.save("a", self.session("question"))
+        store.get("a")['current_index'] = 5
+        self.assertEqual(store.get("a")['current_index'], 0)
+
+    def test_backend_selection(self):
+        self.assertIsInstance(create_session_store("memory"), MemorySessionStore)
+        self.assertIsInstance(create_session_store("database"), DatabaseSessionStore)
+        with self.assertRaises(ValueError):
+            create_session_store("redis")
+
+    def test_database_backend_purges_every_purge_every_writes(self):
+        store = DatabaseSessionStore(purge_every=3)
+        with mock.patch("cohere_app.models.QASession") as sessions, mock.patch.object(store, "purge") as purge:
+            for system_id in range(7):
+                store.save(system_id, self.session("question"))
+        self.assertEqual(sessions.objects.update_or_create.call_count, 7)
+        self.assertEqual(purge.call_count, 2)
+
+
+class ContextAssemblerTests(SimpleTestCase):
+
+    def setUp(self):
+        # Token counts estimated from the length, as without LLM_TOKENIZER
+        patcher = mock.patch("cohere_app.context_assembler.llm_tokenizer", mock.Mock(get=lambda: None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rng = random.Random(0)
+        self.document = "".join(rng.choice("abcdefghij klmnop") for _ in range(3000))
+
+    def hit(self, pk, page, start, end, source="/data/manual.pdf"):
+        return {"pk": pk, "source": source, "page": page, "text": self.document[start:end]}
+
+    def test_hits_beyond_the_budget_or_max_chunks_are_cut(self):
+        hits = [self.hit(pk, str(pk), pk * 400, pk * 400 + 400) for pk in range(5)]
+        context, sources, consumed = ContextAssembler(budget=250, max_chunks=8, context_window=0).assemble(hits)
+        self.assertEqual((len(sources), consumed), (2, 2))
+        self.assertEqual(context.count("Text: "), 2)
+        _, sources, consumed = ContextAssembler(budget=10000, max_chunks=3, context_window=0).assemble(hits)
+        self.assertEqual((len(sources), consumed), (3, 3))
+        _, sources, consumed = ContextAssembler(budget=10000, max_chunks=8, context_window=0).assemble(hits, max_chunks=4)
+        self.assertEqual(consumed, 4)
+        # The best hit is used even when it alone is over the budget
+        _, sources, consumed = ContextAssembler(budget=10, max_chunks=8, context_window=0).assemble(hits)
+        self.assertEqual((len(sources), consumed), (1, 1))
+
+    def test_overlapping_chunks_of_a_page_are_merged(self):
+        hits = [self.hit(1, "1", 200, 600), self.hit(2, "1", 0, 400), self.hit(3, "2", 400, 800), self.hit(4, "1", 250, 350)]
+        assembler = ContextAssembler(budget=10000, context_window=0)
+        context, sources, consumed = assembler.assemble(hits)
+        self.assertEqual(consumed, 4)
+        self.assertEqual(sources, ["Source: /data/manual.pdf | Page: 1", "Source: /data/manual.pdf | Page: 2"])
+        self.assertIn("Text: " + self.document[0:600] + "\n---\n", context)
+        self.assertEqual(assembler.stats()["merged_hits"], 2)
+
+    def test_consumed_counts_merged_hits_for_continue(self):
+        hits = [self.hit(1, "1", 0, 400), self.hit(2, "2", 1000, 1400), self.hit(3, "1", 200, 600),
+                self.hit(4, "3", 0, 2000), self.hit(5, "4", 2000, 2100)]
+        assembler = ContextAssembler(budget=400, context_window=0)
+        context, sources, consumed = assembler.assemble(hits)
+        self.assertEqual(consumed, 3)
+        self.assertEqual(len(sources), 2)
+        self.assertNotIn(self.document[0:2000], context)
+        self.assertEqual(assembler.stats()["merged_hits"], 1)
+        # "continue" starts from the first hit left out
+        _, sources, consumed = assembler.assemble(hits[consumed:])
+        self.assertEqual((sources, consumed), (["Source: /data/manual.pdf | Page: 3"], 1))
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+    TEXTS = ["what is rag", "pump manual", "what is rag", "safety rules", "pump manual", "valve sizes"]
+
+    def encode_concurrently(self, batcher):
+        results, errors = [None] * len(self.TEXTS), [None] * len(self.TEXTS)
+
+        def ask(index):
+            try:
+                results[index] = batcher.encode(self.TEXTS[index])
+            except Exception as e:
+                errors[index] = e
+        threads = [threading.Thread(target=ask, args=(index,)) for index in range(len(self.TEXTS))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        return results, errors
+
+    def test_concurrent_calls_share_one_model_call(self):
+        model = mock.Mock()
+        model.encode.side_effect = lambda texts: np.array([[len(text), sum(map(ord, text))] for text in texts], dtype=np.float32)
+        # The batch is full once every caller is queued, long before the window ends
+        batcher = EmbeddingBatcher(model, window_ms=10000, max_batch_size=len(self.TEXTS))
+        results, errors = self.encode_concurrently(batcher)
+        self.assertEqual(errors, [None] * len(self.TEXTS))
+        model.encode.assert_called_once()
+        self.assertEqual(sorted(model.encode.call_args.args[0]), sorted(set(self.TEXTS)))
+        for text, vector in zip(self.TEXTS, results):
+            np.testing.assert_array_equal(vector, [len(text), sum(map(ord, text))])
+        self.assertEqual(batcher.stats(), {"batches": 1, "queries": 6, "average_batch_size": 6})
+
+    def test_model_error_reaches_every_caller(self):
+        model = mock.Mock()
+        model.encode.side_effect = RuntimeError("model unavailable")
+        batcher = EmbeddingBatcher(model, window_ms=10000, max_batch_size=len(self.TEXTS))
+        results, errors = self.encode_concurrently(batcher)
+        self.assertEqual([str(error) for error in errors], ["model unavailable"] * len(self.TEXTS))
+        model.encode.assert_called_once()
+        # The worker keeps serving after a failed batch
+        model.encode.side_effect = lambda texts: np.zeros((len(texts), 2), dtype=np.float32)
+        batcher.window = 0
+        np.testing.assert_array_equal(batcher.encode("again"), [0, 0])
@@ -3,6 +3,9 @@ from .views import *
 
 urlpatterns = [
     path('cohere/generate/', cohere_generate, name='cohere_generate'),
+    path('cohere/generate/stream/', cohere_generate_stream, name='cohere_generate_stream'),
+    path('cohere/llm-stats/', get_llm_stats, name='llm_stats'),
+    path('models/stats/', get_model_stats, name='model_stats'),
     path('history/', get_prompt_history, name='get_saved_prompts'),
     path('history/<str:session_id>/', get_session_history, name='get_session_history'),  
     path('login/', login_user, name='login'),
@@ -20,6 +23,9 @@ urlpatterns = [
     path('collections/file-delete/<path:source>/<str:collection_name>/', delete_file, name='delete_file'),
     path('collections/create_collection/', create_collection, name='create_collection'),
     path('collections/progress/', get_progress, name='get_progress'),
+    path('collections/progress/<str:job_id>/', get_job_progress, name='get_job_progress'),
+    path('collections/jobs/', list_ingest_jobs, name='list_ingest_jobs'),
+    path('collections/cache-stats/', get_retrieval_cache_stats, name='retrieval_cache_stats'),
     path("milvus-data/<str:collection_name>/", get_milvus_data, name="milvus-data"),
     path('current-using-collection/', get_current_using_collection, name='get-current-using-collection'),
     path("update-current-collection/", update_current_collection, name="update-current-collection"),
@@ -19,11 +19,25 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from asgiref.sync import sync_to_async
 from .models import PromptHistory, CurrentUsingCollection
 from .serializers import PromptHistorySerializer, CurrentUsingCollectionSerializer
-from .api import process_query, get_all_files_from_milvus, chat_with_uploaded_document
-from .Chunking_UI import file_process, db_utility
+from .api import process_query, chat_with_uploaded_document, aprocess_query, achat_with_uploaded_document, llm_client, forget_milvus_collection
+from .retrieval_cache import retrieval_cache
+from .lexical_index import lexical_index
+from .context_assembler import context_assembler
+from .reranker import reranker
+from .search_profiles import search_profiles
+from .session_store import session_store
+from .ingest_jobs import ingest_jobs
+from .faiss_cache import faiss_cache
+from .lazy_resource import LazyResource
+from .model_registry import model_registry
+from .Chunking_UI import file_process, db_utility, folder_sync, file_catalog
 from .Chunking_UI.enable_logging import logger
+from .Chunking_UI.ingest_pipeline import MAX_INGEST_WORKERS
 from urllib.parse import unquote
 from dotenv import load_dotenv
 from .ldap import auth_main
@@ -33,7 +47,7 @@ from django.contrib.auth.models import User
 load_dotenv()
 
 Milvus_url = os.getenv("MILVUS_URL")
-client = MilvusClient(uri= Milvus_url, token="root:Milvus")
+milvus_client = LazyResource("milvus_client", lambda: MilvusClient(uri= Milvus_url, token="root:Milvus"))
 progress_data = {"message": "Starting upload..."}
 
 PDF_DIRECTORY = config('PDF_DIRECTORY')
@@ -76,6 +90,7 @@ def logout_user(request):
         desktop_path = os.path.join(os.path.expanduser("~"), "Desktop", username)       
         if os.path.exists(desktop_path) and os.path.isdir(desktop_path):
             shutil.rmtree(desktop_path) 
+            faiss_cache.invalidate(username)
             print(f"Folder '{username}' deleted from Desktop.")
         else:
             print(f"No folder named '{username}' found on Desktop.")
@@ -164,6 +179,81 @@ def cohere_generate(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@csrf_exempt
+async def cohere_generate_stream(request):
+    """
+    Async variant of cohere_generate for the ASGI server (project.asgi). The answer is relayed
+    from the LLM on the event loop, so an open stream does not hold a worker thread.
+    """
+    if request.method != "POST":
+        return JsonResponse({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if auth is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+    user = auth[0]
+
+    try:
+        data = json.loads(request.body or b"{}")
+        prompt = data.get('prompt', '')
+        session_id = data.get('session_id') or str(uuid.uuid4())
+        file_names = data.get('file_names', [])
+        jwt_token = data.get('jwt_token', '')
+        mode = data.get("mode", "")
+        user_upload_file = data.get("useruploadfile", '')
+
+        prompt_history_entry = await PromptHistory.objects.acreate(
+            user=user,
+            session_id=session_id,
+            prompt=prompt,
+            response=""
+        )
+
+        async def response_stream():
+            collected_responses = []
+            if user_upload_file:
+                stream = achat_with_uploaded_document(user.username, prompt)
+            else:
+                stream = aprocess_query(prompt, mode, file_names, jwt_token)
+            # Each chunk is only pulled from the LLM once the client has taken the previous one
+            async for partial_response in stream:
+                collected_responses.append(partial_response)
+                yield partial_response
+            yield "      "  # Final padding chunk
+
+            prompt_history_entry.response = "\n".join(collected_responses)
+            await prompt_history_entry.asave(update_fields=["response"])
+
+        response = StreamingHttpResponse(
+            response_stream(),
+            content_type='text/plain',
+            status=status.HTTP_200_OK
+        )
+        response['X-History-ID'] = str(prompt_history_entry.id)
+        response['X-Session-ID'] = session_id
+        response['Access-Control-Allow-Origin'] = '*'
+        response['Access-Control-Expose-Headers'] = 'X-History-ID, X-Session-ID, X-File-Names, X-Page-Numbers'
+        return response
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_llm_stats(request):
+    """ Time to first token of recent LLM answers and the size of the contexts sent with them """
+    return JsonResponse({**llm_client.ttft_stats(), "context": context_assembler.stats()})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_model_stats(request):
+    """ Embedding models loaded in this process and the memory they took """
+    return JsonResponse(model_registry.stats())
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def file_upload_view(request):
@@ -173,6 +263,7 @@ def file_upload_view(request):
         temp_file.write(uploaded_file.read())           
         temp_file_path = temp_file.name
     faiss_response = file_process.create_faiss_index(temp_file_path,user_name)
+    faiss_cache.invalidate(user_name)
     return JsonResponse({"message": "File uploaded successfully","temp_file_path": temp_file_path,"faiss_response": faiss_response})
  
 @api_view(['GET'])
@@ -259,11 +350,37 @@ def mark_satisfied_or_unsatisfied(request, pk):
         return Response({"error": "Prompt history not found or unauthorized."}, status=status.HTTP_404_NOT_FOUND)
 
 
+def file_catalog_response(request, collection_name, key):
+    """
+    Files of collection_name from its catalog: {key: [paths], "catalog": [chunk, page and byte counts per file],
+    "total", "page", "next_page"}. ?prefix= filters by path or file name prefix; ?page= and ?page_size= page
+    through them, all files are returned without a page.
+    """
+    prefix = request.GET.get("prefix", "")
+    page = request.GET.get("page")
+    try:
+        page_size = min(int(request.GET.get("page_size", 100)), 1000)
+        page = int(page) if page is not None else None
+        if (page is not None and page < 1) or page_size < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({"error": "page and page_size must be positive integers"}, status=400)
+    entries, total = file_catalog.list_files(collection_name, prefix, page, page_size)
+    next_page = page + 1 if page is not None and page * page_size < total else None
+    return JsonResponse({key: [entry["document_name"] for entry in entries], "catalog": entries,
+                         "total": total, "page": page, "next_page": next_page}, status=200)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_files(request):
-    files = get_all_files_from_milvus()  
-    return JsonResponse({"files":files}) 
+    try:
+        current_collection = CurrentUsingCollection.objects.first()
+        if not current_collection or not current_collection.current_using_collection:
+            return JsonResponse({'error': 'No current collection found'}, status=404)
+        return file_catalog_response(request, current_collection.current_using_collection, "files")
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
 
 
 @api_view(['GET'])
@@ -354,7 +471,7 @@ def serve_file(request, filename, page_number):
 @permission_classes([IsAuthenticated])
 def get_collection_name(request):
     try:
-        collections = client.list_collections()
+        collections = milvus_client.get().list_collections()
         return JsonResponse({"collections": collections, 'username': request.user.username}, status=200)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
@@ -365,18 +482,7 @@ def get_collection_name(request):
 def collection_files(request, collection_name):
     if request.method == 'GET':
         try:
-            connections.connect("default", host=host, port= port)
-            collection = Collection(collection_name)
-            iterator = collection.query_iterator(batch_size=1000, output_fields=["source"])
-            results = []
-            while True:
-                result = iterator.next()
-                if not result:
-                    iterator.close()
-                    break
-                results.extend(result)
-            results = list(set([result['source'] for result in results]))
-            return JsonResponse({"results": results}, status=200)
+            return file_catalog_response(request, collection_name, "results")
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
     return JsonResponse({"error": "Invalid request method"}, status=405)
@@ -386,15 +492,22 @@ def collection_files(request, collection_name):
 @permission_classes([IsAuthenticated]) 
 def delete_collection(request, collection_name):
     try:
-        client.drop_collection(collection_name)
+        milvus_client.get().drop_collection(collection_name)
+        forget_milvus_collection(collection_name)
+        retrieval_cache.invalidate(collection_name)
+        lexical_index.drop(collection_name)
+        search_profiles.invalidate(collection_name)
         connection = db_utility.create_connection()
         cursor = connection.cursor()
         table_name = f"user_access_{collection_name}"
         drop_table_query = f"DROP TABLE IF EXISTS `{table_name}`;"  
         cursor.execute(drop_table_query)
+        cursor.execute(f"DROP TABLE IF EXISTS `file_manifest_{collection_name}`;")
+        cursor.execute(f"DROP TABLE IF EXISTS `file_catalog_{collection_name}`;")
         connection.commit()
         cursor.close()
         connection.close()        
+        file_catalog.forget(collection_name)
         return JsonResponse({"message": f"Collection '{collection_name}' deleted successfully."}, status=200)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
@@ -413,6 +526,8 @@ def delete_file(request, source, collection_name):
             decoded_source = urllib.parse.unquote(source)
             delete_expr = f"source == '{decoded_source}'" 
             result = collection.delete(expr=delete_expr)
+            retrieval_cache.invalidate(collection_name)
+            lexical_index.delete_sources(collection_name, [decoded_source])
             connection = db_utility.create_connection()
             cursor = connection.cursor()
             delete_row_query = f"DELETE FROM `user_access_{collection_name}` WHERE document_name = %s;"
@@ -420,6 +535,8 @@ def delete_file(request, source, collection_name):
             connection.commit()
             cursor.close()
             connection.close()
+            db_utility.delete_file_manifest(collection_name, [decoded_source])
+            file_catalog.remove_files(collection_name, [decoded_source])
             if result.delete_count > 0:
                 return JsonResponse({"message": f"All files with source '{source}' deleted successfully"}, status=200)
             else:
@@ -448,51 +565,108 @@ def find_files(root_dir, extensions):
                 found_files.append(filepath)
     return found_files
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def create_collection(request):
-    collection_name = request.data.get('name')
-    source = request.data.get('source')
-    if not collection_name or not source:
-        return JsonResponse({"error": "Collection name and source are required."}, status=400)
+
+def is_truthy(value):
+    """ Form posts send booleans as strings """
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def run_collection_ingest(job, collection_name, source, sync, workers):
+    """
+    Body of a background ingest job. Progress goes to the job and, for the existing
+    UI polling collections/progress/, to the global progress message as well.
+    """
+    def report(message):
+        job.message = message
+        set_progress_message(message)
+
     try:
-        logger.info(f"Starting collection creation for {collection_name}.")
-        start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if collection_name in client.list_collections():
-            logger.info(f"Collection {collection_name} already exists. Skipping creation.")
-            set_progress_message(f"Collection {collection_name} already exists. Skipping creation.")
-        else:
-            logger.info(f"Creating new collection: {collection_name}")
-        set_progress_message(f"Creating collection: {collection_name}")
+        ingest_collection(report, job, collection_name, source, sync, workers)
+    except Exception as e:
+        logger.error(f"Error during collection creation: {str(e)}")
+        set_progress_message(f"Error occurred: {str(e)}")
+        raise
+
 
-        already_chunked = db_utility.fetch_all_documents(collection_name)
-        file_extensions = config('EXTENSIONS')
+def ingest_collection(report, job, collection_name, source, sync, workers):
+    logger.info(f"Starting collection creation for {collection_name}.")
+    start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if collection_name in milvus_client.get().list_collections():
+        logger.info(f"Collection {collection_name} already exists. Skipping creation.")
+        report(f"Collection {collection_name} already exists. Skipping creation.")
+    else:
+        logger.info(f"Creating new collection: {collection_name}")
+    report(f"Creating collection: {collection_name}")
+
+    file_extensions = config('EXTENSIONS')
+    progress_generator = None
+    if sync:
+        # Incremental mode: diff the folder against the manifest, re-chunk changed files and drop deleted ones
+        plan = folder_sync.plan_sync(collection_name, source, file_extensions)
+        report(f"Sync: {len(plan['added'])} added, {len(plan['modified'])} modified, {len(plan['deleted'])} deleted, {plan['unchanged']} unchanged")
+        if plan['added'] or plan['modified'] or plan['deleted']:
+            progress_generator = folder_sync.apply_sync(collection_name, plan, workers=workers)
+    else:
+        already_chunked = set(db_utility.fetch_all_documents(collection_name))
         found_files = find_files(source, file_extensions)
 
-        needs_to_be_chunked = [file for file in found_files if file not in already_chunked]
-        needs_to_be_chunked = list(set(needs_to_be_chunked))
+        needs_to_be_chunked = list({file for file in found_files if file not in already_chunked})
         if needs_to_be_chunked:
-            progress_generator = file_process.create_langchain_documents(needs_to_be_chunked, collection_name)
+            progress_generator = file_process.create_langchain_documents(needs_to_be_chunked, collection_name, workers=workers)
 
+    if progress_generator:
+        try:
             for progress in progress_generator:
+                job.update(progress)
                 progress_message = f"Progress: {progress['current_progress']} Files completed /  Total files  {progress['total_files']}   -   {progress['progress_percentage']:.2f}%"
-                set_progress_message(progress_message)
+                report(progress_message)
+        finally:
+            # Even a partially completed ingest changes what a search can return
+            retrieval_cache.invalidate(collection_name)
 
-        else:
-            set_progress_message("No new files to process.")
-        
-        logger.info(f"File process completed.")
-        # Insert into chunking monitor
-        end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        insert_query_chunking_monitor = f"""
-            INSERT INTO chunking_monitor (start_time, completed_time, logging_file, chunked_folder, database_name)
-            VALUES ('{start_time}', '{end_time}', '{start_time}_logs.log','{collection_name}', '{source}')
-        """
-        db_utility.insert_chunking_monitor(insert_query_chunking_monitor)
-
-        set_progress_message(f"Collection {collection_name} created successfully.")
-        set_progress_message("Upload completed.")
-        return JsonResponse({"message": "Collection creation completed."}, status=200)
+    else:
+        report("No new files to process.")
+
+    logger.info(f"File process completed.")
+    # Insert into chunking monitor
+    end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    insert_query_chunking_monitor = f"""
+        INSERT INTO chunking_monitor (start_time, completed_time, logging_file, chunked_folder, database_name)
+        VALUES ('{start_time}', '{end_time}', '{start_time}_logs.log','{collection_name}', '{source}')
+    """
+    db_utility.insert_chunking_monitor(insert_query_chunking_monitor)
+
+    report(f"Collection {collection_name} created successfully.")
+    report("Upload completed.")
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_collection(request):
+    collection_name = request.data.get('name')
+    source = request.data.get('source')
+    if not collection_name or not source:
+        return JsonResponse({"error": "Collection name and source are required."}, status=400)
+    workers = request.data.get('workers')
+    if workers not in (None, ""):
+        try:
+            workers = int(workers)
+        except (TypeError, ValueError):
+            workers = 0
+        if workers < 1:
+            return JsonResponse({"error": "workers must be a positive integer."}, status=400)
+        workers = min(workers, MAX_INGEST_WORKERS)
+    else:
+        workers = None
+    try:
+        job = ingest_jobs.submit(
+            collection_name, source, run_collection_ingest,
+            collection_name, source, is_truthy(request.data.get('sync')), workers
+        )
+        if job is None:
+            return JsonResponse({"error": f"Collection {collection_name} is already being ingested."}, status=409)
+        set_progress_message(f"Queued collection: {collection_name}")
+        return JsonResponse({"message": "Collection creation started.", "job_id": job.job_id}, status=202)
 
     except Exception as e:
         logger.error(f"Error during collection creation: {str(e)}")
@@ -505,6 +679,32 @@ def create_collection(request):
 def get_progress(request):
     return JsonResponse(progress_data)
 
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_job_progress(request, job_id):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    return JsonResponse(job.to_dict())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def list_ingest_jobs(request):
+    return JsonResponse({"jobs": ingest_jobs.list_jobs()})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_retrieval_cache_stats(request):
+    stats = retrieval_cache.stats()
+    stats["sessions"] = session_store.stats()
+    stats["lexical"] = lexical_index.stats()
+    stats["reranker"] = reranker.stats()
+    stats["search_profiles"] = search_profiles.stats()
+    return JsonResponse(stats)
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated]) 
 def get_milvus_data(request, collection_name):